@@ -1,5 +1,7 @@
 import itertools
 
+import numpy as np
+
 
 class MultiStepActivation:
 
@@ -17,6 +19,12 @@ class MultiStepActivation:
         self.HighRiskpoolcorporate_clients = []
         self.corporate_clients = []
 
+        # bank of each depositor and client, and first row of each bank's depositors and clients
+        self.depositorBankIndex = np.zeros(0, dtype=int)
+        self.clientBankIndex = np.zeros(0, dtype=int)
+        self.bankDepositorRows = np.zeros(1, dtype=int)
+        self.bankClientRows = np.zeros(1, dtype=int)
+
     def add_central_bank(self, central_bank):
         self.central_bank = central_bank
 
@@ -24,6 +32,8 @@ class MultiStepActivation:
         self.clearing_house = clearing_house
 
     def add_bank(self, bank):
+        # dense position of the bank, used to address per-bank arrays
+        bank.bankIndex = len(self.banks)
         self.banks.append(bank)
 
     def add_depositor(self, depositor):
@@ -38,14 +48,38 @@ class MultiStepActivation:
     def add_corporate_client(self, corporate_client):
         self.corporate_clients.append(corporate_client)     
         
+    def index_populations(self):
+        # Banks are indexed as they are added; depositors and clients by their rows in the model's deposit
+        # and loan books, which are registered bank by bank. Depositors of bank b are then the rows
+        # bankDepositorRows[b]:bankDepositorRows[b + 1], and likewise for clients.
+        deposit_book, loan_book = self.model.depositBook, self.model.loanBook
+        number_banks = len(self.banks)
+        self.depositorBankIndex = deposit_book.bankIndex[:deposit_book.size].copy()
+        self.clientBankIndex = loan_book.bankIndex[:loan_book.size].copy()
+        self.bankDepositorRows = np.searchsorted(self.depositorBankIndex, np.arange(number_banks + 1))
+        self.bankClientRows = np.searchsorted(self.clientBankIndex, np.arange(number_banks + 1))
+
     @property
     def agents(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        # the loan ledger, if any, collects every loan before banks read them
+        ledger = [] if self.model.loanLedger is None else [self.model.loanLedger]
+        # ... and the bank-run cascade, if any, settles period 1 before the clearing house
+        cascade = [] if self.model.bankRunCascade is None else [self.model.bankRunCascade]
+        # depositors may act all at once, through the model's phase executor or depositor stage
+        if self.model.phaseExecutor is not None:
+            # ... the executor also takes care of the corporate clients
+            return itertools.chain([self.model.phaseExecutor], self.banks, [self.clearing_house],
+                                   [self.central_bank])
+        elif self.model.depositorStage is not None:
+            depositors = [self.model.depositorStage]
+        else:
+            depositors = self.depositors
+        if self.model.exogenousFactors.isMonetaryPolicyAvailable:
             # The order is important
-            return itertools.chain(self.depositors, self.banks, [self.clearing_house], [self.central_bank],
+            return itertools.chain(ledger, depositors, self.banks, cascade, [self.clearing_house], [self.central_bank],
                                    self.HighRiskpoolcorporate_clients, self.LowRiskpoolcorporate_clients)
         else:
-            return itertools.chain(self.depositors, self.banks, [self.clearing_house], [self.central_bank],
+            return itertools.chain(ledger, depositors, self.banks, cascade, [self.clearing_house], [self.central_bank],
                                self.corporate_clients)
         
     def reset_cycle(self):
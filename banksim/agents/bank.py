@@ -1,23 +1,31 @@
 from copy import copy
 
 import numpy as np
-from mesa import Agent
 
-from banksim.exogeneous_factors import BankSizeDistribution, ExogenousFactors
+from banksim.base import Agent
+from banksim.deposit_book import DepositBook
+from banksim.exogeneous_factors import BankSizeDistribution
+from banksim.fire_sale import FireSale
+from banksim.loan_book import LoanBook
 from banksim.strategies.bank_ewa_strategy import BankEWAStrategy
-from banksim.util import Util
+from banksim.strategies.strategy_support import StrategySupport
 
 
 class Bank(Agent):
+    # balance sheet account of each loan-book segment
+    loanBookAccounts = {LoanBook.STANDARD: 'nonFinancialSectorLoan',
+                        LoanBook.LOW_RISK: 'nonFinancialSectorLoanLowRisk',
+                        LoanBook.HIGH_RISK: 'nonFinancialSectorLoanHighRisk'}
 
     def __init__(self, bank_size_distribution, is_intelligent, ewa_damping_factor, model):
-        super().__init__(Util.get_unique_id(), model)
+        super().__init__(model.next_id(), model)
+        self.bankIndex = None  # set by the scheduler
+        factors = model.exogenousFactors
 
         self.initialSize = 1 if bank_size_distribution != BankSizeDistribution.LogNormal \
-            else Util.get_random_log_normal(-0.5, 1)
+            else self.random.get_random_log_normal(-0.5, 1)
 
         self.interbankHelper = InterbankHelper()
-        self.guaranteeHelper = GuaranteeHelper()
         self.depositors = []  # Depositors
         self.LowRiskpoolcorporateClients = []  # Banks choose the total quantity of low risk clients from here
         self.HighRiskpoolcorporateClients = [] # Banks choose the total quantity of high risk clients from here
@@ -34,47 +42,53 @@ class Bank(Agent):
         self.liquidityNeeds = 0
         self.bankRunOccurred = False
         self.withdrawalsCounter = 0
+        self.isLiquidated = False
 
-        self.balanceSheet = BalanceSheet()
+        self.balanceSheet = BalanceSheet(factors.isMonetaryPolicyAvailable)
         self.auxBalanceSheet = None
 
         self.isIntelligent = is_intelligent
         if self.isIntelligent:
-            self.strategiesOptionsInformation = BankEWAStrategy.bank_ewa_strategy_list()
+            grids = (factors.bankAlphaGrid, factors.bankBetaGrid, factors.bankGammaGrid)
+            self.strategiesOptionsInformation = BankEWAStrategy.bank_ewa_strategy_list(*grids)
+            self.strategySupport = StrategySupport(
+                self.strategiesOptionsInformation, 0.9999, 'strategyProfitPercentageDamped',
+                is_pruning_active=factors.isStrategyPruningActive,
+                probability_threshold=factors.strategyPruningProbabilityThreshold,
+                patience=factors.strategyPruningPatience,
+                reexpansion_interval=factors.strategyPruningReexpansionInterval,
+                exploration_size=factors.strategyPruningExplorationSize,
+                shape=BankEWAStrategy.grid_shape(*grids),
+                coarse_stride=factors.coarseGridStride if factors.isCoarseToFineLearningActive else 1,
+                refinement_interval=factors.gridRefinementInterval,
+                refinement_top=factors.gridRefinementTopStrategies,
+                rng=self.random.generator)
             self.currentlyChosenStrategy = None
             self.EWADampingFactor = ewa_damping_factor
 
     def update_strategy_choice_probability(self):
-        list_a = np.array([0.9999 * s.A + s.strategyProfitPercentageDamped for s \
-                           in self.strategiesOptionsInformation])
-        _exp = np.exp(list_a)
-        list_p = _exp / np.sum(_exp)
-        list_f = np.cumsum(list_p)
-        for i, strategy in enumerate(self.strategiesOptionsInformation):
-            strategy.A, strategy.P, strategy.F = list_a[i], list_p[i], list_f[i]
+        # only the active support is exponentiated and normalized (the whole grid if pruning is off)
+        self.strategySupport.update()
 
-    
     def pick_new_strategy(self):
-        probability_threshold = Util.get_random_uniform(1)
-        self.currentlyChosenStrategy = [s for s in self.strategiesOptionsInformation if s.F > \
-                                            probability_threshold][0]    
+        probability_threshold = self.random.get_random_uniform(1)
+        self.currentlyChosenStrategy = self.strategySupport.pick(probability_threshold)
             
     def reset(self):
         self.liquidityNeeds = 0
         self.bankRunOccurred = False
         self.withdrawalsCounter = 0
+        self.isLiquidated = False
         self.risk_appetite = 0
         
-    def reset_collateral(self):
-        self.guaranteeHelper = GuaranteeHelper()
-    
     def choose_corporateClient(self, strategy=None):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        factors = self.model.exogenousFactors
+        if factors.isMonetaryPolicyAvailable:
             if strategy is None:
                 strategy = self.currentlyChosenStrategy
                 risk_appetite = self.currentlyChosenStrategy.get_gamma_value()
-                self.quantityHighRiskcorporateClients = int(ExogenousFactors.numberCorporateClientsPerBank * risk_appetite)                                          
-                self.quantityLowRiskcorporateClients = ExogenousFactors.numberCorporateClientsPerBank - self.quantityHighRiskcorporateClients
+                self.quantityHighRiskcorporateClients = int(factors.numberCorporateClientsPerBank * risk_appetite)                                          
+                self.quantityLowRiskcorporateClients = factors.numberCorporateClientsPerBank - self.quantityHighRiskcorporateClients
                 self.HighRiskcorporateClients = self.HighRiskpoolcorporateClients[0:self.quantityHighRiskcorporateClients+1]   
                 self.LowRiskcorporateClients = self.LowRiskpoolcorporateClients[0:self.quantityLowRiskcorporateClients+1]
          
@@ -82,7 +96,7 @@ class Bank(Agent):
         if strategy is None:
             strategy = self.currentlyChosenStrategy
         self.balanceSheet.liquidAssets = self.initialSize * strategy.get_beta_value()
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        if self.model.exogenousFactors.isMonetaryPolicyAvailable:
             self.balanceSheet.nonFinancialSectorLoanHighRisk = (self.initialSize - self.balanceSheet.liquidAssets)*self.risk_appetite                                                   
             self.balanceSheet.nonFinancialSectorLoanLowRisk = self.initialSize - self.balanceSheet.liquidAssets - self.balanceSheet.nonFinancialSectorLoanHighRisk
         else:
@@ -94,7 +108,7 @@ class Bank(Agent):
         self.setup_balance_sheet()        
         
     def setup_balance_sheet(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        if self.model.exogenousFactors.isMonetaryPolicyAvailable:
             loan_per_coporate_clientLowRisk = self.balanceSheet.nonFinancialSectorLoanLowRisk/len(self.LowRiskcorporateClients) if len(self.LowRiskcorporateClients)!= 0 else 0
             loan_per_coporate_clientHighRisk = self.balanceSheet.nonFinancialSectorLoanHighRisk/len(self.HighRiskcorporateClients) if len(self.HighRiskcorporateClients)!=0 else 0
      
@@ -110,82 +124,120 @@ class Bank(Agent):
                 corporateClient.loanAmount = loan_per_coporate_client
             
         deposit_per_depositor = -self.balanceSheet.deposits / len(self.depositors)
-        for depositor in self.depositors:
-            depositor.make_deposit(deposit_per_depositor)
+        self.model.depositBook.make_deposits(DepositBook.rows(self.depositors), deposit_per_depositor)
+        if self.model.loanLedger is not None:
+            # outstanding loans of former cycles are carried over
+            self.model.loanLedger.originate(self)
     
     def get_capital_adequacy_ratio(self):
+        factors = self.model.exogenousFactors
         if self.is_solvent():
             rwa = self.get_real_sector_risk_weighted_assets()
-            total_risk_weighted_assets = self.balanceSheet.liquidAssets * ExogenousFactors.CashRiskWeight + rwa
+            total_risk_weighted_assets = self.balanceSheet.liquidAssets * factors.CashRiskWeight + rwa
             
             if self.is_interbank_creditor():
-                total_risk_weighted_assets += self.balanceSheet.interbankLoan * ExogenousFactors.InterbankLoanRiskWeight
+                total_risk_weighted_assets += self.balanceSheet.interbankLoan * factors.InterbankLoanRiskWeight
                 
             if total_risk_weighted_assets != 0:
                 return -self.balanceSheet.capital / total_risk_weighted_assets
         return 0
-    
+
+    @staticmethod
+    def get_capital_adequacy_ratios(banks):
+        factors = banks[0].model.exogenousFactors
+        # Same as get_capital_adequacy_ratio, for all banks at once
+        sheets = [bank.balanceSheet for bank in banks]
+        liquid_assets = np.array([_.liquidAssets for _ in sheets])
+        interbank_loans = np.array([_.interbankLoan for _ in sheets])
+        capital = np.array([_.capital for _ in sheets])
+
+        total_risk_weighted_assets = liquid_assets * factors.CashRiskWeight + \
+            Bank.get_real_sector_risk_weighted_assets_all(banks) + \
+            np.where(interbank_loans >= 0, interbank_loans * factors.InterbankLoanRiskWeight, 0)
+
+        capital_adequacy_ratios = np.zeros(len(banks))
+        feasible = (capital <= 0) & (total_risk_weighted_assets != 0)
+        capital_adequacy_ratios[feasible] = -capital[feasible] / total_risk_weighted_assets[feasible]
+        return capital_adequacy_ratios
+
+    def loan_book_segments(self):
+        # segment, balance sheet account and chosen clients of each loan-book segment in use
+        if self.model.exogenousFactors.isMonetaryPolicyAvailable:
+            return ((LoanBook.LOW_RISK, 'nonFinancialSectorLoanLowRisk', self.LowRiskcorporateClients),
+                    (LoanBook.HIGH_RISK, 'nonFinancialSectorLoanHighRisk', self.HighRiskcorporateClients))
+        return ((LoanBook.STANDARD, 'nonFinancialSectorLoan', self.corporateClients),)
+
     def adjust_capital_ratio(self, minimum_capital_ratio_required):
         current_capital_ratio = self.get_capital_adequacy_ratio()
-        
-        if ExogenousFactors.isMonetaryPolicyAvailable: 
-        
-            if current_capital_ratio <= minimum_capital_ratio_required:
-                adjustment_factor = current_capital_ratio / minimum_capital_ratio_required
-            
-                for corporateClient in self.LowRiskcorporateClients:
-                    original_loan_amount = corporateClient.loanAmount
-                    new_loan_amount = original_loan_amount * adjustment_factor
-                    corporateClient.loanAmount = new_loan_amount
-                    self.balanceSheet.liquidAssets += (original_loan_amount - new_loan_amount)
-                
-                for corporateClient in self.HighRiskcorporateClients:
-                    original_loan_amount2 = corporateClient.loanAmount
-                    new_loan_amount2 = original_loan_amount2 * adjustment_factor
-                    corporateClient.loanAmount = new_loan_amount2
-                    self.balanceSheet.liquidAssets += (original_loan_amount2 - new_loan_amount2)
-
-                 self.update_non_financial_sector_loans()
-
-         else:
-            if current_capital_ratio <= minimum_capital_ratio_required:
-                adjustment_factor = current_capital_ratio / minimum_capital_ratio_required
-                for corporateClient in self.corporateClients:
-                    original_loan_amount = corporateClient.loanAmount
-                    new_loan_amount = original_loan_amount * adjustment_factor
-                    corporateClient.loanAmount = new_loan_amount
-                    self.balanceSheet.liquidAssets += (original_loan_amount - new_loan_amount)
-
-                self.update_non_financial_sector_loans()
-                
+
+        if current_capital_ratio <= minimum_capital_ratio_required:
+            adjustment_factor = current_capital_ratio / minimum_capital_ratio_required
+            loan_amounts = self.model.loanBook.loanAmounts
+            for _, _, clients in self.loan_book_segments():
+                rows = LoanBook.rows(clients)
+                original_loan_amount = np.sum(loan_amounts[rows])
+                loan_amounts[rows] *= adjustment_factor
+                self.balanceSheet.liquidAssets += original_loan_amount * (1 - adjustment_factor)
+
+            self.update_non_financial_sector_loans()
+
+    @staticmethod
+    def deleverage(banks, adjustment_factors):
+        # Same as adjust_capital_ratio, for all banks at once: every loan of bank i is scaled by
+        # adjustment_factors[i] and the amount no longer lent goes back to liquid assets.
+        loan_book = banks[0].model.loanBook
+        number_banks = len(banks[0].model.schedule.banks)
+        bank_indices = np.array([bank.bankIndex for bank in banks])
+
+        factors = np.ones(number_banks)
+        factors[bank_indices] = adjustment_factors
+        original_loans = loan_book.segment_totals(number_banks)
+        loan_book.scale_banks(factors)
+        resulting_loans = original_loans * factors[:, np.newaxis]
+        freed_liquidity = np.sum(original_loans - resulting_loans, axis=1)
+
+        for bank in banks:
+            i = bank.bankIndex
+            if factors[i] != 1:
+                bank.balanceSheet.liquidAssets += freed_liquidity[i]
+                for segment, account in Bank.loanBookAccounts.items():
+                    setattr(bank.balanceSheet, account, resulting_loans[i, segment])
+
     def update_non_financial_sector_loans(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
-            self.balanceSheet.nonFinancialSectorLoanLowRisk = sum(
-                client.loanAmount for client in self.LowRiskcorporateClients)
-            self.balanceSheet.nonFinancialSectorLoanHighRisk = sum(
-                client.loanAmount for client in self.HighRiskcorporateClients)
-        
-        else:
-            self.balanceSheet.nonFinancialSectorLoan = sum(
-            client.loanAmount for client in self.corporateClients)
+        loan_amounts = self.model.loanBook.loanAmounts
+        for _, account, clients in self.loan_book_segments():
+            setattr(self.balanceSheet, account, np.sum(loan_amounts[LoanBook.rows(clients)]))
         
     def get_real_sector_risk_weighted_assets(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
-            riskLow = self.balanceSheet.nonFinancialSectorLoanLowRisk * ExogenousFactors.LowRiskCorporateLoanRiskWeight
-            riskHigh = self.balanceSheet.nonFinancialSectorLoanHighRisk * ExogenousFactors.HighRiskCorporateLoanRiskWeight
+        factors = self.model.exogenousFactors
+        if factors.isMonetaryPolicyAvailable:
+            riskLow = self.balanceSheet.nonFinancialSectorLoanLowRisk * factors.LowRiskCorporateLoanRiskWeight
+            riskHigh = self.balanceSheet.nonFinancialSectorLoanHighRisk * factors.HighRiskCorporateLoanRiskWeight
             return riskLow + riskHigh
         else:
-            if ExogenousFactors.standardCorporateClients:
-            return self.balanceSheet.nonFinancialSectorLoan * ExogenousFactors.CorporateLoanRiskWeight
+            if factors.standardCorporateClients:
+                return self.balanceSheet.nonFinancialSectorLoan * factors.CorporateLoanRiskWeight
             else:
-                for corporateClient in self.corporateClients:
-                    if corporateClient.probabilityOfDefault == ExogenousFactors.retailCorporateClientDefaultRate:
-                        return corporateClient.loanAmount * ExogenousFactors.retailCorporateLoanRiskWeight
-                    elif corporateClient.probabilityOfDefault == ExogenousFactors.wholesaleCorporateClientDefaultRate:
-                        return corporateClient.loanAmount * ExogenousFactors.wholesaleCorporateLoanRiskWeight
-                    else:
-                        # default risk weight
-                        return corporateClient.loanAmount * ExogenousFactors.CorporateLoanRiskWeight
+                # each client's loan weighted by its own (retail, wholesale or default) risk weight
+                loan_book = self.model.loanBook
+                rows = LoanBook.rows(self.corporateClients)
+                return np.dot(loan_book.loanAmounts[rows], loan_book.riskWeight[rows])
+
+    @staticmethod
+    def get_real_sector_risk_weighted_assets_all(banks):
+        factors = banks[0].model.exogenousFactors
+        sheets = [bank.balanceSheet for bank in banks]
+        if factors.isMonetaryPolicyAvailable:
+            return np.array([_.nonFinancialSectorLoanLowRisk for _ in sheets]) * \
+                factors.LowRiskCorporateLoanRiskWeight + \
+                np.array([_.nonFinancialSectorLoanHighRisk for _ in sheets]) * \
+                factors.HighRiskCorporateLoanRiskWeight
+        elif factors.standardCorporateClients:
+            return np.array([_.nonFinancialSectorLoan for _ in sheets]) * factors.CorporateLoanRiskWeight
+        else:
+            model = banks[0].model
+            weighted_loans = model.loanBook.segment_totals(len(model.schedule.banks), weighted=True)
+            return weighted_loans[[bank.bankIndex for bank in banks], LoanBook.STANDARD]
         
     def withdraw_deposit(self, amount_to_withdraw):
         if amount_to_withdraw > 0:
@@ -203,18 +255,23 @@ class Bank(Agent):
             self.balanceSheet.deposits += total_paid
 
     def accrue_interest_balance_sheet(self):
-        self.balanceSheet.discountWindowLoan *= (1 + ExogenousFactors.centralBankLendingInterestRate)
+        self.balanceSheet.discountWindowLoan *= (1 + self.model.schedule.central_bank.centralBankLendingInterestRate)
         self.balanceSheet.liquidAssets *= (1 + self.model.liquidAssetsInterestRate)
         self.calculate_deposits_interest()
 
     def calculate_deposits_interest(self):
         deposits_interest_rate = 1 + self.model.depositInterestRate
         self.balanceSheet.deposits *= deposits_interest_rate
-        for depositor in self.depositors:
-            depositor.deposit.amount *= deposits_interest_rate
+        self.model.depositBook.scale(DepositBook.rows(self.depositors), deposits_interest_rate)
     
     def collect_loans(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        if self.model.loanLedger is not None:
+            # already collected by the model's loan ledger, which also set the loan accounts
+            pass
+        elif self.model.phaseExecutor is not None:
+            # already collected by the model's phase executor
+            self.update_non_financial_sector_loans()
+        elif self.model.exogenousFactors.isMonetaryPolicyAvailable:
             self.balanceSheet.nonFinancialSectorLoanLowRisk = sum(
                 client.pay_loan_back() for client in self.LowRiskcorporateClients)
         
@@ -240,89 +297,22 @@ class Bank(Agent):
         self.liquidityNeeds -= amount
     
     def use_non_liquid_assets_to_pay_depositors_back(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
-            if self.needs_liquidity():
-                total_loans = self.balanceSheet.nonFinancialSectorLoanLowRisk + self.balanceSheet.nonFinancialSectorLoanHighRisk
-                liquidity_needed = -self.liquidityNeeds
-                total_loans_to_sell = liquidity_needed * (1 + ExogenousFactors.illiquidAssetDiscountRate)
-            
-                if total_loans > total_loans_to_sell:
-                
-                    # Firstly, banks sell their less risky loans because it is easier to find buyers.
-                    if self.balanceSheet.nonFinancialSectorLoanLowRisk >= total_loans_to_sell:
-                        amount_sold = total_loans_to_sell
-                        self.liquidityNeeds = 0
-                        self.balanceSheet.deposits += liquidity_needed
-                    
-                        proportion_of_illiquid_assets_sold = amount_sold / self.balanceSheet.nonFinancialSectorLoanLowRisk
-                   
-                        for firm in self.LowRiskcorporateClients:
-                            firm.loanAmount *= 1 - proportion_of_illiquid_assets_sold
-                
-                        self.balanceSheet.nonFinancialSectorLoanLowRisk -= amount_sold
-                
-                    # If not enough, banks will sell their total amount of less risky loans and part of (or the totality of) their more risky loans.
-                    else:
-                        x = total_loans_to_sell - self.balanceSheet.nonFinancialSectorLoanLowRisk
-                        amount_sold = self.balanceSheet.nonFinancialSectorLoanLowRisk + (self.balanceSheet.nonFinancialSectorLoanHighRisk - x)
-                    
-                        self.liquidityNeeds = 0
-                        self.balanceSheet.deposits += liquidity_needed
-                        proportion_of_illiquid_assets_sold_HighRisk = x / self.balanceSheet.nonFinancialSectorLoanHighRisk
-                                        
-                        for firm in self.LowRiskcorporateClients:
-                            firm.loanAmount *= 0
-                        for firm in self.HighRiskcorporateClients:
-                            firm.loanAmount *= (1 - proportion_of_illiquid_assets_sold_HighRisk)
-                        
-                        self.balanceSheet.nonFinancialSectorLoanLowRisk = 0
-                        self.balanceSheet.nonFinancialSectorLoanHighRisk -= x
-                
-            else:
-                amount_sold = total_loans
-                self.liquidityNeeds += amount_sold / (1 + ExogenousFactors.illiquidAssetDiscountRate)
-                self.balanceSheet.deposits += liquidity_needed - self.liquidityNeeds
-            
-                proportion_of_illiquid_assets_sold = amount_sold / total_loans
-                
-                for firm in self.LowRiskcorporateClients:
-                    firm.loanAmount *= 1 - proportion_of_illiquid_assets_sold  
-                for firm in self.HighRiskcorporateClients:
-                    firm.loanAmount *= 1 - proportion_of_illiquid_assets_sold
-            
-                self.balanceSheet.nonFinancialSectorLoanLowRisk = 0
-                self.balanceSheet.nonFinancialSectorLoanHighRisk = 0
-    
-        else:
-            if self.needs_liquidity():
-                liquidity_needed = -self.liquidityNeeds
-                total_loans_to_sell = liquidity_needed * (1 + ExogenousFactors.illiquidAssetDiscountRate)
-                if self.balanceSheet.nonFinancialSectorLoan > total_loans_to_sell:
-                    amount_sold = total_loans_to_sell
-                    self.liquidityNeeds = 0
-                    self.balanceSheet.deposits += liquidity_needed
-                else:
-                    amount_sold = self.balanceSheet.nonFinancialSectorLoan
-                    self.liquidityNeeds += amount_sold / (1 + ExogenousFactors.illiquidAssetDiscountRate)
-                    self.balanceSheet.deposits += liquidity_needed - self.liquidityNeeds
-                proportion_of_illiquid_assets_sold = amount_sold / self.balanceSheet.nonFinancialSectorLoan
-
-                for firm in self.corporateClients:
-                    firm.loanAmount *= 1 - proportion_of_illiquid_assets_sold
-                self.balanceSheet.nonFinancialSectorLoan -= amount_sold
+        # A fire sale of this bank alone. Loans of the other banks are marked to market only by the sale of
+        # every illiquid bank at once (see CentralBank.make_banks_sell_non_liquid_assets)
+        FireSale(mark_to_market=False, exogenous_factors=self.model.exogenousFactors).clear([self])
     
     def get_profit(self):
         resulting_capital = self.balanceSheet.assets + self.balanceSheet.liabilities
         original_capital = self.auxBalanceSheet.assets + self.auxBalanceSheet.liabilities
-        if ExogenousFactors.banksHaveLimitedLiability:
+        if self.model.exogenousFactors.banksHaveLimitedLiability:
             resulting_capital = max(resulting_capital, 0)
         return resulting_capital - original_capital
     
     def calculate_profit(self, minimum_capital_ratio_required):
         if self.isIntelligent:
-            if ExogenousFactors.isMonetaryPolicyAvailable:
+            if self.model.exogenousFactors.isMonetaryPolicyAvailable:
                 strategy = self.currentlyChosenStrategy
-                self.bankRunOccurred = (self.withdrawalsCounter > ExogenousFactors.numberDepositorsPerBank / 2)
+                self.bankRunOccurred = (self.withdrawalsCounter > len(self.depositors) / 2)
                 if self.bankRunOccurred:
                     original_loans = self.auxBalanceSheet.nonFinancialSectorLoanLowRisk + self.auxBalanceSheet.nonFinancialSectorLoanHighRisk
                     resulting_loans = self.balanceSheet.nonFinancialSectorLoanLowRisk + self.balanceSheet.nonFinancialSectorLoanHighRisk
@@ -336,7 +326,7 @@ class Bank(Agent):
 
                 strategy.strategyProfit = profit
 
-                if ExogenousFactors.isCapitalRequirementActive:
+                if self.model.exogenousFactors.isCapitalRequirementActive:
                     current_capital_ratio = self.get_capital_adequacy_ratio()
 
                     if current_capital_ratio < minimum_capital_ratio_required:
@@ -351,7 +341,7 @@ class Bank(Agent):
                 if self.isIntelligent:
                     strategy = self.currentlyChosenStrategy
 
-                    self.bankRunOccurred = (self.withdrawalsCounter > ExogenousFactors.numberDepositorsPerBank / 2)
+                    self.bankRunOccurred = (self.withdrawalsCounter > len(self.depositors) / 2)
 
                     if self.bankRunOccurred:
                         original_loans = self.auxBalanceSheet.nonFinancialSectorLoan
@@ -364,7 +354,7 @@ class Bank(Agent):
 
                     strategy.strategyProfit = profit
 
-                    if ExogenousFactors.isCapitalRequirementActive:
+                    if self.model.exogenousFactors.isCapitalRequirementActive:
                         current_capital_ratio = self.get_capital_adequacy_ratio()
 
                         if current_capital_ratio < minimum_capital_ratio_required:
@@ -376,7 +366,8 @@ class Bank(Agent):
                     strategy.strategyProfitPercentageDamped = strategy.strategyProfitPercentage * self.EWADampingFactor
     
     def liquidate(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        self.isLiquidated = True
+        if self.model.exogenousFactors.isMonetaryPolicyAvailable:
             #  first, sell assets...
             self.balanceSheet.liquidAssets += (self.balanceSheet.nonFinancialSectorLoanLowRisk + self.balanceSheet.nonFinancialSectorLoanHighRisk)
             self.balanceSheet.nonFinancialSectorLoanLowRisk = 0
@@ -411,9 +402,7 @@ class Bank(Agent):
         # ... finally, if there is any money left, it is proportionally divided among depositors.
         percentage_deposits_payable = self.balanceSheet.liquidAssets / np.absolute(self.balanceSheet.deposits)
         self.balanceSheet.deposits *= percentage_deposits_payable
-
-        for depositor in self.depositors:
-            depositor.deposit.amount *= percentage_deposits_payable
+        self.model.depositBook.scale(DepositBook.rows(self.depositors), percentage_deposits_payable)
 
         self.balanceSheet.liquidAssets = 0
 
@@ -431,8 +420,11 @@ class Bank(Agent):
     
     def period_0(self):
         if self.isIntelligent:
-            self.update_strategy_choice_probability()
-            self.pick_new_strategy()
+            executor = self.model.phaseExecutor
+            if executor is None or not executor.picksBankStrategies:
+                self.update_strategy_choice_probability()
+                self.pick_new_strategy()
+            # (otherwise already picked by the model's phase executor)
             self.choose_corporateClient()
             self.setup_balance_sheet_intelligent(self.currentlyChosenStrategy)
         else:
@@ -440,8 +432,9 @@ class Bank(Agent):
         self.auxBalanceSheet = copy(self.balanceSheet)
 
     def period_1(self):
-        # First, banks try to use liquid assets to pay early withdrawals...
-        self.use_liquid_assets_to_pay_depositors_back()
+        # First, banks try to use liquid assets to pay early withdrawals (as they come, with a BankRunCascade)...
+        if self.model.bankRunCascade is None:
+            self.use_liquid_assets_to_pay_depositors_back()
         # ... if needed, they will try interbank market by clearing house.
         # ... if banks still needs liquidity, central bank might rescue...
 
@@ -461,18 +454,12 @@ class InterbankHelper:
         self.amountLiquidityLeftToBorrowOrLend = 0
 
 
-class GuaranteeHelper:
-    def __init__(self):
-        self.potentialCollateral = 0
-        self.feasibleCollateral = 0
-        self.outstandingAmountImpact = 0
-        self.residual = 0
-        self.redistributedCollateral = 0
-        self.collateralAdjustment = 0
-
-
 class BalanceSheet:
-    def __init__(self):
+    accounts = ('deposits', 'discountWindowLoan', 'interbankLoan', 'nonFinancialSectorLoanLowRisk',
+                'nonFinancialSectorLoanHighRisk', 'nonFinancialSectorLoan', 'liquidAssets')
+
+    def __init__(self, is_monetary_policy_available=False):
+        self.isMonetaryPolicyAvailable = is_monetary_policy_available
         self.deposits = 0
         self.discountWindowLoan = 0
         self.interbankLoan = 0
@@ -483,7 +470,7 @@ class BalanceSheet:
 
     @property
     def capital(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        if self.isMonetaryPolicyAvailable:
             return -(self.liquidAssets +
                     self.nonFinancialSectorLoanLowRisk +
                     self.nonFinancialSectorLoanHighRisk +
@@ -499,7 +486,7 @@ class BalanceSheet:
 
     @property
     def assets(self):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        if self.isMonetaryPolicyAvailable:
             return self.liquidAssets + self.nonFinancialSectorLoanLowRisk + self.nonFinancialSectorLoanHighRisk + np.max(self.interbankLoan, 0)
         else:
             return self.liquidAssets + self.nonFinancialSectorLoan + np.max(self.interbankLoan, 0)
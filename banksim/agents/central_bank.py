@@ -1,16 +1,18 @@
 import numpy as np
-from mesa import Agent
 
-from banksim.exogeneous_factors import ExogenousFactors
+from banksim.agents.bank import Bank
+from banksim.base import Agent
+from banksim.fire_sale import FireSale
 from banksim.strategies.central_bank_ewa_strategy import CentralBankEWAStrategy
-from banksim.util import Util
+from banksim.strategies.strategy_support import StrategySupport
 
 
 class CentralBank(Agent):
 
     def __init__(self, central_bank_lending_interest_rate, offers_discount_window_lending,
                  minimum_capital_adequacy_ratio, is_intelligent, ewa_damping_factor, model):
-        super().__init__(Util.get_unique_id(), model)
+        super().__init__(model.next_id(), model)
+        factors = model.exogenousFactors
 
         self.centralBankLendingInterestRate = central_bank_lending_interest_rate
         self.offersDiscountWindowLending = offers_discount_window_lending
@@ -19,28 +21,43 @@ class CentralBank(Agent):
         self.insolvencyPerCycleCounter = 0
         self.insolvencyDueToContagionPerCycleCounter = 0
 
+        # Illiquid assets are sold by all banks together, at a price that depends on the total sold
+        self.fireSale = FireSale(exogenous_factors=factors)
+        self.fireSaleVolumePerCycle = 0
+
+        # Rates set by a policy rule, or the constants of the scenario
+        self.monetaryPolicy = None
+        if factors.isPolicyRateRuleActive:
+            from banksim.monetary_policy import MonetaryPolicy
+            self.monetaryPolicy = MonetaryPolicy(self)
+
         self.isIntelligent = is_intelligent
         if self.isIntelligent:
-            self.strategiesOptionsInformation = CentralBankEWAStrategy.central_bank_ewa_strategy_list()
+            self.strategiesOptionsInformation = CentralBankEWAStrategy.central_bank_ewa_strategy_list(
+                factors.centralBankAlphaGrid)
+            self.strategySupport = StrategySupport(
+                self.strategiesOptionsInformation, 0.9999, 'strategyProfit',
+                coarse_stride=factors.coarseGridStride if factors.isCoarseToFineLearningActive else 1,
+                refinement_interval=factors.gridRefinementInterval,
+                refinement_top=factors.gridRefinementTopStrategies)
             self.currentlyChosenStrategy = None
             self.EWADampingFactor = ewa_damping_factor
 
     def update_strategy_choice_probability(self):
-        list_a = np.array([0.9999 * s.A + s.strategyProfit for s in self.strategiesOptionsInformation])
-        _exp = np.exp(list_a)
-        list_p = _exp / np.sum(_exp)
-        list_f = np.cumsum(list_p)
-        for i, strategy in enumerate(self.strategiesOptionsInformation):
-            strategy.A, strategy.P, strategy.F = list_a[i], list_p[i], list_f[i]
+        self.strategySupport.update()
 
     def pick_new_strategy(self):
-        probability_threshold = Util.get_random_uniform(1)
-        self.currentlyChosenStrategy = [s for s in self.strategiesOptionsInformation if s.F > probability_threshold][0]
+        probability_threshold = self.random.get_random_uniform(1)
+        self.currentlyChosenStrategy = self.strategySupport.pick(probability_threshold)
                                                 
     def observe_banks_capital_adequacy(self, banks):
-        for bank in banks:
-            if bank.get_capital_adequacy_ratio() < self.minimumCapitalAdequacyRatio:
-                bank.adjust_capital_ratio(self.minimumCapitalAdequacyRatio)
+        # Basel enforcement for the whole banking system at once
+        capital_adequacy_ratios = Bank.get_capital_adequacy_ratios(banks)
+        undercapitalized = capital_adequacy_ratios < self.minimumCapitalAdequacyRatio
+        if np.any(undercapitalized):
+            adjustment_factors = np.where(undercapitalized,
+                                          capital_adequacy_ratios / self.minimumCapitalAdequacyRatio, 1)
+            Bank.deleverage(banks, adjustment_factors)
 
     def organize_discount_window_lending(self, banks):
         for bank in banks:
@@ -51,7 +68,7 @@ class CentralBank(Agent):
     def get_discount_window_lend(self, bank, amount_needed):
         # when should not bank be eligible for such loans?
         if self.offersDiscountWindowLending:
-            if ExogenousFactors.isTooBigToFailPolicyActive:
+            if self.model.exogenousFactors.isTooBigToFailPolicyActive:
                 if CentralBank.is_bank_too_big_to_fail(bank):
                     return min(amount_needed, 0)
                 else:
@@ -64,16 +81,14 @@ class CentralBank(Agent):
 
     @staticmethod
     def is_bank_too_big_to_fail(bank):
-        if ExogenousFactors.isTooBigToFailPolicyActive:
-            random_uniform = Util.get_random_uniform(1)
+        if bank.model.exogenousFactors.isTooBigToFailPolicyActive:
+            random_uniform = bank.random.get_random_uniform(1)
             return random_uniform < 2 * bank.marketShare
         return False
 
-    @staticmethod
-    def make_banks_sell_non_liquid_assets(banks):
-        for bank in banks:
-            if not bank.is_liquid():
-                bank.use_non_liquid_assets_to_pay_depositors_back()
+    def make_banks_sell_non_liquid_assets(self, banks):
+        self.fireSale.clear(banks)
+        self.fireSaleVolumePerCycle += self.fireSale.volume
 
     @staticmethod
     def bailout(bank):
@@ -85,13 +100,12 @@ class CentralBank(Agent):
             capital_shortfall = bank.balanceSheet.capital
             bank.balanceSheet.liquidAssets += capital_shortfall
 
-    @staticmethod
-    def punish_illiquidity(bank):
+    def punish_illiquidity(self, banks):
         # is there anything else to do?
-        bank.use_non_liquid_assets_to_pay_depositors_back()
+        self.make_banks_sell_non_liquid_assets(banks)
 
     def punish_insolvency(self, bank):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+        if self.model.exogenousFactors.isMonetaryPolicyAvailable:
             insolvency_penalty_LowRisk = 0.5
             insolvency_penalty_HighRisk = 0.8
         
@@ -111,14 +125,13 @@ class CentralBank(Agent):
         if self.isIntelligent:
             strategy = self.currentlyChosenStrategy
             strategy.numberInsolvencies = self.insolvencyPerCycleCounter
-            strategy.totalLoans = CentralBank.get_total_real_sector_loans(banks)
+            strategy.totalLoans = self.get_total_real_sector_loans(banks)
             potential_total_size = len(banks)
             ratio = strategy.totalLoans / potential_total_size
             strategy.strategyProfit = ratio - (potential_total_size * strategy.numberInsolvencies)
 
-    @staticmethod
-    def get_total_real_sector_loans(banks):
-        if ExogenousFactors.isMonetaryPolicyAvailable:
+    def get_total_real_sector_loans(self, banks):
+        if self.model.exogenousFactors.isMonetaryPolicyAvailable:
             return sum([bank.balanceSheet.nonFinancialSectorLoanLowRisk for bank in banks]) + sum([bank.balanceSheet.nonFinancialSectorLoanHighRisk for bank in banks])
         else:
              return sum([bank.balanceSheet.nonFinancialSectorLoan for bank in banks])  
@@ -136,13 +149,17 @@ class CentralBank(Agent):
     def reset(self):
         self.insolvencyPerCycleCounter = 0
         self.insolvencyDueToContagionPerCycleCounter = 0
+        self.fireSaleVolumePerCycle = 0
+        if self.monetaryPolicy is not None:
+            # rates of the cycle are announced before anyone acts
+            self.monetaryPolicy.set_rates(self.model.schedule.cycle)
 
     def period_0(self):
         if self.isIntelligent:
             self.update_strategy_choice_probability()
             self.pick_new_strategy()
             self.minimumCapitalAdequacyRatio = self.currentlyChosenStrategy.get_alpha_value()
-        if ExogenousFactors.isCapitalRequirementActive:
+        if self.model.exogenousFactors.isCapitalRequirementActive:
             self.observe_banks_capital_adequacy(self.banks)
 
     def period_1(self):
@@ -150,15 +167,16 @@ class CentralBank(Agent):
         if self.offersDiscountWindowLending:
             self.organize_discount_window_lending(self.banks)
         # ... if everything so far isn't enough, banks will sell illiquid assets at discount prices.
-        if ExogenousFactors.banksMaySellNonLiquidAssetsAtDiscountPrices:
-            CentralBank.make_banks_sell_non_liquid_assets(self.banks)
+        if self.model.exogenousFactors.banksMaySellNonLiquidAssetsAtDiscountPrices:
+            self.make_banks_sell_non_liquid_assets(self.banks)
 
     def period_2(self):
         for bank in self.banks:
             if CentralBank.is_bank_too_big_to_fail(bank):
                 CentralBank.bailout(bank)
-            if not bank.is_liquid():
-                CentralBank.punish_illiquidity(bank)
+        # banks still illiquid sell their loans all at once, before insolvencies are assessed
+        self.punish_illiquidity(self.banks)
+        for bank in self.banks:
             if not bank.is_solvent():
                 self.punish_insolvency(bank)
 
@@ -171,5 +189,12 @@ class CentralBank(Agent):
         self.calculate_final_utility(self.banks)
         CentralBank.liquidate_insolvent_banks(self.banks)
 
-        for depositor in self.model.schedule.depositors:
-            depositor.calculate_final_utility()
+        if self.monetaryPolicy is not None:
+            self.monetaryPolicy.observe(self.get_total_real_sector_loans(self.banks),
+                                        self.insolvencyPerCycleCounter, len(self.banks))
+
+        if self.model.depositorStage is not None:
+            self.model.depositorStage.calculate_final_utility()
+        else:
+            for depositor in self.model.schedule.depositors:
+                depositor.calculate_final_utility()
@@ -1,14 +1,14 @@
 import numpy as np
-from mesa import Agent
 
-from banksim.exogeneous_factors import ExogenousFactors, InterbankPriority
-from banksim.util import Util
+from banksim.base import Agent
+from banksim.exogeneous_factors import InterbankPriority
+from banksim.network_metrics import InterbankNetworkMetrics
 
 
 class ClearingHouse(Agent):
 
     def __init__(self, number_banks, clearing_guarantee_available, model):
-        super().__init__(Util.get_unique_id(), model)
+        super().__init__(model.next_id(), model)
         self.numberBanks = number_banks
         self.clearingGuaranteeAvailable = clearing_guarantee_available
 
@@ -17,12 +17,44 @@ class ClearingHouse(Agent):
         self.totalCollateralDeficit = 0
         self.totalCollateralSurplus = 0
 
-        self.interbankLendingMatrix = np.zeros((self.numberBanks, self.numberBanks))
+        # collateral of each bank, computed by organize_guarantees
+        self.potentialCollateral = np.zeros(self.numberBanks)
+        self.feasibleCollateral = np.zeros(self.numberBanks)
+        self.outstandingAmountImpact = np.zeros(self.numberBanks)
+        self.residualCollateral = np.zeros(self.numberBanks)
+        self.redistributedCollateral = np.zeros(self.numberBanks)
+        self.collateralAdjustment = np.zeros(self.numberBanks)
+
+        # the matrix is a view over a buffer that only grows (by doubling), see resize
+        self.interbankLendingBuffer = np.zeros((self.numberBanks, self.numberBanks))
+        self.interbankLendingMatrix = self.interbankLendingBuffer
         self.vetor_recuperacao = np.ones(self.numberBanks)
         # worst case scenario...
         self.banksNeedingLiquidity = list()
         self.banksOfferingLiquidity = list()
 
+        # (lender, borrower) pairs matched this cycle
+        self.interbankEdges = list()
+        self.networkMetrics = InterbankNetworkMetrics(self.numberBanks) \
+            if model.exogenousFactors.isInterbankNetworkMetricsActive else None
+
+    def resize(self, number_banks):
+        # New number of banks, between cycles. Interbank positions are rebuilt every cycle, so nothing needs
+        # to be moved: the matrix just covers more or fewer rows of its buffer.
+        if number_banks > len(self.interbankLendingBuffer):
+            capacity = max(number_banks, 2 * len(self.interbankLendingBuffer))
+            self.interbankLendingBuffer = np.zeros((capacity, capacity))
+        self.numberBanks = number_banks
+        self.interbankLendingMatrix = self.interbankLendingBuffer[:number_banks, :number_banks]
+        self.interbankLendingMatrix[:, :] = 0
+        self.vetor_recuperacao = np.ones(number_banks)
+        for name in ('potentialCollateral', 'feasibleCollateral', 'outstandingAmountImpact', 'residualCollateral',
+                     'redistributedCollateral', 'collateralAdjustment'):
+            setattr(self, name, np.zeros(number_banks))
+        if self.networkMetrics is not None:
+            self.networkMetrics.numberBanks = number_banks
+            self.networkMetrics.reset()
+
     def reset(self):
         self.interbankLendingMatrix[:, :] = 0
         self.reset_vetor_recuperacao()
@@ -32,6 +64,7 @@ class ClearingHouse(Agent):
         self.totalCollateralSurplus = 0
         self.banksNeedingLiquidity.clear()
         self.banksOfferingLiquidity.clear()
+        self.interbankEdges.clear()
 
     def reset_vetor_recuperacao(self):
         self.vetor_recuperacao[:] = 1
@@ -44,10 +77,18 @@ class ClearingHouse(Agent):
             else:
                 self.banksOfferingLiquidity.append(bank)
 
-        if ExogenousFactors.interbankPriority == InterbankPriority.Random:
-            np.random.shuffle(self.banksOfferingLiquidity)
-            np.random.shuffle(self.banksNeedingLiquidity)
-        elif ExogenousFactors.interbankPriority == InterbankPriority.RiskSorted:
+        common_random_numbers = self.model.commonRandomNumbers
+        interbank_priority = self.model.exogenousFactors.interbankPriority
+        if interbank_priority == InterbankPriority.Random and common_random_numbers is not None:
+            # the same random priority of each bank in every scenario
+            cycle = self.model.schedule.cycle
+            for queue, banks_in_queue in enumerate((self.banksOfferingLiquidity, self.banksNeedingLiquidity)):
+                keys = common_random_numbers.shuffle_keys(cycle, queue)
+                banks_in_queue.sort(key=lambda bank: keys[bank.bankIndex])
+        elif interbank_priority == InterbankPriority.Random:
+            self.random.generator.shuffle(self.banksOfferingLiquidity)
+            self.random.generator.shuffle(self.banksNeedingLiquidity)
+        elif interbank_priority == InterbankPriority.RiskSorted:
             self.sort_queues_by_risk(simulation, m, simulated_strategy)
 
         for i, bank in enumerate(self.banksOfferingLiquidity):
@@ -70,11 +111,10 @@ class ClearingHouse(Agent):
                     lender.interbankHelper.amountLiquidityLeftToBorrowOrLend -= amount_lent
                     borrower.interbankHelper.amountLiquidityLeftToBorrowOrLend += amount_lent
 
-                    lender_id = (lender.unique_id - self.numberBanks) % self.numberBanks
-                    borrower_id = (borrower.unique_id - self.numberBanks) % self.numberBanks
-
-                    self.interbankLendingMatrix[lender_id, borrower_id] = amount_lent
-                    self.interbankLendingMatrix[borrower_id, lender_id] = -amount_lent
+                    lender_index, borrower_index = lender.bankIndex, borrower.bankIndex
+                    self.interbankLendingMatrix[lender_index, borrower_index] = amount_lent
+                    self.interbankLendingMatrix[borrower_index, lender_index] = -amount_lent
+                    self.interbankEdges.append((lender_index, borrower_index))
 
                     if lender.interbankHelper.amountLiquidityLeftToBorrowOrLend == 0:
                         lender = next(iterator_lenders)
@@ -98,23 +138,22 @@ class ClearingHouse(Agent):
             bank.liquidityNeeds = bank.interbankHelper.amountLiquidityLeftToBorrowOrLend
 
     def get_interbank_market_position(self, bank):
-        bank_id_adjusted = (bank.unique_id - self.numberBanks) % self.numberBanks
-        return np.sum(self.interbankLendingMatrix[bank_id_adjusted, :])
+        return np.sum(self.interbankLendingMatrix[bank.bankIndex, :])
 
-    def sort_queues_by_risk(self, simulation, bank_id_simulating, strategy_simulated):
+    def sort_queues_by_risk(self, simulation, bank_index_simulating, strategy_simulated):
 
         def bank_to_alpha_beta_gamma(_bank):
             strategy = _bank.interbankHelper.riskSorting
             return strategy.get_alpha_value(), strategy.get_beta_value(), strategy.get_gamma_value() 
 
         for bank in self.banksOfferingLiquidity:
-            if simulation and bank.unique_id == bank_id_simulating:
+            if simulation and bank.bankIndex == bank_index_simulating:
                 bank.interbankHelper.riskSorting = strategy_simulated
             else:
                 bank.interbankHelper.riskSorting = bank.currentlyChosenStrategy
 
         for bank in self.banksNeedingLiquidity:
-            if simulation and bank.unique_id == bank_id_simulating:
+            if simulation and bank.bankIndex == bank_index_simulating:
                 bank.interbankHelper.riskSorting = strategy_simulated
             else:
                 bank.interbankHelper.riskSorting = bank.currentlyChosenStrategy
@@ -135,133 +174,67 @@ class ClearingHouse(Agent):
                 self.totalInterbankDebt = self.totalInterbankDebt - bank.balanceSheet.interbankLoan
 
     def organize_guarantees(self, banks):
-        if ExogenousFactors.isMonetaryPolicyAvailable: 
-            for bank in banks:
-                bank.reset_collateral()
-                if not bank.is_interbank_creditor():
-                    g_helper = bank.guaranteeHelper
-                    ratio = bank.balanceSheet.interbankLoan / self.totalInterbankDebt
-                    g_helper.potentialCollateral = self.biggestInterbankDebt * ratio
-                    # both assets can be used as collateral
-                    g_helper.feasibleCollateral = min(
-                        g_helper.potentialCollateral,
-                        bank.balanceSheet.liquidAssets + bank.balanceSheet.nonFinancialSectorLoanLowRisk +\
-                        +bank.balanceSheet.nonFinancialSectorLoanHighRisk)
-                    # minimize to avoid insolvent bank to use collateral
-                    g_helper.feasibleCollateral = min(
-                        g_helper.feasibleCollateral,
-                        max(0, -bank.balanceSheet.interbankLoan - min(0, bank.balanceSheet.capital)))
-
-                    # interbank debit balance impact
-                    g_helper.outstandingAmountImpact = max(
-                        0,
-                        min(
-                            bank.balanceSheet.capital + g_helper.feasibleCollateral,
-                            -bank.balanceSheet.interbankLoan))
-                    # residual collateral
-                    g_helper.residual = g_helper.feasibleCollateral - g_helper.outstandingAmountImpact
-
-            for bank in banks:
-
-                g_helper = bank.guaranteeHelper
-
-                # total of collateral deficit or surplus
-                if g_helper.residual < 0:
-                    self.totalCollateralDeficit += g_helper.residual
-                else:
-                    self.totalCollateralSurplus += g_helper.residual
-
-            for bank in banks:
-
-                g_helper = bank.guaranteeHelper
-
-                # residual collateral redistributed
-                if g_helper.residual < 0:
-                    g_helper.redistributedCollateral = g_helper.residual
-                elif self.totalCollateralSurplus == 0:
-                    g_helper.redistributedCollateral = 0
-                else:
-                    f = min(1.0, -self.totalCollateralDeficit / self.totalCollateralSurplus)
-                    g_helper.redistributedCollateral = (1 - f) * g_helper.residual
-
-                # final total collateral
-                g_helper.collateralAdjustment = g_helper.outstandingAmountImpact + g_helper.redistributedCollateral
-                collateral = g_helper.feasibleCollateral - g_helper.collateralAdjustment
-            
-                bank.balanceSheet.nonFinancialSectorLoanLowRisk += \
-                - max(0, collateral - bank.balanceSheet.liquidAssets)*0.5
-            
-                bank.balanceSheet.nonFinancialSectorLoanHighRisk += \
-                - max(0, collateral - bank.balanceSheet.liquidAssets)*0.5
-            
-                bank.balanceSheet.liquidAssets += -min(bank.balanceSheet.liquidAssets, collateral)
-
+        # Collateral of every interbank debtor, computed for all banks at once. Loans of the segments in use
+        # (see Bank.loan_book_segments) can be pledged besides liquid assets, in equal shares.
+        accounts = [account for _, account, _ in banks[0].loan_book_segments()]
+        sheets = [bank.balanceSheet for bank in banks]
+        liquid_assets = np.array([_.liquidAssets for _ in sheets], dtype=float)
+        loans = np.array([[getattr(_, account) for account in accounts] for _ in sheets], dtype=float)
+        interbank_loans = np.array([_.interbankLoan for _ in sheets], dtype=float)
+        capital = np.array([_.capital for _ in sheets], dtype=float)
+
+        debtors = interbank_loans < 0
+        self.potentialCollateral = np.zeros(len(banks))
+        self.feasibleCollateral = np.zeros(len(banks))
+        self.outstandingAmountImpact = np.zeros(len(banks))
+        self.residualCollateral = np.zeros(len(banks))
+
+        ratio = interbank_loans[debtors] / self.totalInterbankDebt
+        self.potentialCollateral[debtors] = self.biggestInterbankDebt * ratio
+        # both assets can be used as collateral
+        feasible = np.minimum(self.potentialCollateral[debtors], liquid_assets[debtors] + np.sum(loans[debtors], axis=1))
+        # minimize to avoid insolvent bank to use collateral
+        feasible = np.minimum(feasible, np.maximum(0, -interbank_loans[debtors] - np.minimum(0, capital[debtors])))
+        self.feasibleCollateral[debtors] = feasible
+        # interbank debit balance impact
+        self.outstandingAmountImpact[debtors] = np.maximum(0, np.minimum(capital[debtors] + feasible,
+                                                                         -interbank_loans[debtors]))
+        # residual collateral
+        self.residualCollateral = self.feasibleCollateral - self.outstandingAmountImpact
+
+        # total of collateral deficit or surplus
+        deficit = self.residualCollateral < 0
+        self.totalCollateralDeficit += np.sum(self.residualCollateral[deficit])
+        self.totalCollateralSurplus += np.sum(self.residualCollateral[~deficit])
+
+        # residual collateral redistributed
+        if self.totalCollateralSurplus == 0:
+            self.redistributedCollateral = np.where(deficit, self.residualCollateral, 0)
         else:
-            for bank in banks:
-                bank.reset_collateral()
-                if not bank.is_interbank_creditor():
-                    g_helper = bank.guaranteeHelper
-                    ratio = bank.balanceSheet.interbankLoan / self.totalInterbankDebt
-                    g_helper.potentialCollateral = self.biggestInterbankDebt * ratio
-                    # both assets can be used as collateral
-                    g_helper.feasibleCollateral = min(
-                        g_helper.potentialCollateral,
-                        bank.balanceSheet.liquidAssets + bank.balanceSheet.nonFinancialSectorLoan)
-                    # minimize to avoid insolvent bank to use collateral
-                    g_helper.feasibleCollateral = min(
-                        g_helper.feasibleCollateral,
-                        max(0, -bank.balanceSheet.interbankLoan - min(0, bank.balanceSheet.capital)))
-
-                    # interbank debit balance impact
-                    g_helper.outstandingAmountImpact = max(
-                        0,
-                        min(
-                            bank.balanceSheet.capital + g_helper.feasibleCollateral,
-                            -bank.balanceSheet.interbankLoan))
-                    # residual collateral
-                    g_helper.residual = g_helper.feasibleCollateral - g_helper.outstandingAmountImpact
-
-            for bank in banks:
-
-                g_helper = bank.guaranteeHelper
-
-                # total of collateral deficit or surplus
-                if g_helper.residual < 0:
-                    self.totalCollateralDeficit += g_helper.residual
-                else:
-                    self.totalCollateralSurplus += g_helper.residual
+            f = min(1.0, -self.totalCollateralDeficit / self.totalCollateralSurplus)
+            self.redistributedCollateral = np.where(deficit, self.residualCollateral, (1 - f) * self.residualCollateral)
 
-            for bank in banks:
+        # final total collateral
+        self.collateralAdjustment = self.outstandingAmountImpact + self.redistributedCollateral
+        collateral = self.feasibleCollateral - self.collateralAdjustment
+        loans -= np.maximum(0, collateral - liquid_assets)[:, np.newaxis] / len(accounts)
+        liquid_assets -= np.minimum(liquid_assets, collateral)
 
-                g_helper = bank.guaranteeHelper
+        for i, sheet in enumerate(sheets):
+            sheet.liquidAssets = liquid_assets[i]
+            for k, account in enumerate(accounts):
+                setattr(sheet, account, loans[i, k])
 
-                # residual collateral redistributed
-                if g_helper.residual < 0:
-                    g_helper.redistributedCollateral = g_helper.residual
-                elif self.totalCollateralSurplus == 0:
-                    g_helper.redistributedCollateral = 0
-                else:
-                    f = min(1.0, -self.totalCollateralDeficit / self.totalCollateralSurplus)
-                    g_helper.redistributedCollateral = (1 - f) * g_helper.residual
-
-                # final total collateral
-                g_helper.collateralAdjustment = g_helper.outstandingAmountImpact + g_helper.redistributedCollateral
-                collateral = g_helper.feasibleCollateral - g_helper.collateralAdjustment
-                bank.balanceSheet.nonFinancialSectorLoan += - max(0, collateral - bank.balanceSheet.liquidAssets)
-                bank.balanceSheet.liquidAssets += -min(bank.balanceSheet.liquidAssets, collateral)
-            
     def interbank_contagion(self, banks, central_bank):
         self.reset_vetor_recuperacao()
         for bank in banks:
-
-            bank_id = (bank.unique_id - self.numberBanks) % self.numberBanks
-
+            bank_index = bank.bankIndex
             if not bank.is_solvent() and bank.is_interbank_debtor():
                 if self.clearingGuaranteeAvailable:
                     _max = max(0, -self.totalCollateralDeficit - self.totalCollateralSurplus)
-                    self.vetor_recuperacao[bank_id] = (self.totalInterbankDebt + _max) / self.totalInterbankDebt
+                    self.vetor_recuperacao[bank_index] = (self.totalInterbankDebt + _max) / self.totalInterbankDebt
                 else:
-                    self.vetor_recuperacao[bank_id] = (bank.balanceSheet.interbankLoan + min(
+                    self.vetor_recuperacao[bank_index] = (bank.balanceSheet.interbankLoan + min(
                         -bank.balanceSheet.interbankLoan,
                         bank.balanceSheet.capital)) / bank.balanceSheet.interbankLoan
 
@@ -271,8 +244,7 @@ class ClearingHouse(Agent):
                 self.interbankLendingMatrix[j, i] = -self.interbankLendingMatrix[i, j]
 
         for bank in banks:
-            bank_id = (bank.unique_id - self.numberBanks) % self.numberBanks
-            bank.balanceSheet.interbankLoan = np.sum(self.interbankLendingMatrix[bank_id, :])
+            bank.balanceSheet.interbankLoan = self.get_interbank_market_position(bank)
             if bank.is_insolvent():
                 central_bank.punish_contagion_insolvency(bank)
 
@@ -281,14 +253,27 @@ class ClearingHouse(Agent):
         for bank in banks:
             bank.balanceSheet.interbankLoan = self.get_interbank_market_position(bank)
 
+    def update_network_metrics(self, banks):
+        edges = np.array(self.interbankEdges, dtype=int).reshape(-1, 2)
+        lenders, borrowers = edges[:, 0], edges[:, 1]
+        equity = np.zeros(self.numberBanks)
+        for bank in banks:
+            equity[bank.bankIndex] = -bank.balanceSheet.capital
+        self.networkMetrics.update(lenders, borrowers, self.interbankLendingMatrix[lenders, borrowers], equity)
+
     def period_0(self):
         pass
 
     def period_1(self):
         if self.model.interbankLendingMarketAvailable:
-            self.organize_interbank_market_common(self.model.schedule.banks)
+            if self.model.bankRunCascade is None:
+                # ... otherwise, interbank calls were already cleared as the cascade went
+                self.organize_interbank_market_common(self.model.schedule.banks)
             if self.clearingGuaranteeAvailable:
                 self.interbank_clearing_guarantee(self.model.schedule.banks)
 
     def period_2(self):
         self.accrue_interest(self.model.schedule.banks, self.model.interbankInterestRate)
+        if self.networkMetrics is not None:
+            # exposures before this cycle's contagion, so DebtRank measures its potential
+            self.update_network_metrics(self.model.schedule.banks)
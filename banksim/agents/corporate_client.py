@@ -1,31 +1,60 @@
-from mesa import Agent
-
-from banksim.util import Util
+from banksim.base import Agent
+from banksim.loan_book import LoanBook
 
 
 class CorporateClient(Agent):
 
-    def __init__(self, default_rate, loss_given_default, loan_interest_rate, bank, model):
-        super().__init__(Util.get_unique_id(), model)
+    def __init__(self, default_rate, loss_given_default, loan_interest_rate, bank, model,
+                 segment=LoanBook.STANDARD):
+        super().__init__(model.next_id(), model)
 
         # Bank Reference
         self.bank = bank
 
-        self.loanAmount = 0
         self.percentageRepaid = 0
 
         self.probabilityOfDefault = default_rate
         self.lossGivenDefault = loss_given_default
         self.loanInterestRate = loan_interest_rate
 
+        # The loan itself lives in the model's loan book
+        self.loanIndex = model.loanBook.add_client(bank.bankIndex, segment, self.get_risk_weight(segment))
+
+    @property
+    def loanAmount(self):
+        return self.model.loanBook.loanAmounts[self.loanIndex]
+
+    @loanAmount.setter
+    def loanAmount(self, amount):
+        self.model.loanBook.loanAmounts[self.loanIndex] = amount
+
+    def get_risk_weight(self, segment):
+        factors = self.model.exogenousFactors
+        if segment == LoanBook.LOW_RISK:
+            return factors.LowRiskCorporateLoanRiskWeight
+        elif segment == LoanBook.HIGH_RISK:
+            return factors.HighRiskCorporateLoanRiskWeight
+        elif factors.standardCorporateClients:
+            return factors.CorporateLoanRiskWeight
+        elif self.probabilityOfDefault == factors.retailCorporateClientDefaultRate:
+            return factors.retailCorporateLoanRiskWeight
+        elif self.probabilityOfDefault == factors.wholesaleCorporateClientDefaultRate:
+            return factors.wholesaleCorporateLoanRiskWeight
+        else:
+            # default risk weight
+            return factors.CorporateLoanRiskWeight
+
     def pay_loan_back(self, simulation=False):
         if simulation:
             # if under simulation, assume last percetageRepaid used
             amount_paid = self.percentageRepaid * self.loanAmount
         else:
+            common_random_numbers = self.model.commonRandomNumbers
+            uniform = self.random.get_random_uniform(1) if common_random_numbers is None \
+                else common_random_numbers.default_uniforms(self.model.schedule.cycle)[self.loanIndex]
             amount_paid = self.loanAmount * (1 - self.lossGivenDefault) \
-                if Util.get_random_uniform(1) <= self.probabilityOfDefault \
-                else self.loanAmount * (1 + self.loanInterestRate)
+                if uniform <= self.probabilityOfDefault \
+                else self.loanAmount * (1 + self.loanInterestRate + self.model.loanBook.interestRateShift)
             self.percentageRepaid = 0 if self.loanAmount == 0 else amount_paid / self.loanAmount
 
         self.loanAmount = amount_paid
@@ -1,17 +1,13 @@
-import math
-
-import numpy as np
-from mesa import Agent
-
-from banksim.exogeneous_factors import ExogenousFactors
+from banksim.base import Agent
+from banksim.deposit_book import Deposit
 from banksim.strategies.depositor_ewa_strategy import DepositorEWAStrategy
-from banksim.util import Util
+from banksim.strategies.strategy_support import StrategySupport
 
 
 class Depositor(Agent):
 
     def __init__(self, is_intelligent, ewa_damping_factor, bank, model):
-        super().__init__(Util.get_unique_id(), model)
+        super().__init__(model.next_id(), model)
 
         # Bank Reference
         self.bank = bank
@@ -20,44 +16,52 @@ class Depositor(Agent):
         self.amountFinalWithdraw = 0
         self.safetyTreshold = 0
 
-        self.initialDeposit = Deposit()
-        self.deposit = self.initialDeposit
+        # Row of this depositor in the model's deposit book
+        self.depositIndex = model.depositBook.add_depositor(bank.bankIndex)
+        self.initialDeposit = Deposit(model.depositBook, self.depositIndex, initial=True)
+        self.deposit = Deposit(model.depositBook, self.depositIndex)
 
+        factors = model.exogenousFactors
         self.isIntelligent = is_intelligent
-        if self.isIntelligent:
-            self.strategiesOptionsInformation = DepositorEWAStrategy.depositor_ewa_strategy_list()
+        # ... otherwise, every intelligent depositor learns in the model's IntelligentDepositorStage
+        if self.isIntelligent and not factors.isDepositorLearningVectorized:
+            self.strategiesOptionsInformation = DepositorEWAStrategy.depositor_ewa_strategy_list(
+                factors.depositorAlphaGrid)
+            self.strategySupport = StrategySupport(
+                self.strategiesOptionsInformation, 1, 'strategyProfit',
+                coarse_stride=factors.coarseGridStride if factors.isCoarseToFineLearningActive else 1,
+                refinement_interval=factors.gridRefinementInterval,
+                refinement_top=factors.gridRefinementTopStrategies)
             self.currentlyChosenStrategy = None
             self.EWADampingFactor = ewa_damping_factor
 
     def update_strategy_choice_probability(self):
-        list_a = np.array([s.A + s.strategyProfit for s in self.strategiesOptionsInformation])
-        _exp = np.exp(list_a)
-        list_p = _exp / np.sum(_exp)
-        list_f = np.cumsum(list_p)
-        for i, strategy in enumerate(self.strategiesOptionsInformation):
-            strategy.A, strategy.P, strategy.F = list_a[i], list_p[i], list_f[i]
+        self.strategySupport.update()
 
     def pick_new_strategy(self):
-        probability_threshold = Util.get_random_uniform(1)
-        self.currentlyChosenStrategy = [s for s in self.strategiesOptionsInformation if s.F > probability_threshold][0]
+        probability_threshold = self.random.get_random_uniform(1)
+        self.currentlyChosenStrategy = self.strategySupport.pick(probability_threshold)
 
     def make_deposit(self, amount):
-        self.initialDeposit.amount = amount
-        self.deposit = Deposit(amount, self.initialDeposit.lastPercentageWithdrawn)
+        # Same as Bank.setup_balance_sheet does for all its depositors at once
+        self.model.depositBook.make_deposits(self.depositIndex, amount)
 
     def withdraw_deposit(self, simulation=False):
+        factors = self.model.exogenousFactors
         if self.isIntelligent:
             # Smart depositor
             bank_car = self.bank.get_capital_adequacy_ratio()
-            shock = 0 if bank_car > self.safetyTreshold else ExogenousFactors.amountWithdrawn
+            shock = 0 if bank_car > self.safetyTreshold else factors.amountWithdrawn
         else:
             if simulation:
                 # if in simulation, uses last real withdrawal by this depositor
                 shock = self.deposit.lastPercentageWithdrawn
             else:
                 # Simulating a Diamond & Dribvig banksim...
-                shock = ExogenousFactors.amountWithdrawn if Util.get_random_uniform(
-                    1) < ExogenousFactors.probabilityofWithdrawal else 0
+                common_random_numbers = self.model.commonRandomNumbers
+                uniform = self.random.get_random_uniform(1) if common_random_numbers is None \
+                    else common_random_numbers.withdrawal_uniforms(self.model.schedule.cycle)[self.depositIndex]
+                shock = factors.amountWithdrawn if uniform < factors.probabilityofWithdrawal else 0
         self.deposit.lastPercentageWithdrawn = shock
         amount_depositor_wish_to_withdraw = self.deposit.amount * shock
         amount_withdrawn = self.bank.withdraw_deposit(amount_depositor_wish_to_withdraw)
@@ -71,20 +75,20 @@ class Depositor(Agent):
             final_consumption = self.amountEarlyWithdraw + self.amountFinalWithdraw
 
             if final_consumption < self.initialDeposit.amount:
-                if ExogenousFactors.isDepositInsuranceAvailable:
-                    final_consumption = self.initialDeposit.amount * (1 + ExogenousFactors.depositInterestRate)
+                if self.model.exogenousFactors.isDepositInsuranceAvailable:
+                    final_consumption = self.initialDeposit.amount * (1 + self.model.depositInterestRate)
                 else:
                     strategy.insolvencyCounter += 1
 
-            amount = self.initialDeposit.amount
-            profit = 100 * math.log(final_consumption / amount)
+            profit = float(DepositorEWAStrategy.utility(final_consumption, self.initialDeposit.amount,
+                                                        self.model.exogenousFactors.depositorMinimumConsumptionRatio))
             strategy.finalConsumption = final_consumption
             strategy.strategyProfit = profit
             strategy.amountEarlyWithdraw = self.amountEarlyWithdraw
             strategy.amountFinalWithdraw = self.amountFinalWithdraw
 
     def reset(self):
-        self.deposit = self.initialDeposit
+        self.deposit.amount = self.initialDeposit.amount
 
     def period_0(self):
         if self.isIntelligent:
@@ -93,15 +97,9 @@ class Depositor(Agent):
             self.safetyTreshold = self.currentlyChosenStrategy.get_alpha_value()
 
     def period_1(self):
-        #  Liquidity Shock
-        if ExogenousFactors.areBankRunsPossible:
+        #  Liquidity Shock (or withdrawals as events of the model's BankRunCascade)
+        if self.model.exogenousFactors.areBankRunsPossible and self.model.bankRunCascade is None:
             self.withdraw_deposit()
 
     def period_2(self):
         pass
-
-
-class Deposit:
-    def __init__(self, amount=0, last_percentage_withdrawn=0):
-        self.amount = amount
-        self.lastPercentageWithdrawn = last_percentage_withdrawn
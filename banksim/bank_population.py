@@ -0,0 +1,149 @@
+import numpy as np
+
+
+class BankPopulation:
+    """
+    Exit, takeover and entry of banks, applied between cycles.
+
+    A bank liquidated during the cycle leaves the system (unless that would leave fewer than
+    `minimumNumberBanks`), or, with probability `bankMergerProbability`, is taken over by the best
+    capitalized surviving bank, which absorbs its size, balance sheet, depositors and corporate clients.
+    Then a Poisson(`bankEntryRate`) number of new banks enters, each with fresh depositors and clients.
+
+    Banks keep dense indices and the rows of each bank stay contiguous in the deposit and loan books, so
+    every per-bank array engine works unchanged. Entrants are appended to storage that grows by doubling,
+    which is O(1) amortized per row. Exit is not: a cycle with any exit or takeover compacts the books in
+    a single pass over all their rows (one masked, stable reordering), moves every depositor and client to
+    its new row and refreshes the per-row state of the schedule and of the phase executor, which is
+    O(total rows). Free slots left in place would break both the dense indices and the contiguity that
+    takeovers need, and every cycle already goes over all rows (deposits, withdrawals, loan collection),
+    so compaction adds a fraction of the cost of the cycle it happens in. The interbank matrix is rebuilt
+    every cycle anyway, so the clearing house only takes a view of the right size over its buffer instead
+    of rebuilding N x N state.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.exitsPerCycle = 0
+        self.mergersPerCycle = 0
+        self.entriesPerCycle = 0
+
+    def update(self):
+        banks = self.model.schedule.banks
+        failed = [bank for bank in banks if bank.isLiquidated]
+        number_leaving = max(0, min(len(failed), len(banks) - self.model.exogenousFactors.minimumNumberBanks))
+        failed = failed[:number_leaving]
+
+        leaving = set(failed)
+        survivors = [bank for bank in banks if bank not in leaving]
+        acquirer = {}
+        if len(failed) > 0:
+            # best capitalized survivor (the most negative capital)
+            best = min(survivors, key=lambda bank: bank.balanceSheet.capital)
+            for bank in failed:
+                if self.model.random.get_random_uniform(1) < self.model.exogenousFactors.bankMergerProbability:
+                    acquirer[bank] = best
+                    self.merge(best, bank)
+
+        self.exitsPerCycle = len(failed) - len(acquirer)
+        self.mergersPerCycle = len(acquirer)
+        if len(failed) > 0:
+            self.compact(survivors, acquirer)
+
+        self.entriesPerCycle = self.model.random.generator.poisson(self.model.exogenousFactors.bankEntryRate)
+        if self.entriesPerCycle > 0:
+            self.enter(self.entriesPerCycle)
+
+        if len(failed) > 0 or self.entriesPerCycle > 0:
+            self.refresh()
+
+    @staticmethod
+    def merge(acquirer, bank):
+        acquirer.initialSize += bank.initialSize
+        for account in acquirer.balanceSheet.accounts:
+            setattr(acquirer.balanceSheet, account,
+                    getattr(acquirer.balanceSheet, account) + getattr(bank.balanceSheet, account))
+        for name in ('depositors', 'corporateClients', 'LowRiskpoolcorporateClients', 'HighRiskpoolcorporateClients'):
+            agents = getattr(bank, name)
+            for agent in agents:
+                agent.bank = acquirer
+            getattr(acquirer, name).extend(agents)
+
+    def compact(self, survivors, acquirer):
+        model = self.model
+        banks = model.schedule.banks
+
+        # new index of every old bank: its own, its acquirer's, or -1 when it left
+        new_index = np.full(len(banks), -1)
+        new_index[[bank.bankIndex for bank in survivors]] = np.arange(len(survivors))
+        for bank, buyer in acquirer.items():
+            new_index[bank.bankIndex] = new_index[buyer.bankIndex]
+
+        # rows of the books, grouped by new bank (and by segment for loans), in their former order within it
+        deposit_book, loan_book = model.depositBook, model.loanBook
+        deposit_banks = new_index[deposit_book.bankIndex[:deposit_book.size]]
+        deposit_rows = np.flatnonzero(deposit_banks >= 0)
+        deposit_rows = deposit_rows[np.argsort(deposit_banks[deposit_rows], kind='stable')]
+        loan_banks = new_index[loan_book.bankIndex[:loan_book.size]]
+        loan_rows = np.flatnonzero(loan_banks >= 0)
+        loan_rows = loan_rows[np.lexsort((loan_rows, loan_book.segment[loan_rows], loan_banks[loan_rows]))]
+
+        deposit_position = np.full(deposit_book.size, -1)
+        deposit_position[deposit_rows] = np.arange(len(deposit_rows))
+        loan_position = np.full(loan_book.size, -1)
+        loan_position[loan_rows] = np.arange(len(loan_rows))
+        deposit_book.compact(deposit_rows, deposit_banks[deposit_rows])
+        loan_book.compact(loan_rows, loan_banks[loan_rows])
+
+        acquirers = set(acquirer.values())
+        for i, bank in enumerate(survivors):
+            bank.bankIndex = i
+            for depositor in bank.depositors:
+                row = deposit_position[depositor.depositIndex]
+                depositor.depositIndex = depositor.initialDeposit.row = depositor.deposit.row = row
+            for name in ('corporateClients', 'LowRiskpoolcorporateClients', 'HighRiskpoolcorporateClients'):
+                for client in getattr(bank, name):
+                    client.loanIndex = loan_position[client.loanIndex]
+            if bank in acquirers:
+                # absorbed agents were appended to the lists: put them back in row order
+                bank.depositors.sort(key=lambda _: _.depositIndex)
+                for name in ('corporateClients', 'LowRiskpoolcorporateClients', 'HighRiskpoolcorporateClients'):
+                    getattr(bank, name).sort(key=lambda _: _.loanIndex)
+        model.schedule.banks = survivors
+
+        schedule = model.schedule
+        schedule.depositors = [_ for bank in survivors for _ in bank.depositors]
+        schedule.corporate_clients = [_ for bank in survivors for _ in bank.corporateClients]
+        schedule.LowRiskpoolcorporate_clients = [_ for bank in survivors for _ in bank.LowRiskpoolcorporateClients]
+        schedule.HighRiskpoolcorporate_clients = [_ for bank in survivors for _ in bank.HighRiskpoolcorporateClients]
+
+        if model.depositorStage is not None:
+            model.depositorStage.update_rows(deposit_rows)
+        if model.loanLedger is not None:
+            model.loanLedger.move_rows(loan_position)
+
+    def enter(self, number_banks):
+        model = self.model
+        number_depositors = model.depositBook.size
+        for _ in range(number_banks):
+            bank = model.add_bank()
+            # entrants are as big as an average incumbent
+            bank.initialSize *= np.mean([_.initialSize for _ in model.schedule.banks[:-1]])
+            model.add_depositors_and_corporate_clients(bank)
+        if model.depositorStage is not None:
+            model.depositorStage.update_rows(np.arange(number_depositors))
+
+    def refresh(self):
+        # per-bank state that depends on the number of banks
+        model = self.model
+        banks = model.schedule.banks
+        model.numberBanks = len(banks)
+        total_size = sum(_.initialSize for _ in banks)
+        for bank in banks:
+            bank.marketShare = bank.initialSize / total_size
+        model.schedule.clearing_house.resize(len(banks))
+        model.schedule.index_populations()
+        if model.loanLedger is not None:
+            model.loanLedger.refresh_clients()
+        if model.phaseExecutor is not None:
+            model.phaseExecutor.refresh()
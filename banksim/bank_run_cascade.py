@@ -0,0 +1,213 @@
+import heapq
+
+import numpy as np
+
+from banksim.agents.bank import Bank
+
+
+class BankRunCascade:
+    """
+    Period 1 as a cascade of time-stamped events, processed in time order from a heap.
+
+    It takes the place of the depositors' withdrawals, of the banks paying them out of liquid assets and of
+    the interbank market of the clearing house:
+
+    - every depositor that withdraws does so at a random time of the period (WITHDRAWAL);
+    - a bank pays what it owes out of its liquid assets `bankResponseDelay` after a withdrawal (RESPONSE);
+    - whatever it can not pay, it borrows `interbankCallDelay` later from the banks with the most liquid
+      assets left at that time (INTERBANK_CALL);
+    - a bank that still falls short is distressed. The news reaches each of its remaining depositors with
+      probability `runContagionProbability`, and each depositor of the banks that lent to it with probability
+      `interbankRunContagionProbability`, who then withdraw everything after an exponential delay of mean
+      `runInformationDelay`.
+
+    Every depositor withdraws at most once and every borrowing either exhausts a lender or covers the
+    borrower, so the cascade takes O(E log E) for E events. At the end, balance sheets, the interbank matrix
+    and liquidity needs are left as the clearing house would leave them, and the central bank steps in as
+    usual.
+    """
+
+    WITHDRAWAL = 0
+    RESPONSE = 1
+    INTERBANK_CALL = 2
+
+    def __init__(self, model):
+        self.model = model
+        self.numberEvents = 0
+        self.numberContagionWithdrawals = 0
+        # time each bank became distressed in the last cycle (inf if it did not)
+        self.distressTime = np.zeros(0)
+
+    def run(self):
+        model = self.model
+        banks = model.schedule.banks
+        deposit_book = model.depositBook
+        number_banks, number_depositors = len(banks), deposit_book.size
+
+        # per bank: liquid assets left, withdrawals not paid yet, and how withdrawals were paid
+        self.cash = np.array([bank.balanceSheet.liquidAssets for bank in banks], dtype=float)
+        self.owed = np.zeros(number_banks)
+        self.paidFromCash = np.zeros(number_banks)
+        self.borrowed = np.zeros(number_banks)
+        self.lenders = [set() for _ in range(number_banks)]
+        self.distressTime = np.full(number_banks, np.inf)
+        self.pendingResponse = np.zeros(number_banks, dtype=bool)
+        self.pendingCall = np.zeros(number_banks, dtype=bool)
+
+        # per depositor: whether it has withdrawn, or heard of a distressed bank, and how much it took
+        self.bankIndex = deposit_book.bankIndex[:number_depositors]
+        self.withdrawn = np.zeros(number_depositors, dtype=bool)
+        self.alerted = np.zeros(number_depositors, dtype=bool)
+        self.amountEarlyWithdraw = np.zeros(number_depositors)
+        deposit_book.lastPercentageWithdrawn[:number_depositors] = 0
+
+        # banks ready to lend, most liquid first (stale entries are skipped when popped)
+        self.market = [(-cash, i) for i, cash in enumerate(self.cash) if cash > 0]
+        heapq.heapify(self.market)
+
+        self.events = []
+        self.sequence = 0
+        self.numberEvents = 0
+        self.numberContagionWithdrawals = 0
+        if self.model.exogenousFactors.areBankRunsPossible:
+            self.schedule_withdrawals()
+
+        handlers = {self.WITHDRAWAL: self.withdraw, self.RESPONSE: self.respond, self.INTERBANK_CALL: self.call}
+        while self.events:
+            time, _, kind, index, amount = heapq.heappop(self.events)
+            self.numberEvents += 1
+            handlers[kind](time, index, amount)
+
+        self.settle()
+
+    def push(self, time, kind, index, amount=0.0):
+        # the sequence number breaks ties in the order events were scheduled
+        heapq.heappush(self.events, (time, self.sequence, kind, index, amount))
+        self.sequence += 1
+
+    def schedule_withdrawals(self):
+        # Whoever would withdraw in period 1 does so at a uniformly distributed time
+        number_depositors = len(self.bankIndex)
+        if self.model.exogenousFactors.areDepositorsZeroIntelligenceAgents:
+            common_random_numbers = self.model.commonRandomNumbers
+            if common_random_numbers is None:
+                uniforms = self.model.random.get_random_uniform(1, number_depositors)
+            else:
+                uniforms = common_random_numbers.withdrawal_uniforms(self.model.schedule.cycle)[:number_depositors]
+            withdraws = uniforms < self.model.exogenousFactors.probabilityofWithdrawal
+        else:
+            # the capital adequacy ratio of a bank does not change before the cascade settles
+            bank_car = Bank.get_capital_adequacy_ratios(self.model.schedule.banks)
+            withdraws = bank_car[self.bankIndex] <= self.safety_tresholds()
+        times = self.model.random.get_random_uniform(1, number_depositors)
+        for row in np.flatnonzero(withdraws):
+            self.push(times[row], self.WITHDRAWAL, row, self.model.exogenousFactors.amountWithdrawn)
+
+    def safety_tresholds(self):
+        if self.model.depositorStage is not None:
+            return self.model.depositorStage.safetyTreshold
+        return np.array([depositor.safetyTreshold for depositor in self.model.schedule.depositors])
+
+    def withdraw(self, time, row, shock):
+        if self.withdrawn[row]:
+            return
+        self.withdrawn[row] = True
+        deposit_book = self.model.depositBook
+        amount = deposit_book.amounts[row] * shock
+        deposit_book.amounts[row] -= amount
+        deposit_book.lastPercentageWithdrawn[row] = shock
+        self.amountEarlyWithdraw[row] = amount
+
+        i = self.bankIndex[row]
+        self.model.schedule.banks[i].withdraw_deposit(amount)
+        self.owed[i] += amount
+        if amount > 0 and not self.pendingResponse[i]:
+            self.pendingResponse[i] = True
+            self.push(time + self.model.exogenousFactors.bankResponseDelay, self.RESPONSE, i)
+
+    def respond(self, time, i, _):
+        # pays depositors out of liquid assets, then calls the interbank market for the rest
+        self.pendingResponse[i] = False
+        paid = min(self.cash[i], self.owed[i])
+        self.cash[i] -= paid
+        self.owed[i] -= paid
+        self.paidFromCash[i] += paid
+        if self.owed[i] > 0:
+            if not self.model.interbankLendingMarketAvailable:
+                self.distress(time, i)
+            elif not self.pendingCall[i]:
+                self.pendingCall[i] = True
+                self.push(time + self.model.exogenousFactors.interbankCallDelay, self.INTERBANK_CALL, i)
+        elif self.cash[i] > 0:
+            heapq.heappush(self.market, (-self.cash[i], i))
+
+    def call(self, time, i, _):
+        self.pendingCall[i] = False
+        clearing_house = self.model.schedule.clearing_house
+        while self.owed[i] > 0 and self.market:
+            cash, lender = heapq.heappop(self.market)
+            if -cash != self.cash[lender] or self.owed[lender] > 0:
+                # stale: the lender has lent or paid its own depositors since
+                continue
+            amount = min(self.cash[lender], self.owed[i])
+            if clearing_house.interbankLendingMatrix[lender, i] == 0:
+                clearing_house.interbankEdges.append((lender, i))
+            clearing_house.interbankLendingMatrix[lender, i] += amount
+            clearing_house.interbankLendingMatrix[i, lender] -= amount
+            self.cash[lender] -= amount
+            self.owed[i] -= amount
+            self.borrowed[i] += amount
+            self.lenders[i].add(lender)
+            if self.cash[lender] > 0:
+                heapq.heappush(self.market, (-self.cash[lender], lender))
+        if self.owed[i] > 0:
+            self.distress(time, i)
+
+    def distress(self, time, i):
+        if self.distressTime[i] < np.inf:
+            return
+        self.distressTime[i] = time
+        rows = self.model.schedule.bankDepositorRows
+        factors = self.model.exogenousFactors
+        self.alert(time, np.arange(rows[i], rows[i + 1]), factors.runContagionProbability)
+        for lender in self.lenders[i]:
+            self.alert(time, np.arange(rows[lender], rows[lender + 1]), factors.interbankRunContagionProbability)
+
+    def alert(self, time, rows, probability):
+        # depositors that hear of a distressed bank run on theirs
+        rows = rows[~(self.withdrawn[rows] | self.alerted[rows])]
+        factors, random = self.model.exogenousFactors, self.model.random
+        rows = rows[random.get_random_uniform(1, len(rows)) < probability]
+        self.alerted[rows] = True
+        delays = -factors.runInformationDelay * np.log(1 - random.get_random_uniform(1, len(rows)))
+        for row, delay in zip(rows, delays):
+            self.push(time + delay, self.WITHDRAWAL, row, factors.amountWithdrawn)
+        self.numberContagionWithdrawals += len(rows)
+
+    def settle(self):
+        # Leaves the banks as Bank.period_1 and the clearing house would have
+        clearing_house = self.model.schedule.clearing_house
+        for bank in self.model.schedule.banks:
+            i = bank.bankIndex
+            bank.balanceSheet.liquidAssets = self.cash[i]
+            bank.balanceSheet.deposits += self.paidFromCash[i] + self.borrowed[i]
+            bank.balanceSheet.interbankLoan = clearing_house.get_interbank_market_position(bank)
+            bank.liquidityNeeds = self.cash[i] - self.owed[i]
+
+        if self.model.depositorStage is not None:
+            self.model.depositorStage.amountEarlyWithdraw = self.amountEarlyWithdraw
+        else:
+            for depositor in self.model.schedule.depositors:
+                depositor.amountEarlyWithdraw = self.amountEarlyWithdraw[depositor.depositIndex]
+
+    def reset(self):
+        pass
+
+    def period_0(self):
+        pass
+
+    def period_1(self):
+        self.run()
+
+    def period_2(self):
+        pass
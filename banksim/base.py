@@ -0,0 +1,52 @@
+import datetime
+
+from banksim.util import RandomStream
+
+
+class Agent:
+    """
+    Base class of every agent, with the same interface as mesa.Agent.
+
+    The core of BankSim only needs numpy: mesa is an optional extra, used by the visualization example
+    (DataCollector and ModularServer work with any model exposing `step`, `running` and `schedule`).
+    """
+
+    def __init__(self, unique_id, model):
+        self.unique_id = unique_id
+        self.model = model
+
+    @property
+    def random(self):
+        return self.model.random
+
+    def step(self):
+        pass
+
+
+class Model:
+    """
+    Base class of BankingModel, with the same interface as mesa.Model.
+
+    Like mesa.Model, a model draws from a random stream of its own, `self.random`, seeded by `seed` (from
+    the OS when seed is None); process-wide generators are left alone.
+    """
+
+    def __init__(self, seed=None):
+        self.seed = datetime.datetime.now() if seed is None else seed
+        self.random = RandomStream(seed)
+
+        self.running = True
+        self.schedule = None
+        # agent ids are counted per model, so several models can live in one process
+        self.currentId = 0
+
+    def next_id(self):
+        self.currentId += 1
+        return self.currentId
+
+    def run_model(self):
+        while self.running:
+            self.step()
+
+    def step(self):
+        pass
@@ -0,0 +1,224 @@
+"""
+Calibration of exogenous factors by the method of simulated moments.
+
+Candidate factors live in a ParameterSpace box (see banksim.surrogate). Each candidate is simulated once
+per seed, and the moments of its runs, averaged over seeds, are compared with target moments:
+
+    J(theta) = sum_k weights_k * (simulated moment_k(theta) - target_k) ** 2
+
+Every candidate is run with the same seeds, so candidates are compared on common random numbers and
+differences in J reflect the factors rather than sampling noise. J is minimized by Nelder-Mead in the unit
+box. Each iteration evaluates the reflection, expansion and both contraction points in one batch
+(candidates x seeds spread over worker processes) and keeps what the sequential method would have
+kept. After every batch, the state of the search is written to `checkpoint_path`, and a calibration
+started with an existing checkpoint picks up where it stopped.
+"""
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from banksim.surrogate import ParameterSpace
+
+
+def insolvency_rate(cycles, number_banks):
+    return np.mean(cycles['insolvencies']) / number_banks
+
+
+def contagion_rate(cycles, number_banks):
+    return np.mean(cycles['contagions']) / number_banks
+
+
+def loans_per_bank(cycles, number_banks):
+    return np.mean(cycles['totalLoans']) / number_banks
+
+
+def interbank_debt_per_bank(cycles, number_banks):
+    return np.mean(cycles['totalInterbankDebt']) / number_banks
+
+
+MOMENTS = {'insolvencyRate': insolvency_rate,
+           'contagionRate': contagion_rate,
+           'loansPerBank': loans_per_bank,
+           'interbankDebtPerBank': interbank_debt_per_bank}
+
+
+def simulate_moments(factors, simulation_type, number_of_cycles, seed, number_of_banks=None, burn_in=0,
+                     moments=tuple(MOMENTS)):
+    # Moments of one run, from the default exogenous factors, over the cycles after burn_in. Only the totals
+    # the moments are taken from are kept, one per cycle: no snapshot of the interbank network
+    from banksim.model import BankingModel
+
+    model = BankingModel(simulation_type, dict(factors), number_of_banks, seed=seed)
+    for _ in range(burn_in):
+        model.step()
+    central_bank = model.schedule.central_bank
+    clearing_house = model.schedule.clearing_house
+    cycles = {name: np.zeros(number_of_cycles)
+              for name in ('insolvencies', 'contagions', 'totalLoans', 'totalInterbankDebt')}
+    for t in range(number_of_cycles):
+        model.step()
+        cycles['insolvencies'][t] = central_bank.insolvencyPerCycleCounter
+        cycles['contagions'][t] = central_bank.insolvencyDueToContagionPerCycleCounter
+        cycles['totalLoans'][t] = central_bank.get_total_real_sector_loans(model.schedule.banks)
+        cycles['totalInterbankDebt'][t] = clearing_house.totalInterbankDebt
+    return [float(MOMENTS[_](cycles, len(model.schedule.banks))) for _ in moments]
+
+
+def run_task(task):
+    # entry point of the worker processes
+    index, arguments = task
+    return index, simulate_moments(*arguments)
+
+
+class Calibration:
+
+    # Nelder-Mead coefficients: reflection, expansion, contraction and shrinkage
+    REFLECTION, EXPANSION, CONTRACTION, SHRINKAGE = 1, 2, 0.5, 0.5
+
+    def __init__(self, space, targets, simulation_type, number_of_cycles, seeds, number_of_banks=None,
+                 burn_in=0, weights=None, fixed_factors=None, number_workers=0, checkpoint_path=None):
+        self.space = space if isinstance(space, ParameterSpace) else ParameterSpace(space)
+        # {moment name: target value}
+        self.targets = dict(targets)
+        self.moments = tuple(self.targets)
+        for moment in self.moments:
+            if moment not in MOMENTS:
+                raise ValueError('Unknown moment: {}'.format(moment))
+        target_values = np.array([self.targets[_] for _ in self.moments], dtype=float)
+        self.targetValues = target_values
+        # relative squared errors by default
+        if weights is None:
+            self.weights = 1 / np.maximum(np.abs(target_values), 1e-12) ** 2
+        else:
+            self.weights = np.array([weights[_] for _ in self.moments], dtype=float)
+
+        self.simulationType = simulation_type
+        self.numberCycles = number_of_cycles
+        self.seeds = list(seeds)
+        self.numberBanks = number_of_banks
+        self.burnIn = burn_in
+        self.fixedFactors = dict(fixed_factors or {})
+        self.numberWorkers = number_workers
+        self.checkpointPath = checkpoint_path
+        self.pool = None
+
+        # every candidate evaluated so far (unit-box point, mean moments, objective), and the search state
+        self.evaluations = []
+        self.simplex = None
+        self.values = None
+        self.iteration = 0
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            self.load()
+
+    def factors(self, point):
+        factors = dict(self.fixedFactors)
+        factors.update(self.space.factors(self.space.from_unit(np.clip(point, 0, 1))))
+        return factors
+
+    def objective(self, moments):
+        return float(np.sum(self.weights * (np.asarray(moments) - self.targetValues) ** 2))
+
+    def evaluate(self, points):
+        # Objective of a batch of unit-box points, running every (point, seed) pair at once
+        tasks = [((i, j), (self.factors(point), self.simulationType, self.numberCycles, seed, self.numberBanks,
+                           self.burnIn, self.moments))
+                 for i, point in enumerate(points) for j, seed in enumerate(self.seeds)]
+        runs = np.zeros((len(points), len(self.seeds), len(self.moments)))
+        outcomes = self.pool.imap_unordered(run_task, tasks) if self.pool is not None else map(run_task, tasks)
+        for (i, j), moments in outcomes:
+            runs[i, j] = moments
+
+        values = []
+        for point, moments in zip(points, np.mean(runs, axis=1)):
+            value = self.objective(moments)
+            self.evaluations.append((np.clip(point, 0, 1).tolist(), moments.tolist(), value))
+            values.append(value)
+        return np.array(values)
+
+    def best(self):
+        # exogenous factors, moments and objective of the best candidate so far
+        point, moments, value = min(self.evaluations, key=lambda _: _[2])
+        return self.factors(point), dict(zip(self.moments, moments)), value
+
+    def run(self, max_iterations=100, tolerance=1e-6, initial_step=0.1, start=None):
+        """
+        Nelder-Mead from `start` (exogenous factors; the center of the box by default), until the spread of
+        objective values over the simplex falls below tolerance or after max_iterations iterations.
+        """
+        if self.numberWorkers > 0:
+            self.pool = multiprocessing.Pool(self.numberWorkers)
+        try:
+            if self.simplex is None:
+                x0 = np.full(len(self.space.names), 0.5) if start is None \
+                    else self.space.to_unit(self.space.point(start))
+                simplex = [x0] + [x0 + initial_step * np.eye(len(x0))[k] for k in range(len(x0))]
+                self.simplex = np.clip(simplex, 0, 1)
+                self.values = self.evaluate(self.simplex)
+                self.save()
+
+            while self.iteration < max_iterations and np.ptp(self.values) > tolerance:
+                self.step()
+                self.iteration += 1
+                self.save()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+        return self.best()
+
+    def step(self):
+        order = np.argsort(self.values)
+        simplex, values = self.simplex[order], self.values[order]
+        centroid = np.mean(simplex[:-1], axis=0)
+        worst = simplex[-1]
+
+        # every point the sequential method could need next, in one batch
+        candidates = np.clip([centroid + self.REFLECTION * (centroid - worst),
+                              centroid + self.EXPANSION * (centroid - worst),
+                              centroid + self.CONTRACTION * self.REFLECTION * (centroid - worst),
+                              centroid - self.CONTRACTION * (centroid - worst)], 0, 1)
+        reflected, expanded, outside, inside = self.evaluate(candidates)
+
+        if reflected < values[0]:
+            replacement = (candidates[1], expanded) if expanded < reflected else (candidates[0], reflected)
+        elif reflected < values[-2]:
+            replacement = (candidates[0], reflected)
+        elif reflected < values[-1] and outside <= reflected:
+            replacement = (candidates[2], outside)
+        elif reflected >= values[-1] and inside < values[-1]:
+            replacement = (candidates[3], inside)
+        else:
+            replacement = None
+
+        if replacement is not None:
+            simplex[-1], values[-1] = replacement
+        else:
+            # shrink towards the best point
+            simplex[1:] = simplex[0] + self.SHRINKAGE * (simplex[1:] - simplex[0])
+            values[1:] = self.evaluate(simplex[1:])
+        self.simplex, self.values = simplex, values
+
+    def save(self):
+        if self.checkpointPath is None:
+            return
+        state = {'names': self.space.names,
+                 'iteration': self.iteration,
+                 'simplex': self.simplex.tolist(),
+                 'values': self.values.tolist(),
+                 'evaluations': self.evaluations}
+        temporary = '{}.{}.tmp'.format(self.checkpointPath, os.getpid())
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.checkpointPath)
+
+    def load(self):
+        with open(self.checkpointPath) as f:
+            state = json.load(f)
+        if state['names'] != self.space.names:
+            raise ValueError('Checkpoint {} is of another parameter space'.format(self.checkpointPath))
+        self.iteration = state['iteration']
+        self.simplex = np.array(state['simplex'])
+        self.values = np.array(state['values'])
+        self.evaluations = [tuple(_) for _ in state['evaluations']]
@@ -0,0 +1,82 @@
+import os
+import shutil
+
+import numpy as np
+
+
+class CommonRandomNumbers:
+    """
+    Exogenous random streams of a seed, generated once and shared read-only by every scenario run with it.
+
+    Per cycle, a stream holds one uniform per depositor (whether a zero-intelligence depositor withdraws),
+    one per corporate client (whether it defaults) and one priority key per bank for each interbank queue
+    (the random order of lenders and borrowers). Streams are .npy files in a directory of their own, opened
+    as read-only memory maps: runs of different scenarios, in one or many processes, share the same pages
+    and, as depositors, clients and banks are addressed by their rows in the books and their indices, they
+    face the very same withdrawals, defaults and queues. Differences between scenarios then reflect the
+    scenarios, not sampling noise, so far fewer seeds are needed to compare them.
+
+    Everything else (strategy choices, bank sizes...) still comes from the model's seed.
+    """
+
+    STREAMS = ('withdrawalUniforms', 'defaultUniforms', 'shuffleKeys')
+
+    def __init__(self, path):
+        self.path = path
+        for name in self.STREAMS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        self.numberCycles = len(self.withdrawalUniforms)
+
+    @classmethod
+    def generate(cls, path, seed, number_cycles, number_depositors, number_clients, number_banks):
+        # Writes the streams of a seed to path, unless they are already there
+        if not os.path.exists(path):
+            temporary = '{}.{}.tmp'.format(path, os.getpid())
+            os.makedirs(temporary)
+            rng = np.random.default_rng(seed)
+            shapes = {'withdrawalUniforms': (number_cycles, number_depositors),
+                      'defaultUniforms': (number_cycles, number_clients),
+                      'shuffleKeys': (number_cycles, 2, number_banks)}
+            for name in cls.STREAMS:
+                stream = np.lib.format.open_memmap(os.path.join(temporary, name + '.npy'), mode='w+',
+                                                   dtype=np.float64, shape=shapes[name])
+                # cycle by cycle, so memory use does not grow with the number of cycles
+                for cycle in range(number_cycles):
+                    stream[cycle] = rng.random(shapes[name][1:])
+                stream.flush()
+                del stream
+            try:
+                os.rename(temporary, path)
+            except OSError:
+                # generated meanwhile by another process
+                shutil.rmtree(temporary)
+        return cls(path)
+
+    def check(self, model):
+        # Streams must cover every depositor, client and bank of the model
+        if model.bankPopulation is not None:
+            raise ValueError('Common random numbers address agents by row, which bank entry and exit changes')
+        if model.phaseExecutor is not None:
+            raise ValueError('Worker processes draw from streams of their own (see ParallelPhaseExecutor)')
+        sizes = (('depositors', model.depositBook.size, self.withdrawalUniforms.shape[1]),
+                 ('corporate clients', model.loanBook.size, self.defaultUniforms.shape[1]),
+                 ('banks', len(model.schedule.banks), self.shuffleKeys.shape[2]))
+        for name, size, covered in sizes:
+            if size > covered:
+                raise ValueError('Common random numbers cover {} {}, not {}'.format(covered, name, size))
+
+    def row(self, stream, cycle):
+        # cycles are counted from 1
+        if not 1 <= cycle <= self.numberCycles:
+            raise IndexError('Common random numbers cover cycles 1 to {}, not {}'.format(self.numberCycles, cycle))
+        return stream[cycle - 1]
+
+    def withdrawal_uniforms(self, cycle):
+        return self.row(self.withdrawalUniforms, cycle)
+
+    def default_uniforms(self, cycle):
+        return self.row(self.defaultUniforms, cycle)
+
+    def shuffle_keys(self, cycle, queue):
+        # queue 0: banks offering liquidity, 1: banks needing it
+        return self.row(self.shuffleKeys, cycle)[queue]
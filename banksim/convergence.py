@@ -0,0 +1,124 @@
+from statistics import NormalDist
+
+import numpy as np
+
+# floor of the previous probabilities in the KL divergence, so strategies woken up from zero stay finite
+KL_PROBABILITY_FLOOR = 1e-12
+
+
+def total_variation(p, q):
+    # one distance per row of the (learners, strategies) arrays
+    return 0.5 * np.sum(np.abs(p - q), axis=1)
+
+
+def kl_divergence(p, q):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(p > 0, p * np.log(p / np.maximum(q, KL_PROBABILITY_FLOOR)), 0)
+    return np.sum(terms, axis=1)
+
+
+DIVERGENCES = {'tv': total_variation, 'kl': kl_divergence}
+
+
+def support_probabilities(strategy_supports):
+    # (learners, strategies) choice probabilities over the whole grid, zero for dormant strategies
+    if len(strategy_supports) == 0 or strategy_supports[0].probabilities is None:
+        return None
+    distributions = np.zeros((len(strategy_supports), strategy_supports[0].numberStrategies))
+    for row, support in zip(distributions, strategy_supports):
+        row[support.activeIndices] = support.probabilities
+    return distributions
+
+
+class ConvergenceMonitor:
+    """
+    Online convergence diagnostics of a run, updated at the end of every cycle.
+
+    For each learning population (banks, central bank, depositors) the distance between the choice
+    probabilities P of two successive cycles is computed learner by learner, either as total variation
+    ('tv') or as Kullback-Leibler divergence ('kl'), and the largest one is kept. Insolvencies are
+    followed as a rate per bank, with a normal confidence interval on its mean over the last `window`
+    cycles. Populations of zero-intelligence agents have nothing to learn and are left out.
+    """
+
+    def __init__(self, model, divergence='tv', window=50, confidence=0.95):
+        if divergence not in DIVERGENCES:
+            raise ValueError("Unknown divergence: {}".format(divergence))
+        self.model = model
+        self.divergence = divergence
+        self.window = window
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+        self.previous = {}
+        self.distances = {}
+        self.insolvencyRates = []
+        self.history = []
+
+    def probabilities(self):
+        schedule = self.model.schedule
+        populations = {}
+        banks = [bank.strategySupport for bank in schedule.banks if bank.isIntelligent]
+        populations['banks'] = support_probabilities(banks)
+        if schedule.central_bank.isIntelligent:
+            populations['centralBank'] = support_probabilities([schedule.central_bank.strategySupport])
+        if self.model.depositorStage is not None:
+            P = self.model.depositorStage.P
+            populations['depositors'] = P if np.any(P) else None
+        else:
+            depositors = [_.strategySupport for _ in schedule.depositors if _.isIntelligent]
+            populations['depositors'] = support_probabilities(depositors)
+        return {name: P for name, P in populations.items() if P is not None}
+
+    def update(self):
+        populations = self.probabilities()
+        self.distances = {}
+        for name, P in populations.items():
+            previous = self.previous.get(name)
+            if previous is not None and previous.shape == P.shape:
+                self.distances[name] = float(np.max(DIVERGENCES[self.divergence](P, previous)))
+            else:
+                self.distances[name] = np.inf
+            self.previous[name] = P.copy()
+
+        banks = self.model.schedule.banks
+        self.insolvencyRates.append(self.model.schedule.central_bank.insolvencyPerCycleCounter / len(banks))
+        self.history.append(self.summary())
+
+    @property
+    def strategy_distance(self):
+        # largest change of any learner's probabilities over the last cycle
+        return max(self.distances.values(), default=0.)
+
+    def insolvency_rate_interval(self):
+        # (mean, lower, upper) of the insolvency rate over the last `window` cycles
+        rates = np.array(self.insolvencyRates[-self.window:])
+        if len(rates) == 0:
+            return np.nan, np.nan, np.nan
+        mean = np.mean(rates)
+        half_width = self.z * np.std(rates, ddof=1) / np.sqrt(len(rates)) if len(rates) > 1 else np.inf
+        return mean, mean - half_width, mean + half_width
+
+    def is_converged(self, tol, ci_width=None):
+        """
+        True once every population moved less than `tol` in each of the last `window` cycles and, when
+        `ci_width` is given, the confidence interval of the insolvency rate is narrower than it.
+        """
+        if len(self.history) < self.window:
+            return False
+        if any(_['strategyDistance'] >= tol for _ in self.history[-self.window:]):
+            return False
+        if ci_width is not None:
+            _, lower, upper = self.insolvency_rate_interval()
+            return upper - lower < ci_width
+        return True
+
+    def summary(self):
+        mean, lower, upper = self.insolvency_rate_interval()
+        summary = {'cycle': self.model.schedule.cycle,
+                   'strategyDistance': self.strategy_distance,
+                   'insolvencyRate': self.insolvencyRates[-1],
+                   'insolvencyRateMean': float(mean),
+                   'insolvencyRateLower': float(lower),
+                   'insolvencyRateUpper': float(upper)}
+        summary.update({name + 'Distance': distance for name, distance in self.distances.items()})
+        return summary
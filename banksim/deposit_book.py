@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class DepositBook:
+    """
+    Deposits of every depositor of a model, stored in flat arrays.
+
+    Depositors are registered bank by bank, so the depositors of a bank are a contiguous range of rows
+    and deposits can be made, accrued and haircut for a whole bank at once.
+    """
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.amounts = np.zeros(capacity)
+        self.initialAmounts = np.zeros(capacity)
+        self.lastPercentageWithdrawn = np.zeros(capacity)
+        self.bankIndex = np.zeros(capacity, dtype=int)
+
+    def add_depositor(self, bank_index):
+        if self.size == len(self.amounts):
+            self.grow(2 * self.size)
+        row = self.size
+        self.bankIndex[row] = bank_index
+        self.size += 1
+        return row
+
+    def grow(self, capacity):
+        for name in ('amounts', 'initialAmounts', 'lastPercentageWithdrawn', 'bankIndex'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def compact(self, rows, bank_index):
+        # Keeps only the given rows, in that order, with new bank indices; capacity is kept for entrants
+        for name in ('amounts', 'initialAmounts', 'lastPercentageWithdrawn'):
+            column = getattr(self, name)
+            column[:len(rows)] = column[rows]
+        self.bankIndex[:len(rows)] = bank_index
+        self.size = len(rows)
+
+    @staticmethod
+    def rows(depositors):
+        if len(depositors) == 0:
+            return slice(0, 0)
+        return slice(depositors[0].depositIndex, depositors[-1].depositIndex + 1)
+
+    def make_deposits(self, rows, amount):
+        # New deposits of a cycle, replacing the previous ones
+        self.initialAmounts[rows] = amount
+        self.amounts[rows] = amount
+        self.lastPercentageWithdrawn[rows] = 0
+
+    def scale(self, rows, factor):
+        # Interest accrual (factor > 1) or haircut in a liquidation (factor < 1)
+        self.amounts[rows] *= factor
+
+
+class Deposit:
+    """
+    View over the row of a depositor in a DepositBook (the current or the initial deposit of the cycle).
+    """
+
+    def __init__(self, deposit_book, row, initial=False):
+        self.depositBook = deposit_book
+        self.row = row
+        self.initial = initial
+
+    @property
+    def amount(self):
+        book = self.depositBook
+        return (book.initialAmounts if self.initial else book.amounts)[self.row]
+
+    @amount.setter
+    def amount(self, value):
+        book = self.depositBook
+        (book.initialAmounts if self.initial else book.amounts)[self.row] = value
+
+    @property
+    def lastPercentageWithdrawn(self):
+        return self.depositBook.lastPercentageWithdrawn[self.row]
+
+    @lastPercentageWithdrawn.setter
+    def lastPercentageWithdrawn(self, value):
+        self.depositBook.lastPercentageWithdrawn[self.row] = value
@@ -1,5 +1,7 @@
 from enum import Enum
 
+from banksim.strategies.strategy_grid import StrategyGrid
+
 
 class SimulationType(Enum):
     HighSpread = 1
@@ -24,6 +26,11 @@ class InterbankPriority(Enum):
     RiskSorted = 2
 
 
+class LoanAmortization(Enum):
+    Bullet = 1
+    Linear = 2
+
+
 class ExogenousFactors:
     # Model
     numberBanks = 50
@@ -31,37 +38,91 @@ class ExogenousFactors:
     interbankInterestRate = 0.01  
     liquidAssetsInterestRate = 0
     illiquidAssetDiscountRate = 0.15
+    illiquidAssetPriceImpact = 0
+    areIlliquidAssetsMarkedToMarket = False
     interbankLendingMarketAvailable = True
     banksMaySellNonLiquidAssetsAtDiscountPrices = True
     banksHaveLimitedLiability = False
+    # 0: agents act one by one; 1 or more: per-bank phases run over shared memory (see ParallelPhaseExecutor)
+    numberWorkerProcesses = 0
+    # Failed banks exit instead of being liquidated and restarted, and new banks enter (see BankPopulation)
+    isBankEntryAndExitActive = False
+    bankEntryRate = 0.1  # expected number of new banks per cycle
+    bankMergerProbability = 0.5  # chance a failed bank is taken over by the best capitalized bank instead
+    minimumNumberBanks = 2
 
     # Banks
     bankSizeDistribution = BankSizeDistribution.Vanilla
     numberDepositorsPerBank = 100
     numberCorporateClientsPerBank = 50
     areBanksZeroIntelligenceAgents = False
+    bankAlphaGrid = StrategyGrid(30)
+    bankBetaGrid = StrategyGrid(20)
+    bankGammaGrid = StrategyGrid(30)
 
     # Central Bank
     centralBankLendingInterestRate = 0.05 
     offersDiscountWindowLending = True
     minimumCapitalAdequacyRatio = -10
     isCentralBankZeroIntelligenceAgent = True
+    centralBankAlphaGrid = StrategyGrid(30)
     isCapitalRequirementActive = False
     isTooBigToFailPolicyActive = False
     isDepositInsuranceAvailable = False
     isMonetaryPolicyAvailable = False
+    # The central bank sets every rate each cycle, around the interbank rate of the scenario (see MonetaryPolicy)
+    isPolicyRateRuleActive = False
+    policyRatePath = None  # one policy rate per cycle, instead of the rule
+    policyRateSmoothing = 0.8
+    creditGapWeight = 0.5
+    financialStressWeight = 0.1
+    creditTrendWeight = 0.1
+    policyRateLowerBound = 0
+    depositRatePassThrough = 0.5
+    loanRatePassThrough = 1.0
 
     # Clearing House
     isClearingGuaranteeAvailable = True
     interbankPriority = InterbankPriority.Random
+    isInterbankNetworkMetricsActive = False
 
     # Depositors
     areDepositorsZeroIntelligenceAgents = True
+    depositorAlphaGrid = StrategyGrid(10)
+    isDepositorLearningVectorized = True
+    # share of the initial deposit below which final consumption counts as this share in the utility, so
+    # that losing everything is very costly but not an infinite loss
+    depositorMinimumConsumptionRatio = 1e-6
     areBankRunsPossible = True
     amountWithdrawn = 1.0
     probabilityofWithdrawal = 0.15
+    # Period 1 as an event-driven cascade of withdrawals, liquidity responses and interbank calls (see
+    # BankRunCascade); delays are fractions of the period
+    isBankRunCascadeActive = False
+    bankResponseDelay = 0.01
+    interbankCallDelay = 0.01
+    runInformationDelay = 0.05
+    runContagionProbability = 0.5
+    interbankRunContagionProbability = 0.1
 
-    # Firms / Corporate Clients
+    # Firms / Corporate Clients: loans last one cycle, or loanMaturity cycles with multi-period loans
+    areLoansMultiPeriod = False
+    loanMaturity = 4
+    loanAmortization = LoanAmortization.Linear
+
+    # Firms / Corporate Clients (without monetary policy)
+    standardCorporateClients = True
+    standardCorporateClientDefaultRate = 0.04
+    standardCorporateClientLossGivenDefault = 1
+    standardCorporateClientLoanInterestRate = 0.08
+    wholesaleCorporateClientDefaultRate = 0.04
+    wholesaleCorporateClientLossGivenDefault = 1
+    wholesaleCorporateClientLoanInterestRate = 0.06
+    retailCorporateClientDefaultRate = 0.07
+    retailCorporateClientLossGivenDefault = 1
+    retailCorporateClientLoanInterestRate = 0.08
+
+    # Firms / Corporate Clients (with monetary policy)
     HighRiskCorporateClientDefaultRate = 0.07
     HighRiskCorporateClientLossGivenDefault = 1
     HighRiskCorporateClientLoanInterestRate = 0.08
@@ -71,9 +132,28 @@ class ExogenousFactors:
     
     # Risk Weights
     CashRiskWeight = 0
+    CorporateLoanRiskWeight = 1
+    retailCorporateLoanRiskWeight = 0.75
+    wholesaleCorporateLoanRiskWeight = 1
     HighRiskCorporateLoanRiskWeight = 1
     InterbankLoanRiskWeight = 1
     LowRiskCorporateLoanRiskWeight = 0.8
     
     # Learning
     DefaultEWADampingFactor = 1
+    isStrategyPruningActive = False
+    strategyPruningProbabilityThreshold = 1e-6
+    strategyPruningPatience = 10
+    strategyPruningReexpansionInterval = 100
+    strategyPruningExplorationSize = 10
+    isCoarseToFineLearningActive = False
+    coarseGridStride = 4
+    gridRefinementInterval = 50
+    gridRefinementTopStrategies = 10
+
+    def __init__(self, factors=None):
+        # Factors of one model: every factor of the class as it stands, then the given ones. A model reads
+        # its own copy, so neither its scenario nor its overrides reach other models.
+        vars(self).update({k: v for k, v in vars(ExogenousFactors).items() if not k.startswith('_')})
+        if factors:
+            vars(self).update(factors)
@@ -0,0 +1,102 @@
+import numpy as np
+
+from banksim.exogeneous_factors import ExogenousFactors
+from banksim.loan_book import LoanBook
+
+
+class FireSale:
+    """
+    System-wide sale of illiquid assets (corporate loans) by the banks that still need liquidity.
+
+    The sell orders of every illiquid bank are cleared together against the price-impact curve
+
+        price = exp(-illiquidAssetPriceImpact * total sold / total loans) / (1 + illiquidAssetDiscountRate)
+
+    so the more the whole system sells, the less each bank gets for its loans. Without price impact every
+    bank sells at the fixed discount. Optionally, the clearing price is also used to mark to market the
+    loans of every other bank, which opens the fire-sale contagion channel to banks that did not sell.
+
+    Depositors of a seller are paid what its sale raised: its whole shortfall when the sale covers it,
+    otherwise the cash raised, the rest of the shortfall staying in its liquidity needs. (The former
+    bank-by-bank sale credited deposits with the shortfall minus the shortfall left, which counted the
+    part left unpaid twice.)
+    """
+
+    def __init__(self, discount_rate=None, price_impact=None, mark_to_market=None, max_iterations=100,
+                 tolerance=1e-12, exogenous_factors=ExogenousFactors):
+        # parameters not given are those of exogenous_factors (the model's, for the model's fire sales)
+        self.discountRate = exogenous_factors.illiquidAssetDiscountRate if discount_rate is None else discount_rate
+        self.priceImpact = exogenous_factors.illiquidAssetPriceImpact if price_impact is None else price_impact
+        self.markToMarket = exogenous_factors.areIlliquidAssetsMarkedToMarket if mark_to_market is None \
+            else mark_to_market
+        self.maxIterations = max_iterations
+        self.tolerance = tolerance
+
+        self.basePrice = 1 / (1 + self.discountRate)
+        self.price = self.basePrice
+        self.volume = 0
+
+    def clearing_price(self, holdings, liquidity_needed, market_size):
+        # Fixed point of price -> impact(total sold at that price), starting from the undisturbed price
+        price = self.basePrice
+        if self.priceImpact == 0 or market_size <= 0:
+            return price
+        for _ in range(self.maxIterations):
+            sold = np.minimum(holdings, liquidity_needed / price)
+            new_price = self.basePrice * np.exp(-self.priceImpact * np.sum(sold) / market_size)
+            if abs(new_price - price) < self.tolerance:
+                return new_price
+            price = new_price
+        return price
+
+    def clear(self, banks):
+        self.price, self.volume = self.basePrice, 0
+        sellers = [bank for bank in banks if not bank.is_liquid()]
+        if len(sellers) == 0:
+            return
+
+        model = sellers[0].model
+        all_banks = model.schedule.banks
+        loan_book = model.loanBook
+
+        # Loans are sold in segment order: less risky loans first, because it is easier to find buyers
+        segments = [segment for segment, _, _ in sellers[0].loan_book_segments()]
+        accounts = [account for _, account, _ in sellers[0].loan_book_segments()]
+        holdings = np.array([[getattr(bank.balanceSheet, account) for account in accounts] for bank in sellers])
+        holdings = np.maximum(holdings, 0)
+        total_holdings = np.sum(holdings, axis=1)
+        liquidity_needed = np.array([-bank.liquidityNeeds for bank in sellers])
+        market_size = sum(getattr(bank.balanceSheet, account) for bank in all_banks for account in accounts)
+
+        self.price = self.clearing_price(total_holdings, liquidity_needed, market_size)
+        sold = np.minimum(total_holdings, liquidity_needed / self.price)
+        fully_paid = sold < total_holdings
+        cash = sold * self.price
+        self.volume = np.sum(sold)
+
+        # ... each bank's sale is split across its segments, in order
+        sold_before = np.cumsum(holdings, axis=1) - holdings
+        sold_per_segment = np.clip(sold[:, np.newaxis] - sold_before, 0, holdings)
+        proportions_sold = np.divide(sold_per_segment, holdings, out=np.zeros_like(holdings), where=holdings > 0)
+
+        # ... and haircuts are applied to whole loan-book segments at once
+        factors = np.ones((len(all_banks), LoanBook.NUMBER_SEGMENTS))
+        seller_indices = np.array([bank.bankIndex for bank in sellers])
+        factors[seller_indices[:, np.newaxis], segments] = 1 - proportions_sold
+        if self.markToMarket:
+            remaining = factors[:, segments]
+            factors[:, segments] = remaining * (self.price / self.basePrice)
+        loan_book.scale_segments(factors)
+
+        for i, bank in enumerate(sellers):
+            # cash[i] is the whole shortfall when the sale covers it
+            bank.balanceSheet.deposits += cash[i]
+            bank.liquidityNeeds = 0 if fully_paid[i] else bank.liquidityNeeds + cash[i]
+            for k, account in enumerate(accounts):
+                setattr(bank.balanceSheet, account, getattr(bank.balanceSheet, account) - sold_per_segment[i, k])
+
+        if self.markToMarket:
+            mark = self.price / self.basePrice
+            for bank in all_banks:
+                for account in accounts:
+                    setattr(bank.balanceSheet, account, getattr(bank.balanceSheet, account) * mark)
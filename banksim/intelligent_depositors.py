@@ -0,0 +1,118 @@
+import numpy as np
+
+from banksim.agents.bank import Bank
+from banksim.strategies.depositor_ewa_strategy import DepositorEWAStrategy
+
+
+class IntelligentDepositorStage:
+    """
+    Run decisions and EWA learning of every intelligent depositor of a model, in batch.
+
+    It takes the place of the Depositor agents in the schedule: each period, the capital adequacy ratio
+    of every bank is computed once, all safety thresholds are compared against it in a single broadcast,
+    and attractions and choice probabilities of all depositors are updated as (depositors, strategies)
+    arrays. Depositors are addressed by their rows in the model's deposit book; the whole alpha grid is
+    always evaluated (pruning and coarse-to-fine learning only apply to per-agent strategy supports).
+    """
+
+    def __init__(self, model, alpha_grid=None, decay=1):
+        self.model = model
+        self.depositBook = model.depositBook
+        self.alphaGrid = alpha_grid if alpha_grid is not None else model.exogenousFactors.depositorAlphaGrid
+        self.decay = decay
+
+        number_depositors = self.depositBook.size
+        number_strategies = len(self.alphaGrid)
+        self.bankIndex = self.depositBook.bankIndex[:number_depositors]
+
+        # EWA state, one row per depositor and one column per strategy
+        self.A = np.zeros((number_depositors, number_strategies))
+        self.P = np.zeros((number_depositors, number_strategies))
+        self.F = np.zeros((number_depositors, number_strategies))
+        self.strategyProfit = np.zeros((number_depositors, number_strategies))
+        self.insolvencyCounter = np.zeros((number_depositors, number_strategies), dtype=int)
+
+        # currently chosen strategy and outcome of the cycle, per depositor
+        self.currentlyChosenStrategy = np.zeros(number_depositors, dtype=int)
+        self.safetyTreshold = np.zeros(number_depositors)
+        self.amountEarlyWithdraw = np.zeros(number_depositors)
+        self.amountFinalWithdraw = np.zeros(number_depositors)
+        self.finalConsumption = np.zeros(number_depositors)
+
+    def update_rows(self, rows):
+        # After a change of the bank population: keeps the state of the given rows of the deposit book, in
+        # that order, and starts depositors added to the book since then with no attraction to any strategy
+        number_depositors = self.depositBook.size
+        self.bankIndex = self.depositBook.bankIndex[:number_depositors]
+        for name in ('A', 'P', 'F', 'strategyProfit', 'insolvencyCounter', 'currentlyChosenStrategy',
+                     'safetyTreshold', 'amountEarlyWithdraw', 'amountFinalWithdraw', 'finalConsumption'):
+            column = getattr(self, name)
+            resized = np.zeros((number_depositors,) + column.shape[1:], dtype=column.dtype)
+            resized[:len(rows)] = column[rows]
+            setattr(self, name, resized)
+
+    def update_strategy_choice_probability(self):
+        self.A = self.decay * self.A + self.strategyProfit
+        _exp = np.exp(self.A - np.max(self.A, axis=1, keepdims=True))
+        self.P = _exp / np.sum(_exp, axis=1, keepdims=True)
+        self.F = np.cumsum(self.P, axis=1)
+
+    def pick_new_strategy(self):
+        # first strategy whose cumulative probability exceeds each depositor's threshold
+        probability_thresholds = self.model.random.get_random_uniform(1, len(self.F))
+        chosen = np.sum(self.F <= probability_thresholds[:, np.newaxis], axis=1)
+        self.currentlyChosenStrategy = np.minimum(chosen, self.F.shape[1] - 1)
+        self.safetyTreshold = self.alphaGrid.values[self.currentlyChosenStrategy]
+
+    def withdraw_deposits(self):
+        banks = self.model.schedule.banks
+        rows = slice(0, len(self.bankIndex))
+
+        bank_car = Bank.get_capital_adequacy_ratios(banks)
+        factors = self.model.exogenousFactors
+        shock = np.where(bank_car[self.bankIndex] > self.safetyTreshold, 0, factors.amountWithdrawn)
+        self.depositBook.lastPercentageWithdrawn[rows] = shock
+        amount_withdrawn = self.depositBook.amounts[rows] * shock
+        self.depositBook.amounts[rows] -= amount_withdrawn
+        self.amountEarlyWithdraw = amount_withdrawn
+
+        withdrawals = np.bincount(self.bankIndex, weights=amount_withdrawn, minlength=len(banks))
+        withdrawals_counter = np.bincount(self.bankIndex, weights=amount_withdrawn > 0, minlength=len(banks))
+        for bank in banks:
+            bank.liquidityNeeds -= withdrawals[bank.bankIndex]
+            bank.withdrawalsCounter += int(withdrawals_counter[bank.bankIndex])
+
+    def calculate_final_utility(self):
+        rows = slice(0, len(self.bankIndex))
+        initial_deposits = self.depositBook.initialAmounts[rows]
+        self.amountFinalWithdraw = self.depositBook.amounts[rows].copy()
+        final_consumption = self.amountEarlyWithdraw + self.amountFinalWithdraw
+
+        lost = final_consumption < initial_deposits
+        if self.model.exogenousFactors.isDepositInsuranceAvailable:
+            final_consumption = np.where(lost, initial_deposits * (1 + self.model.depositInterestRate),
+                                         final_consumption)
+        else:
+            self.insolvencyCounter[np.flatnonzero(lost), self.currentlyChosenStrategy[lost]] += 1
+
+        depositors = np.arange(len(self.bankIndex))
+        self.finalConsumption = final_consumption
+        profit = DepositorEWAStrategy.utility(final_consumption, initial_deposits,
+                                              self.model.exogenousFactors.depositorMinimumConsumptionRatio)
+        self.strategyProfit[depositors, self.currentlyChosenStrategy] = profit
+
+    def reset(self):
+        rows = slice(0, len(self.bankIndex))
+        self.depositBook.amounts[rows] = self.depositBook.initialAmounts[rows]
+
+    def period_0(self):
+        self.update_strategy_choice_probability()
+        self.pick_new_strategy()
+
+    def period_1(self):
+        #  Liquidity Shock (or withdrawals as events of the model's BankRunCascade)
+        if self.model.exogenousFactors.areBankRunsPossible and self.model.bankRunCascade is None:
+            self.withdraw_deposits()
+
+    def period_2(self):
+        pass
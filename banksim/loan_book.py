@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class LoanBook:
+    """
+    Loans of every corporate client of a model, stored in flat arrays.
+
+    Clients are registered bank by bank and pool by pool, so each loan-book segment of a bank is a
+    contiguous range of rows and whole segments (or the whole economy) can be updated at once.
+    """
+
+    # Loan-book segments
+    STANDARD = 0
+    LOW_RISK = 1
+    HIGH_RISK = 2
+    NUMBER_SEGMENTS = 3
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.loanAmounts = np.zeros(capacity)
+        self.bankIndex = np.zeros(capacity, dtype=int)
+        self.segment = np.zeros(capacity, dtype=int)
+        self.riskWeight = np.zeros(capacity)
+        # added to the contract rate of every client, as monetary policy moves (see MonetaryPolicy)
+        self.interestRateShift = 0
+
+    def add_client(self, bank_index, segment, risk_weight):
+        if self.size == len(self.loanAmounts):
+            self.grow(2 * self.size)
+        row = self.size
+        self.bankIndex[row] = bank_index
+        self.segment[row] = segment
+        self.riskWeight[row] = risk_weight
+        self.size += 1
+        return row
+
+    def grow(self, capacity):
+        for name in ('loanAmounts', 'bankIndex', 'segment', 'riskWeight'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def compact(self, rows, bank_index):
+        # Keeps only the given rows, in that order, with new bank indices; capacity is kept for entrants
+        for name in ('loanAmounts', 'segment', 'riskWeight'):
+            column = getattr(self, name)
+            column[:len(rows)] = column[rows]
+        self.bankIndex[:len(rows)] = bank_index
+        self.size = len(rows)
+
+    @staticmethod
+    def rows(clients):
+        # clients of a segment are always a prefix of a bank's pool, hence contiguous
+        if len(clients) == 0:
+            return slice(0, 0)
+        return slice(clients[0].loanIndex, clients[-1].loanIndex + 1)
+
+    def segment_totals(self, number_banks, weighted=False):
+        # Loans per bank and segment, as a (number_banks, NUMBER_SEGMENTS) array
+        amounts = self.loanAmounts[:self.size]
+        if weighted:
+            amounts = amounts * self.riskWeight[:self.size]
+        keys = self.bankIndex[:self.size] * LoanBook.NUMBER_SEGMENTS + self.segment[:self.size]
+        totals = np.bincount(keys, weights=amounts, minlength=number_banks * LoanBook.NUMBER_SEGMENTS)
+        return totals.reshape(number_banks, LoanBook.NUMBER_SEGMENTS)
+
+    def scale_banks(self, factors):
+        # Applies a per-bank factor to every loan of each bank
+        self.loanAmounts[:self.size] *= factors[self.bankIndex[:self.size]]
+
+    def scale_segments(self, factors):
+        # Applies a per-bank, per-segment factor, given as a (number_banks, NUMBER_SEGMENTS) array
+        self.loanAmounts[:self.size] *= factors[self.bankIndex[:self.size], self.segment[:self.size]]
@@ -0,0 +1,201 @@
+import numpy as np
+
+from banksim.exogeneous_factors import LoanAmortization
+from banksim.loan_book import LoanBook
+
+
+class LoanLedger:
+    """
+    Multi-period corporate loans, as tranches (one per client and origination cycle) stored in flat arrays.
+
+    A tranche is a loan-book row, its outstanding principal, the interest rate it was written at, the
+    number of periods left and its scheduled principal payment per period (the whole principal at
+    maturity for bullet loans). Every cycle:
+
+    - each bank sets its target loans as usual, and only the part not covered by the outstanding principal
+      of its clients is originated, as new tranches maturing in `loanMaturity` periods (see originate);
+    - in period 2, all tranches are aged at once: a client defaults on every tranche it holds, otherwise it
+      pays interest and the scheduled principal. The loan-book row of a client then holds what was
+      collected plus what is still outstanding, so with one-period bullet loans this is the usual
+      single-cycle settlement;
+    - at the end of the cycle, haircuts the banks suffered after collection (insolvency penalties, fire
+      sales, liquidation) are passed on to their outstanding tranches, and closed tranches are dropped.
+
+    In-cycle changes of the loan book before collection (deleveraging, fire sales) scale the tranches of
+    each row in proportion. Everything is done in bulk, over all tranches of the economy.
+    """
+
+    def __init__(self, model, maturity=None, amortization=None, capacity=1024):
+        self.model = model
+        self.maturity = model.exogenousFactors.loanMaturity if maturity is None else maturity
+        self.amortization = model.exogenousFactors.loanAmortization if amortization is None else amortization
+
+        # tranches
+        self.size = 0
+        self.row = np.zeros(capacity, dtype=int)
+        self.principal = np.zeros(capacity)
+        self.interestRate = np.zeros(capacity)
+        self.remainingPeriods = np.zeros(capacity, dtype=int)
+        self.installment = np.zeros(capacity)
+
+        # per loan-book row: outstanding principal, amount booked this cycle and client parameters
+        self.outstanding = np.zeros(0)
+        self.booked = np.zeros(0)
+        self.collectedValue = np.zeros(0)
+        self.refresh_clients()
+
+    def refresh_clients(self):
+        # client parameters by loan-book row, after clients were added
+        schedule = self.model.schedule
+        pools = (schedule.corporate_clients, schedule.LowRiskpoolcorporate_clients,
+                 schedule.HighRiskpoolcorporate_clients)
+        clients = sorted((client for pool in pools for client in pool), key=lambda _: _.loanIndex)
+        self.defaultRate = np.array([_.probabilityOfDefault for _ in clients], dtype=float)
+        self.lossGivenDefault = np.array([_.lossGivenDefault for _ in clients], dtype=float)
+        self.loanInterestRate = np.array([_.loanInterestRate for _ in clients], dtype=float)
+        for name in ('outstanding', 'booked'):
+            column = getattr(self, name)
+            resized = np.zeros(len(clients))
+            resized[:min(len(column), len(clients))] = column[:len(clients)]
+            setattr(self, name, resized)
+
+    def grow(self, capacity):
+        for name in ('row', 'principal', 'interestRate', 'remainingPeriods', 'installment'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def add_tranches(self, rows, principal):
+        if self.size + len(rows) > len(self.row):
+            self.grow(max(2 * len(self.row), self.size + len(rows)))
+        new = slice(self.size, self.size + len(rows))
+        self.row[new] = rows
+        self.principal[new] = principal
+        # fixed rate, at the monetary conditions of origination
+        self.interestRate[new] = self.loanInterestRate[rows] + self.model.loanBook.interestRateShift
+        self.remainingPeriods[new] = self.maturity
+        self.installment[new] = principal / self.maturity if self.amortization == LoanAmortization.Linear else 0
+        self.size += len(rows)
+
+    def originate(self, bank):
+        # Tops up the loans set by bank.setup_balance_sheet with the outstanding principal of its clients.
+        # Seasoned loans can not be called back, so a bank may hold more loans than its strategy targets,
+        # in which case the difference comes from its liquid assets.
+        loan_amounts = self.model.loanBook.loanAmounts
+        for _, account, pool in self.loan_pools(bank):
+            rows = LoanBook.rows(pool)
+            target = loan_amounts[rows]
+            carried = self.outstanding[rows]
+            new = np.maximum(target - carried, 0)
+            loan_amounts[rows] = carried + new
+            self.booked[rows] = loan_amounts[rows]
+            originated = np.flatnonzero(new > 0)
+            self.add_tranches(rows.start + originated, new[originated])
+
+            total = np.sum(loan_amounts[rows])
+            bank.balanceSheet.liquidAssets -= total - getattr(bank.balanceSheet, account)
+            setattr(bank.balanceSheet, account, total)
+
+    @staticmethod
+    def loan_pools(bank):
+        # every client a bank can lend to in each segment, since former clients may still owe it money
+        if bank.model.exogenousFactors.isMonetaryPolicyAvailable:
+            return ((LoanBook.LOW_RISK, 'nonFinancialSectorLoanLowRisk', bank.LowRiskpoolcorporateClients),
+                    (LoanBook.HIGH_RISK, 'nonFinancialSectorLoanHighRisk', bank.HighRiskpoolcorporateClients))
+        return ((LoanBook.STANDARD, 'nonFinancialSectorLoan', bank.corporateClients),)
+
+    def collect(self):
+        loan_book = self.model.loanBook
+        number_rows = loan_book.size
+        tranches = slice(0, self.size)
+        rows, principal = self.row[tranches], self.principal[tranches]
+
+        # deleveraging and fire sales since origination scale every tranche of a row alike
+        loan_amounts = loan_book.loanAmounts[:number_rows]
+        scale = np.divide(loan_amounts, self.booked, out=np.zeros(number_rows), where=self.booked > 0)
+        principal *= scale[rows]
+        self.installment[tranches] *= scale[rows]
+
+        common_random_numbers = self.model.commonRandomNumbers
+        if common_random_numbers is None:
+            uniforms = self.model.random.get_random_uniform(1, number_rows)
+        else:
+            uniforms = common_random_numbers.default_uniforms(self.model.schedule.cycle)[:number_rows]
+        defaults = uniforms <= self.defaultRate
+        defaulted = defaults[rows]
+        due = np.where(self.remainingPeriods[tranches] <= 1, principal,
+                       np.minimum(self.installment[tranches], principal))
+        cash = np.where(defaulted, principal * (1 - self.lossGivenDefault[rows]),
+                        principal * self.interestRate[tranches] + due)
+        principal -= np.where(defaulted, principal, due)
+        self.remainingPeriods[tranches] -= 1
+
+        self.outstanding = np.bincount(rows, weights=principal, minlength=number_rows)
+        loan_amounts[:] = np.bincount(rows, weights=cash, minlength=number_rows) + self.outstanding
+        self.collectedValue = loan_book.segment_totals(len(self.model.schedule.banks))
+
+        for bank in self.model.schedule.banks:
+            for segment, account, _ in self.loan_pools(bank):
+                setattr(bank.balanceSheet, account, self.collectedValue[bank.bankIndex, segment])
+
+    def close_cycle(self):
+        # Losses booked on the balance sheets after collection reach the outstanding tranches, pro rata
+        banks = self.model.schedule.banks
+        held = np.zeros_like(self.collectedValue)
+        for bank in banks:
+            for segment, account, _ in self.loan_pools(bank):
+                held[bank.bankIndex, segment] = getattr(bank.balanceSheet, account)
+        factors = np.divide(held, self.collectedValue, out=np.zeros_like(held), where=self.collectedValue > 0)
+        factors = np.clip(factors, 0, 1)
+
+        loan_book = self.model.loanBook
+        tranches = slice(0, self.size)
+        rows = self.row[tranches]
+        factors = factors[loan_book.bankIndex[rows], loan_book.segment[rows]]
+        self.principal[tranches] *= factors
+        self.installment[tranches] *= factors
+        self.compact(np.flatnonzero((self.principal[tranches] > 0) & (self.remainingPeriods[tranches] > 0)))
+        self.outstanding = np.bincount(self.row[:self.size], weights=self.principal[:self.size],
+                                       minlength=loan_book.size)
+
+    def compact(self, tranches):
+        # Keeps the given tranches, in that order
+        for name in ('row', 'principal', 'interestRate', 'remainingPeriods', 'installment'):
+            column = getattr(self, name)
+            column[:len(tranches)] = column[tranches]
+        self.size = len(tranches)
+
+    def move_rows(self, row_position):
+        # After the loan book was compacted (see BankPopulation): row_position maps every former row to its
+        # new one, or to -1 when the client left with its bank
+        rows = row_position[self.row[:self.size]]
+        kept = np.flatnonzero(rows >= 0)
+        self.compact(kept)
+        self.row[:self.size] = rows[kept]
+        number_rows = self.model.loanBook.size
+        self.outstanding = np.bincount(self.row[:self.size], weights=self.principal[:self.size],
+                                       minlength=number_rows)
+        self.booked = np.zeros(number_rows)
+
+    def maturity_ladder(self):
+        # Outstanding principal per bank and number of periods left, as a (banks, maturity) array
+        loan_book = self.model.loanBook
+        number_banks = len(self.model.schedule.banks)
+        tranches = slice(0, self.size)
+        keys = loan_book.bankIndex[self.row[tranches]] * self.maturity + self.remainingPeriods[tranches] - 1
+        ladder = np.bincount(keys, weights=self.principal[tranches], minlength=number_banks * self.maturity)
+        return ladder.reshape(number_banks, self.maturity)
+
+    def reset(self):
+        pass
+
+    def period_0(self):
+        pass
+
+    def period_1(self):
+        pass
+
+    def period_2(self):
+        # before the banks, which then read their collected loans (see Bank.collect_loans)
+        self.collect()
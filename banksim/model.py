@@ -1,14 +1,14 @@
-from mesa import Model
-
-from numba import njit, prange
-
 from banksim.activation import MultiStepActivation
 from banksim.agents.bank import Bank
 from banksim.agents.central_bank import CentralBank
 from banksim.agents.clearing_house import ClearingHouse
 from banksim.agents.corporate_client import CorporateClient
 from banksim.agents.depositor import Depositor
+from banksim.base import Model
+from banksim.deposit_book import DepositBook
 from banksim.exogeneous_factors import ExogenousFactors, SimulationType, InterbankPriority
+from banksim.loan_book import LoanBook
+from banksim.streaming import CycleSnapshot
 
 
 class BankingModel(Model):
@@ -22,107 +22,218 @@ class BankingModel(Model):
     The paper is available online at https://mpra.ub.uni-muenchen.de/73308.
     """
 
-    def __init__(self, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None):
-        super().__init__()
+    def __init__(self, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None, seed=None,
+                 common_random_numbers=None):
+        super().__init__(seed)
 
         # Simulation data
         self.simulation_type = SimulationType[simulation_type]
-        BankingModel.update_exogeneous_factors_by_simulation_type(self.simulation_type)
+        self.exogenousFactors = factors = ExogenousFactors()
+        self.update_exogeneous_factors_by_simulation_type(self.simulation_type)
 
-        BankingModel.update_exogeneous_factors(exogenous_factors, number_of_banks)
+        self.update_exogeneous_factors(exogenous_factors, number_of_banks)
 
         # Economy data
-        self.numberBanks = ExogenousFactors.numberBanks
-        self.depositInterestRate = ExogenousFactors.depositInterestRate
-        self.interbankInterestRate = ExogenousFactors.interbankInterestRate
-        self.liquidAssetsInterestRate = ExogenousFactors.liquidAssetsInterestRate
-        self.interbankLendingMarketAvailable = ExogenousFactors.interbankLendingMarketAvailable
+        self.numberBanks = factors.numberBanks
+        self.depositInterestRate = factors.depositInterestRate
+        self.interbankInterestRate = factors.interbankInterestRate
+        self.liquidAssetsInterestRate = factors.liquidAssetsInterestRate
+        self.interbankLendingMarketAvailable = factors.interbankLendingMarketAvailable
 
         # Scheduler
         self.schedule = MultiStepActivation(self)
 
+        # Loans of all corporate clients
+        self.loanBook = LoanBook()
+        # ... and deposits of all depositors
+        self.depositBook = DepositBook()
+
         # Central Bank
-        _params = (ExogenousFactors.centralBankLendingInterestRate,
-                   ExogenousFactors.offersDiscountWindowLending,
-                   ExogenousFactors.minimumCapitalAdequacyRatio,
-                   not ExogenousFactors.isCentralBankZeroIntelligenceAgent,
-                   ExogenousFactors.DefaultEWADampingFactor)
+        _params = (factors.centralBankLendingInterestRate,
+                   factors.offersDiscountWindowLending,
+                   factors.minimumCapitalAdequacyRatio,
+                   not factors.isCentralBankZeroIntelligenceAgent,
+                   factors.DefaultEWADampingFactor)
         self.schedule.add_central_bank(CentralBank(*_params, self))
 
         # Clearing House
         _params = (self.numberBanks,
-                   ExogenousFactors.isClearingGuaranteeAvailable)
+                   factors.isClearingGuaranteeAvailable)
         self.schedule.add_clearing_house(ClearingHouse(*_params, self))
 
         # Banks
-        _params = (ExogenousFactors.bankSizeDistribution,
-                   not ExogenousFactors.areBanksZeroIntelligenceAgents,
-                   ExogenousFactors.DefaultEWADampingFactor)
         for _ in range(self.numberBanks):
-            bank = Bank(*_params, self)
-            self.schedule.add_bank(bank)
+            self.add_bank()
         self.normalize_banks()
-        
 
+        # Depositors and Corporate Clients (Firms)
+        for bank in self.schedule.banks:
+            self.add_depositors_and_corporate_clients(bank)
+
+        self.schedule.index_populations()
+
+        # Intelligent depositors decide and learn all at once
+        self.depositorStage = None
+        if not factors.areDepositorsZeroIntelligenceAgents and factors.isDepositorLearningVectorized:
+            from banksim.intelligent_depositors import IntelligentDepositorStage
+            self.depositorStage = IntelligentDepositorStage(self)
+
+        # Loans spanning several cycles, aged all at once
+        self.loanLedger = None
+        if factors.areLoansMultiPeriod:
+            if factors.numberWorkerProcesses > 0:
+                raise ValueError('Multi-period loans are collected by the loan ledger, not by worker processes')
+            from banksim.loan_ledger import LoanLedger
+            self.loanLedger = LoanLedger(self)
+
+        # Bank runs within period 1, event by event
+        self.bankRunCascade = None
+        if factors.isBankRunCascadeActive:
+            if factors.numberWorkerProcesses > 0:
+                raise ValueError('The bank-run cascade processes withdrawals one by one, not in worker processes')
+            from banksim.bank_run_cascade import BankRunCascade
+            self.bankRunCascade = BankRunCascade(self)
+
+        # Per-bank phases in parallel, over shared memory
+        self.phaseExecutor = None
+        if factors.numberWorkerProcesses > 0:
+            if self.depositorStage is None and not factors.areDepositorsZeroIntelligenceAgents:
+                raise ValueError('Intelligent depositors learn one by one, not in worker processes: '
+                                 'set isDepositorLearningVectorized')
+            from banksim.parallel import ParallelPhaseExecutor
+            self.phaseExecutor = ParallelPhaseExecutor(self, factors.numberWorkerProcesses)
+
+        # Failed banks leave, new banks enter and mergers happen between cycles
+        self.bankPopulation = None
+        if factors.isBankEntryAndExitActive:
+            from banksim.bank_population import BankPopulation
+            self.bankPopulation = BankPopulation(self)
+
+        # Withdrawals, defaults and interbank queues drawn from streams shared across scenarios, if given
+        self.commonRandomNumbers = None
+        if common_random_numbers is not None:
+            self.use_common_random_numbers(common_random_numbers)
+
+    def use_common_random_numbers(self, common_random_numbers):
+        common_random_numbers.check(self)
+        self.commonRandomNumbers = common_random_numbers
+
+    def add_bank(self):
+        factors = self.exogenousFactors
+        _params = (factors.bankSizeDistribution,
+                   not factors.areBanksZeroIntelligenceAgents,
+                   factors.DefaultEWADampingFactor)
+        bank = Bank(*_params, self)
+        self.schedule.add_bank(bank)
+        return bank
+
+    def add_depositors_and_corporate_clients(self, bank):
+        factors = self.exogenousFactors
         _params_depositors = (
-            not ExogenousFactors.areDepositorsZeroIntelligenceAgents,
-            ExogenousFactors.DefaultEWADampingFactor)
+            not factors.areDepositorsZeroIntelligenceAgents,
+            factors.DefaultEWADampingFactor)
 
-        # Depositors and Corporate Clients (Firms)
+        if factors.isMonetaryPolicyAvailable:        
+            _params_corporate_clientsHighRisk = (factors.HighRiskCorporateClientDefaultRate,
+                                             factors.HighRiskCorporateClientLossGivenDefault,
+                                             factors.HighRiskCorporateClientLoanInterestRate)
         
-        if ExogenousFactors.isMonetaryPolicyAvailable:        
-            _params_corporate_clientsHighRisk = (ExogenousFactors.HighRiskCorporateClientDefaultRate,
-                                             ExogenousFactors.HighRiskCorporateClientLossGivenDefault,
-                                             ExogenousFactors.HighRiskCorporateClientLoanInterestRate)
-        
-            _params_corporate_clientsLowRisk = (ExogenousFactors.LowRiskCorporateClientDefaultRate,
-                                             ExogenousFactors.LowRiskCorporateClientLossGivenDefault,
-                                             ExogenousFactors.LowRiskCorporateClientLoanInterestRate)
+            _params_corporate_clientsLowRisk = (factors.LowRiskCorporateClientDefaultRate,
+                                             factors.LowRiskCorporateClientLossGivenDefault,
+                                             factors.LowRiskCorporateClientLoanInterestRate)
 
         else:
-            if ExogenousFactors.standardCorporateClients:
-                _params_corporate_clients = (ExogenousFactors.standardCorporateClientDefaultRate,
-                                             ExogenousFactors.standardCorporateClientLossGivenDefault,
-                                             ExogenousFactors.standardCorporateClientLoanInterestRate)
+            if factors.standardCorporateClients:
+                _params_corporate_clients = (factors.standardCorporateClientDefaultRate,
+                                             factors.standardCorporateClientLossGivenDefault,
+                                             factors.standardCorporateClientLoanInterestRate)
             else:
-                _params_corporate_clients = (ExogenousFactors.wholesaleCorporateClientDefaultRate,
-                                             ExogenousFactors.wholesaleCorporateClientLossGivenDefault,
-                                             ExogenousFactors.wholesaleCorporateClientLoanInterestRate)
+                _params_corporate_clients = (factors.wholesaleCorporateClientDefaultRate,
+                                             factors.wholesaleCorporateClientLossGivenDefault,
+                                             factors.wholesaleCorporateClientLoanInterestRate)
 
-            
-        for bank in self.schedule.banks:
-            for i in range(ExogenousFactors.numberDepositorsPerBank):
-                depositor = Depositor(*_params_depositors, bank, self)
-                bank.depositors.append(depositor)
-                self.schedule.add_depositor(depositor)
-            
-            if ExogenousFactors.isMonetaryPolicyAvailable:
-                for i in range(ExogenousFactors.numberCorporateClientsPerBank):
-                    corporate_client = CorporateClient(*_params_corporate_clientsLowRisk, bank, self)
-                    bank.LowRiskpoolcorporateClients.append(corporate_client)
-                    self.schedule.add_corporate_client_LowRisk(corporate_client)
-                for i in range(ExogenousFactors.numberCorporateClientsPerBank):
-                    corporate_client = CorporateClient(*_params_corporate_clientsHighRisk, bank, self)
-                    bank.HighRiskpoolcorporateClients.append(corporate_client)
-                    self.schedule.add_corporate_client_HighRisk(corporate_client)
-            else:
-                for i in range(ExogenousFactors.numberCorporateClientsPerBank):
+        for i in range(factors.numberDepositorsPerBank):
+            depositor = Depositor(*_params_depositors, bank, self)
+            bank.depositors.append(depositor)
+            self.schedule.add_depositor(depositor)
+
+        if factors.isMonetaryPolicyAvailable:
+            for i in range(factors.numberCorporateClientsPerBank):
+                corporate_client = CorporateClient(*_params_corporate_clientsLowRisk, bank, self,
+                                                   LoanBook.LOW_RISK)
+                bank.LowRiskpoolcorporateClients.append(corporate_client)
+                self.schedule.add_corporate_client_LowRisk(corporate_client)
+            for i in range(factors.numberCorporateClientsPerBank):
+                corporate_client = CorporateClient(*_params_corporate_clientsHighRisk, bank, self,
+                                                   LoanBook.HIGH_RISK)
+                bank.HighRiskpoolcorporateClients.append(corporate_client)
+                self.schedule.add_corporate_client_HighRisk(corporate_client)
+        else:
+            for i in range(factors.numberCorporateClientsPerBank):
                 corporate_client = CorporateClient(*_params_corporate_clients, bank, self)
                 bank.corporateClients.append(corporate_client)
                 self.schedule.add_corporate_client(corporate_client)
-                    
-    @jit(parallel = True)       
+
     def step(self):
         self.schedule.reset_cycle()
         self.schedule.period_0()
         self.schedule.period_1()
         self.schedule.period_2()
-        
-    
+        if self.loanLedger is not None:
+            self.loanLedger.close_cycle()
+        if self.bankPopulation is not None:
+            self.bankPopulation.update()
+
     def run_model(self, n):
         for i in range(n):
             self.step()
         self.running = False        
+
+    def run_until_converged(self, tol=1e-3, max_cycles=1000, divergence='tv', window=50, ci_width=None):
+        # Runs until strategy probabilities (and, with ci_width, the insolvency rate) settle, or for
+        # max_cycles cycles; returns the number of cycles run. Diagnostics are kept in self.convergence.
+        from banksim.convergence import ConvergenceMonitor
+        self.convergence = ConvergenceMonitor(self, divergence, window)
+        for i in range(max_cycles):
+            self.step()
+            self.convergence.update()
+            if self.convergence.is_converged(tol, ci_width):
+                break
+        self.running = False
+        return len(self.convergence.history)
+
+    def close(self):
+        # Stops the worker processes, if any; the model can still be run serially afterwards
+        if self.phaseExecutor is not None:
+            self.phaseExecutor.close()
+            self.phaseExecutor = None
+
+    def advance(self):
+        self.step()
+        return self.snapshot()
+
+    def iter_cycles(self, n):
+        # Runs n cycles, yielding a snapshot after each one
+        for i in range(n):
+            yield self.advance()
+        self.running = False
+
+    def astream(self, n):
+        # Same as iter_cycles, for asyncio consumers: async for snapshot in model.astream(n)
+        from banksim.streaming import CycleStream
+        return CycleStream(self, n)
+
+    def snapshot(self):
+        central_bank = self.schedule.central_bank
+        clearing_house = self.schedule.clearing_house
+        interbank_lending_matrix = clearing_house.interbankLendingMatrix.copy()
+        interbank_lending_matrix.flags.writeable = False
+        return CycleSnapshot(cycle=self.schedule.cycle,
+                             insolvencies=central_bank.insolvencyPerCycleCounter,
+                             contagions=central_bank.insolvencyDueToContagionPerCycleCounter,
+                             totalLoans=central_bank.get_total_real_sector_loans(self.schedule.banks),
+                             totalInterbankDebt=clearing_house.totalInterbankDebt,
+                             interbankLendingMatrix=interbank_lending_matrix)
         
     def normalize_banks(self):
         # Normalize banks size and Compute market share (in % of total assets)
@@ -131,53 +242,52 @@ class BankingModel(Model):
         for bank in self.schedule.banks:
             bank.marketShare = bank.initialSize / total_size
             bank.initialSize *= factor
-   
 
-    @staticmethod
-    def update_exogeneous_factors(exogenous_factors, number_of_banks):
+    def update_exogeneous_factors(self, exogenous_factors, number_of_banks):
+        factors = self.exogenousFactors
         if isinstance(exogenous_factors, dict):
             for key, value in exogenous_factors.items():
-                setattr(ExogenousFactors, key, value)
+                setattr(factors, key, value)
 
         if number_of_banks:
-            ExogenousFactors.numberBanks = number_of_banks
+            factors.numberBanks = number_of_banks
 
-    @staticmethod
-    def update_exogeneous_factors_by_simulation_type(simulation_type):
+    def update_exogeneous_factors_by_simulation_type(self, simulation_type):
+        factors = self.exogenousFactors
         if simulation_type == SimulationType.HighSpread:
             pass
         if simulation_type == SimulationType.LowSpread:
-            ExogenousFactors.standardCorporateClientLoanInterestRate = 0.06
+            factors.standardCorporateClientLoanInterestRate = 0.06
         elif simulation_type == SimulationType.ClearingHouse:
-            ExogenousFactors.isClearingGuaranteeAvailable = True
+            factors.isClearingGuaranteeAvailable = True
         elif simulation_type == SimulationType.ClearingHouseLowSpread:
-            ExogenousFactors.isClearingGuaranteeAvailable = True
-            ExogenousFactors.standardCorporateClientLoanInterestRate = 0.06
+            factors.isClearingGuaranteeAvailable = True
+            factors.standardCorporateClientLoanInterestRate = 0.06
         elif simulation_type == SimulationType.Basel:
-            ExogenousFactors.standardCorporateClients = False
-            ExogenousFactors.isCentralBankZeroIntelligenceAgent = False
-            ExogenousFactors.isCapitalRequirementActive = True
-            ExogenousFactors.interbankPriority = InterbankPriority.RiskSorted
-            ExogenousFactors.standardCorporateClientDefaultRate = 0.05
+            factors.standardCorporateClients = False
+            factors.isCentralBankZeroIntelligenceAgent = False
+            factors.isCapitalRequirementActive = True
+            factors.interbankPriority = InterbankPriority.RiskSorted
+            factors.standardCorporateClientDefaultRate = 0.05
         elif simulation_type == SimulationType.BaselBenchmark:
-            ExogenousFactors.standardCorporateClients = False
-            ExogenousFactors.standardCorporateClientDefaultRate = 0.05
+            factors.standardCorporateClients = False
+            factors.standardCorporateClientDefaultRate = 0.05
         elif simulation_type == SimulationType.DepositInsurance:
-            ExogenousFactors.areDepositorsZeroIntelligenceAgents = False
-            ExogenousFactors.isDepositInsuranceAvailable = True
+            factors.areDepositorsZeroIntelligenceAgents = False
+            factors.isDepositInsuranceAvailable = True
         elif simulation_type == SimulationType.DepositInsuranceBenchmark:
-            ExogenousFactors.areDepositorsZeroIntelligenceAgents = False
+            factors.areDepositorsZeroIntelligenceAgents = False
         elif simulation_type == SimulationType.RestrictiveMonetaryPolicy:
-            ExogenousFactors.interbankInterestRate = 0.03
-            ExogenousFactors.LowRiskCorporateClientDefaultRate = 0.05
-            ExogenousFactors.HighRiskCorporateClientDefaultRate = 0.09
-            ExogenousFactors.HighRiskCorporateClientLoanInterestRate = 0.07
-            ExogenousFactors.LowRiskCorporateClientLoanInterestRate = 0.04
-            ExogenousFactors.probabilityofWithdrawal = 0.25
+            factors.interbankInterestRate = 0.03
+            factors.LowRiskCorporateClientDefaultRate = 0.05
+            factors.HighRiskCorporateClientDefaultRate = 0.09
+            factors.HighRiskCorporateClientLoanInterestRate = 0.07
+            factors.LowRiskCorporateClientLoanInterestRate = 0.04
+            factors.probabilityofWithdrawal = 0.25
         elif simulation_type == SimulationType.ExpansiveMonetaryPolicy:
-            ExogenousFactors.interbankInterestRate = 0.01
-            ExogenousFactors.LowRiskCorporateClientDefaultRate = 0.02
-            ExogenousFactors.HighRiskCorporateClientDefaultRate = 0.03
-            ExogenousFactors.HighRiskCorporateClientLoanInterestRate = 0.05
-            ExogenousFactors.LowRiskCorporateClientLoanInterestRate = 0.04
-            ExogenousFactors.probabilityofWithdrawal = 0.15
+            factors.interbankInterestRate = 0.01
+            factors.LowRiskCorporateClientDefaultRate = 0.02
+            factors.HighRiskCorporateClientDefaultRate = 0.03
+            factors.HighRiskCorporateClientLoanInterestRate = 0.05
+            factors.LowRiskCorporateClientLoanInterestRate = 0.04
+            factors.probabilityofWithdrawal = 0.15
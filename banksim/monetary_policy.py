@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class MonetaryPolicy:
+    """
+    Policy-rate rule of the central bank, and transmission of the policy rate to every other rate.
+
+    The policy rate is the interbank rate the central bank targets. Its neutral level is the interbank rate
+    of the scenario, and each cycle it follows a smoothed Taylor-type rule
+
+        rate = policyRateSmoothing * previous rate + (1 - policyRateSmoothing) *
+               (neutral rate + creditGapWeight * credit gap - financialStressWeight * insolvency rate),
+
+    bounded below by policyRateLowerBound. The credit gap is the log deviation of total corporate loans from
+    their exponentially weighted trend, and the insolvency rate is the share of banks found insolvent last
+    cycle. Alternatively, it follows policyRatePath, one rate per cycle (the last one thereafter). A rate
+    shock (see ShockSchedule) sets the policy rate of a cycle over either, and the rule goes on from it.
+
+    The distance of the policy rate from neutral moves the rate of the discount window and the rate paid on
+    reserves one for one (the corridor around it), and deposit and loan rates by their pass-through. The
+    reserves of a bank are its liquid assets, paid liquidAssetsInterestRate (the floor of the corridor). Loan
+    rates move for the whole loan book at once (see LoanBook.interestRateShift), so setting every rate
+    costs the same whatever the number of banks and clients. With no gap, every rate is the constant of
+    the scenario.
+    """
+
+    def __init__(self, central_bank):
+        self.centralBank = central_bank
+        self.model = central_bank.model
+        self.factors = self.model.exogenousFactors
+        self.neutralRate = self.factors.interbankInterestRate
+        self.policyRate = self.neutralRate
+        self.path = None
+        if self.factors.policyRatePath is not None:
+            self.path = np.asarray(self.factors.policyRatePath, dtype=float)
+        # policy rate of the next cycle set from outside the rule, e.g. by a stress test
+        self.shockedRate = None
+
+        self.creditTrend = None
+        self.creditGap = 0
+        self.insolvencyRate = 0
+        # policy rate of each cycle
+        self.history = []
+
+    def observe(self, total_loans, number_insolvencies, number_banks):
+        # End of a cycle: credit against its trend, and share of insolvent banks
+        if self.creditTrend is None:
+            self.creditTrend = total_loans
+        if total_loans > 0 and self.creditTrend > 0:
+            self.creditGap = np.log(total_loans / self.creditTrend)
+        else:
+            self.creditGap = 0
+        self.creditTrend += self.factors.creditTrendWeight * (total_loans - self.creditTrend)
+        self.insolvencyRate = number_insolvencies / number_banks
+
+    def taylor_rate(self):
+        target = self.neutralRate + self.factors.creditGapWeight * self.creditGap - \
+            self.factors.financialStressWeight * self.insolvencyRate
+        smoothing = self.factors.policyRateSmoothing
+        rate = smoothing * self.policyRate + (1 - smoothing) * target
+        return max(rate, self.factors.policyRateLowerBound)
+
+    def set_rates(self, cycle):
+        if self.shockedRate is not None:
+            self.policyRate = self.shockedRate
+        elif self.path is not None:
+            self.policyRate = self.path[min(cycle, len(self.path)) - 1]
+        else:
+            self.policyRate = self.taylor_rate()
+        self.history.append(self.policyRate)
+        self.transmit()
+
+    def transmit(self):
+        model = self.model
+        gap = self.policyRate - self.neutralRate
+        model.interbankInterestRate = self.policyRate
+        self.centralBank.centralBankLendingInterestRate = self.factors.centralBankLendingInterestRate + gap
+        model.liquidAssetsInterestRate = self.factors.liquidAssetsInterestRate + gap
+        model.depositInterestRate = self.factors.depositInterestRate + \
+            self.factors.depositRatePassThrough * gap
+        model.loanBook.interestRateShift = self.factors.loanRatePassThrough * gap
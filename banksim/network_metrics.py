@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class InterbankNetworkMetrics:
+    """
+    Interbank network analytics computed directly on the cycle's exposure edges.
+
+    The interbank market is rebuilt from scratch every cycle, so the edge list produced by the clearing
+    house matching already is the whole network. Every metric below works on the (lender, borrower) edge
+    arrays, in O(number of edges) per bank or per propagation step, and never on a dense graph object.
+    """
+
+    def __init__(self, number_banks, number_largest_exposures=10, debt_rank_max_iterations=20):
+        self.numberBanks = number_banks
+        self.numberLargestExposures = number_largest_exposures
+        self.debtRankMaxIterations = debt_rank_max_iterations
+        self.history = []
+        self.reset()
+
+    def reset(self):
+        n = self.numberBanks
+        self.inDegree = np.zeros(n, dtype=int)
+        self.outDegree = np.zeros(n, dtype=int)
+        self.interbankAssets = np.zeros(n)
+        self.interbankLiabilities = np.zeros(n)
+        self.exposureConcentration = np.zeros(n)
+        self.largestExposures = np.zeros(0, dtype=[('lender', int), ('borrower', int), ('amount', float)])
+        self.debtRank = np.zeros(n)
+        self.coreness = np.zeros(n)
+
+    def update(self, lenders, borrowers, exposures, equity):
+        """
+        lenders, borrowers: bank indices of each interbank loan of the cycle
+        exposures: outstanding amount of each loan, from the lender's point of view
+        equity: shareholders' equity of each bank (positive when solvent)
+        """
+        self.reset()
+        n = self.numberBanks
+        if len(lenders) > 0:
+            self.outDegree = np.bincount(lenders, minlength=n)
+            self.inDegree = np.bincount(borrowers, minlength=n)
+            self.interbankAssets = np.bincount(lenders, weights=exposures, minlength=n)
+            self.interbankLiabilities = np.bincount(borrowers, weights=exposures, minlength=n)
+
+            # Herfindahl index of each lender's exposures
+            squared = np.bincount(lenders, weights=exposures ** 2, minlength=n)
+            lending = self.interbankAssets > 0
+            self.exposureConcentration[lending] = squared[lending] / self.interbankAssets[lending] ** 2
+
+            k = min(self.numberLargestExposures, len(exposures))
+            largest = np.argpartition(exposures, -k)[-k:]
+            largest = largest[np.argsort(exposures[largest])[::-1]]
+            self.largestExposures = np.array(list(zip(lenders[largest], borrowers[largest], exposures[largest])),
+                                             dtype=self.largestExposures.dtype)
+
+            self.debtRank = self.calculate_debt_rank(lenders, borrowers, exposures, equity)
+            self.coreness = self.calculate_coreness(lenders, borrowers, exposures)
+
+        self.history.append(self.summary())
+
+    def calculate_debt_rank(self, lenders, borrowers, exposures, equity):
+        # DebtRank (Battiston et al., 2012) of every bank, all seeds propagated at once.
+        # Column s of `h` holds the distress of every bank when seeds[s] is the initially distressed one;
+        # only borrowers can distress anybody, every other bank has a DebtRank of zero.
+        n = self.numberBanks
+        order = np.argsort(lenders, kind='mergesort')
+        lenders, borrowers, exposures = lenders[order], borrowers[order], exposures[order]
+        group_lenders, group_starts = np.unique(lenders, return_index=True)
+        seeds = np.unique(borrowers)
+
+        # impact of the borrower's distress on the lender's equity
+        impact = np.ones(len(exposures))
+        solvent = equity[lenders] > 0
+        impact[solvent] = np.minimum(1, exposures[solvent] / equity[lenders][solvent])
+        impact = impact[:, np.newaxis]
+
+        total_assets = np.sum(self.interbankAssets)
+        economic_value = self.interbankAssets / total_assets if total_assets > 0 else np.zeros(n)
+
+        h = np.zeros((n, len(seeds)))
+        h[seeds, np.arange(len(seeds))] = 1
+        distressed = h > 0
+        inactive = np.zeros_like(distressed)
+        for _ in range(self.debtRankMaxIterations):
+            if not np.any(distressed):
+                break
+            contribution = (h * distressed)[borrowers] * impact
+            shock = np.add.reduceat(contribution, group_starts, axis=0)
+            inactive |= distressed
+            shock[inactive[group_lenders]] = 0
+
+            h[group_lenders] = np.minimum(1, h[group_lenders] + shock)
+            distressed[:] = False
+            distressed[group_lenders] = shock > 0
+
+        debt_rank = np.zeros(n)
+        debt_rank[seeds] = economic_value.dot(h) - economic_value[seeds]
+        return debt_rank
+
+    def calculate_coreness(self, lenders, borrowers, exposures, iterations=50):
+        # Continuous core-periphery score: leading eigenvector of the symmetrized exposure network,
+        # obtained by power iteration over the edge list.
+        n = self.numberBanks
+        score = np.ones(n) / np.sqrt(n)
+        for _ in range(iterations):
+            new_score = np.bincount(lenders, weights=exposures * score[borrowers], minlength=n) + \
+                np.bincount(borrowers, weights=exposures * score[lenders], minlength=n)
+            norm = np.linalg.norm(new_score)
+            if norm == 0:
+                return np.zeros(n)
+            new_score /= norm
+            if np.allclose(new_score, score):
+                score = new_score
+                break
+            score = new_score
+        return score / np.max(score)
+
+    def summary(self):
+        total_assets = np.sum(self.interbankAssets)
+        return {'numberEdges': int(np.sum(self.outDegree)),
+                'maxInDegree': int(np.max(self.inDegree, initial=0)),
+                'maxOutDegree': int(np.max(self.outDegree, initial=0)),
+                'totalExposure': float(total_assets),
+                'largestExposure': float(self.largestExposures['amount'][0]) if len(self.largestExposures) else 0.,
+                'exposureConcentration': float(np.sum(self.interbankAssets ** 2) / total_assets ** 2)
+                if total_assets > 0 else 0.,
+                'maxDebtRank': float(np.max(self.debtRank, initial=0)),
+                'mostSystemicBank': int(np.argmax(self.debtRank)),
+                'numberCoreBanks': int(np.sum(self.coreness > 0.5))}
@@ -0,0 +1,332 @@
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Phases with their own random substreams
+WITHDRAWALS = 1
+LOAN_COLLECTION = 2
+STRATEGY_CHOICE = 3
+
+# Columns of the books kept in shared memory
+DEPOSIT_COLUMNS = ('amounts', 'initialAmounts', 'lastPercentageWithdrawn')
+LOAN_COLUMNS = ('loanAmounts',)
+
+# Shared arrays attached by each worker process, and their segments, by name
+_shared = {}
+_shms = {}
+
+
+def bank_substream(entropy, cycle, phase, bank_index):
+    # Random numbers of a bank in a phase depend only on the model seed, cycle, phase and bank, never on
+    # which worker processes the bank, so results do not depend on the number of workers.
+    return np.random.default_rng([entropy, cycle, phase, bank_index])
+
+
+def attach_shared_arrays(specs):
+    # Attaches the arrays whose segment changed since the last call (shared anew, larger, by the model)
+    for name, (shm_name, shape, dtype) in specs.items():
+        if name in _shms and _shms[name][0] == shm_name:
+            continue
+        if name in _shms:
+            del _shared[name]
+            close(_shms.pop(name)[1])
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shms[name] = (shm_name, shm)
+        _shared[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # still mapped by arrays of a book, released along with them
+        pass
+
+
+def withdraw_deposits(arrays, banks, entropy, cycle, probability, amount_withdrawn):
+    # Diamond & Dybvig liquidity shocks of the zero-intelligence depositors of banks[0]..banks[1]-1
+    amounts, last_percentage_withdrawn = arrays['amounts'], arrays['lastPercentageWithdrawn']
+    bank_rows, withdrawals, counter = arrays['depositRows'], arrays['withdrawals'], arrays['withdrawalsCounter']
+    for bank_index in range(*banks):
+        rows = slice(bank_rows[bank_index], bank_rows[bank_index + 1])
+        rng = bank_substream(entropy, cycle, WITHDRAWALS, bank_index)
+        shock = np.where(rng.random(rows.stop - rows.start) < probability, amount_withdrawn, 0)
+        last_percentage_withdrawn[rows] = shock
+        amount_withdrawn_per_depositor = amounts[rows] * shock
+        amounts[rows] -= amount_withdrawn_per_depositor
+        withdrawals[bank_index] = np.sum(amount_withdrawn_per_depositor)
+        counter[bank_index] = np.count_nonzero(amount_withdrawn_per_depositor > 0)
+
+
+def collect_loans(arrays, banks, entropy, cycle, interest_rate_shift):
+    # Repayment (or default) of every corporate client of banks[0]..banks[1]-1
+    loan_amounts, bank_rows = arrays['loanAmounts'], arrays['loanRows']
+    default_rate, loss_given_default, interest_rate = arrays['defaultRate'], arrays['lossGivenDefault'], \
+        arrays['loanInterestRate']
+    for bank_index in range(*banks):
+        rows = slice(bank_rows[bank_index], bank_rows[bank_index + 1])
+        rng = bank_substream(entropy, cycle, LOAN_COLLECTION, bank_index)
+        defaults = rng.random(rows.stop - rows.start) <= default_rate[rows]
+        loan_amounts[rows] *= np.where(defaults, 1 - loss_given_default[rows],
+                                       1 + interest_rate[rows] + interest_rate_shift)
+
+
+def update_bank_strategies(arrays, banks, entropy, cycle, decay):
+    # EWA update of the attractions of banks[0]..banks[1]-1 over the whole grid (see StrategySupport.update)
+    # and choice of their strategy of the cycle
+    attractions, payoffs, probabilities = arrays['attractions'], arrays['payoffs'], arrays['probabilities']
+    strategy_rows, chosen = arrays['strategyRows'], arrays['chosenStrategies']
+    for bank_index in range(*banks):
+        row = strategy_rows[bank_index]
+        a, p = attractions[row], probabilities[row]
+        a *= decay
+        a += payoffs[row]
+        np.exp(a - np.max(a), out=p)
+        p /= np.sum(p)
+        probability_threshold = bank_substream(entropy, cycle, STRATEGY_CHOICE, bank_index).random()
+        chosen[row] = min(np.searchsorted(np.cumsum(p), probability_threshold, side='right'), len(p) - 1)
+
+
+KERNELS = {'withdraw_deposits': withdraw_deposits, 'collect_loans': collect_loans,
+           'update_bank_strategies': update_bank_strategies}
+
+
+def run_kernel(kernel, specs, banks, *args):
+    # entry point of the worker processes
+    attach_shared_arrays(specs)
+    KERNELS[kernel](_shared, banks, *args)
+
+
+def release(shms, pool):
+    if pool is not None:
+        pool.terminate()
+    for shm in shms:
+        shm.unlink()
+        close(shm)
+
+
+class ParallelPhaseExecutor:
+    """
+    Runs the per-bank work of a period over partitions of banks, in worker processes.
+
+    Deposits, loans and client parameters are moved to shared memory, and each worker updates the rows
+    of the banks of its partition in place. A phase returns only once every partition is done, which is
+    the barrier between periods. Random numbers come from per-bank substreams of the model seed, so a run
+    gives the same results with any number of workers (a single worker runs the phases in-process).
+
+    In the schedule the executor takes the place of the depositors and corporate clients: it draws the
+    liquidity shocks of the depositors (intelligent depositors keep deciding in their own stage) and
+    collects the loans of every client at the start of period 2. It also updates the attractions of
+    intelligent banks and picks their strategy at the start of period 0, the bulk of a cycle's work, when
+    they learn by plain EWA over the whole grid: attractions, payoffs and probabilities are kept in shared
+    (banks x strategies) arrays, and each bank only reports the payoff of the strategy it played. Banks
+    then set up their balance sheets serially, since that writes to their depositors and clients. With
+    strategy pruning or coarse-to-fine learning, banks keep learning on their own, serially.
+
+    Shared arrays have room to spare: books grow by doubling and are compacted in place, and per-bank
+    arrays are shared anew with twice the room only when banks outgrow them. When the population of banks
+    changes, refresh() updates the arrays in place, and workers attach to new segments at their next task,
+    so the pool of worker processes lives as long as the executor. Each bank keeps its row of learning
+    state for as long as it lives, so entry and exit never move the state of the other banks.
+    """
+
+    def __init__(self, model, number_workers):
+        self.model = model
+        self.numberWorkers = number_workers
+        self.entropy = model.seed if isinstance(model.seed, int) else int(model.random.generator.integers(2 ** 32))
+        factors = model.exogenousFactors
+        self.picksBankStrategies = not factors.areBanksZeroIntelligenceAgents and \
+            not factors.isStrategyPruningActive and not factors.isCoarseToFineLearningActive
+        # row of learning state of each bank, rows left by banks that exited, and rows used so far
+        self.strategyRows = {}
+        self.freeStrategyRows = []
+        self.numberStrategyRows = 0
+
+        self.shms = []
+        self.specs = {}
+        self.arrays = {}
+        # segment of each shared array, and segments replaced since the last refresh
+        self.segments = {}
+        self.replaced = []
+        self.refresh()
+
+        self.pool = None
+        if number_workers > 1:
+            self.pool = multiprocessing.Pool(number_workers)
+        self.finalizer = weakref.finalize(self, release, self.shms, self.pool)
+
+    def refresh(self):
+        # Shares the books and per-bank arrays for the current banks, reusing segments while they are large enough
+        model = self.model
+        banks = model.schedule.banks
+        deposit_book, loan_book = model.depositBook, model.loanBook
+        number_banks = len(banks)
+        pools = (model.schedule.corporate_clients, model.schedule.LowRiskpoolcorporate_clients,
+                 model.schedule.HighRiskpoolcorporate_clients)
+        clients = sorted((client for pool in pools for client in pool), key=lambda _: _.loanIndex)
+
+        # columns of the books, as shared arrays the books keep working on; a book that grew since has
+        # private (twice as large) columns again
+        for book, names in ((deposit_book, DEPOSIT_COLUMNS), (loan_book, LOAN_COLUMNS)):
+            for name in names:
+                column = getattr(book, name)
+                if self.arrays.get(name) is not column:
+                    setattr(book, name, self.share(name, column))
+
+        # parameters of the clients, by loan-book row, with the capacity of the loan book
+        capacity = len(loan_book.loanAmounts)
+        self.update('defaultRate', np.array([_.probabilityOfDefault for _ in clients], dtype=float), capacity)
+        self.update('lossGivenDefault', np.array([_.lossGivenDefault for _ in clients], dtype=float), capacity)
+        self.update('loanInterestRate', np.array([_.loanInterestRate for _ in clients], dtype=float), capacity)
+
+        # first row of each bank, in both books
+        self.update('depositRows', model.schedule.bankDepositorRows, 2 * (number_banks + 1))
+        self.update('loanRows', model.schedule.bankClientRows, 2 * (number_banks + 1))
+        self.withdrawals = self.update('withdrawals', np.zeros(number_banks), 2 * number_banks)
+        self.withdrawalsCounter = self.update('withdrawalsCounter', np.zeros(number_banks, dtype=int),
+                                              2 * number_banks)
+
+        if self.picksBankStrategies:
+            self.refresh_strategies(banks)
+
+        bounds = np.linspace(0, number_banks, min(self.numberWorkers, number_banks) + 1).astype(int)
+        self.partitions = [(int(first), int(last)) for first, last in zip(bounds[:-1], bounds[1:])]
+
+        # segments replaced are no longer used by the books: workers close them when they attach the new ones
+        for shm in self.replaced:
+            self.shms.remove(shm)
+            shm.unlink()
+            close(shm)
+        self.replaced = []
+
+    def refresh_strategies(self, banks):
+        # Banks that exited free their rows of learning state, and entrants take free rows or new ones
+        live = set(banks)
+        for bank in [_ for _ in self.strategyRows if _ not in live]:
+            self.freeStrategyRows.append(self.strategyRows.pop(bank))
+        entrants = [bank for bank in banks if bank not in self.strategyRows]
+        needed = self.numberStrategyRows + max(0, len(entrants) - len(self.freeStrategyRows))
+        attractions = self.arrays.get('attractions')
+        if attractions is None or len(attractions) < needed:
+            # shared anew with twice the room
+            grid = (2 * needed, len(banks[0].strategiesOptionsInformation))
+            for name, shape, dtype in (('attractions', grid, float), ('payoffs', grid, float),
+                                       ('probabilities', grid, float), ('chosenStrategies', grid[:1], int)):
+                grown = np.zeros(shape, dtype=dtype)
+                if name in self.arrays:
+                    grown[:self.numberStrategyRows] = self.arrays[name][:self.numberStrategyRows]
+                self.share(name, grown)
+
+        for bank in entrants:
+            if self.freeStrategyRows:
+                row = self.freeStrategyRows.pop()
+            else:
+                row = self.numberStrategyRows
+                self.numberStrategyRows += 1
+            self.strategyRows[bank] = row
+            strategies, payoff = bank.strategiesOptionsInformation, bank.strategySupport.payoffAttribute
+            self.arrays['attractions'][row] = [_.A for _ in strategies]
+            self.arrays['payoffs'][row] = [getattr(_, payoff) for _ in strategies]
+            self.arrays['probabilities'][row] = [_.P for _ in strategies]
+        self.update('strategyRows', np.array([self.strategyRows[bank] for bank in banks], dtype=int),
+                    2 * len(banks))
+
+    def pick_bank_strategies(self):
+        banks = self.model.schedule.banks
+        payoffs, chosen = self.arrays['payoffs'], self.arrays['chosenStrategies']
+        # payoff of the strategy each bank played last cycle
+        for bank in banks:
+            if bank.currentlyChosenStrategy is not None:
+                row = self.strategyRows[bank]
+                payoffs[row, chosen[row]] = getattr(bank.currentlyChosenStrategy, bank.strategySupport.payoffAttribute)
+
+        self.run('update_bank_strategies', self.entropy, self.model.schedule.cycle, banks[0].strategySupport.decay)
+        probabilities = self.arrays['probabilities']
+        for bank in banks:
+            row = self.strategyRows[bank]
+            bank.currentlyChosenStrategy = bank.strategiesOptionsInformation[chosen[row]]
+            bank.strategySupport.probabilities = probabilities[row]
+
+    def share(self, name, values):
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        array = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)
+        array[:] = values
+        if name in self.segments:
+            self.replaced.append(self.segments[name])
+        self.segments[name] = shm
+        self.shms.append(shm)
+        self.arrays[name] = array
+        self.specs[name] = (shm.name, values.shape, values.dtype.str)
+        return array
+
+    def update(self, name, values, capacity):
+        # Writes values at the start of a shared array, shared anew with the given capacity when too small
+        array = self.arrays.get(name)
+        if array is None or len(array) < len(values):
+            array = np.zeros(max(capacity, len(values)), dtype=values.dtype)
+            array[:len(values)] = values
+            return self.share(name, array)
+        array[:len(values)] = values
+        return array
+
+    def run(self, kernel, *args):
+        if self.pool is None:
+            for banks in self.partitions:
+                KERNELS[kernel](self.arrays, banks, *args)
+        else:
+            self.pool.starmap(run_kernel, [(kernel, self.specs, banks) + args for banks in self.partitions])
+
+    def close(self):
+        # books get private copies of their rows back, so the model can go on serially
+        deposit_book, loan_book = self.model.depositBook, self.model.loanBook
+        for name in ('amounts', 'initialAmounts', 'lastPercentageWithdrawn'):
+            setattr(deposit_book, name, getattr(deposit_book, name).copy())
+        loan_book.loanAmounts = loan_book.loanAmounts.copy()
+        # ... and banks their learning state
+        for bank, row in self.strategyRows.items():
+            attractions, probabilities = self.arrays['attractions'][row], self.arrays['probabilities'][row].copy()
+            cumulative_probabilities = np.cumsum(probabilities)
+            for strategy, a, p, f in zip(bank.strategiesOptionsInformation, attractions.tolist(),
+                                         probabilities.tolist(), cumulative_probabilities.tolist()):
+                strategy.A, strategy.P, strategy.F = a, p, f
+            bank.strategySupport.probabilities = probabilities
+            bank.strategySupport.cumulativeProbabilities = cumulative_probabilities
+        self.strategyRows.clear()
+        self.arrays.clear()
+        self.withdrawals = self.withdrawalsCounter = None
+        self.finalizer()
+
+    def reset(self):
+        self.model.loanBook.loanAmounts[:] = 0
+        if self.model.depositorStage is not None:
+            self.model.depositorStage.reset()
+        else:
+            deposit_book = self.model.depositBook
+            deposit_book.amounts[:] = deposit_book.initialAmounts
+
+    def period_0(self):
+        if self.picksBankStrategies:
+            self.pick_bank_strategies()
+        if self.model.depositorStage is not None:
+            self.model.depositorStage.period_0()
+
+    def period_1(self):
+        if self.model.depositorStage is not None:
+            self.model.depositorStage.period_1()
+        elif self.model.exogenousFactors.areBankRunsPossible:
+            #  Liquidity Shock
+            factors = self.model.exogenousFactors
+            self.run('withdraw_deposits', self.entropy, self.model.schedule.cycle,
+                     factors.probabilityofWithdrawal, factors.amountWithdrawn)
+            for bank in self.model.schedule.banks:
+                bank.liquidityNeeds -= self.withdrawals[bank.bankIndex]
+                bank.withdrawalsCounter += int(self.withdrawalsCounter[bank.bankIndex])
+
+    def period_2(self):
+        # banks then read their collected loans from the loan book (see Bank.collect_loans)
+        self.run('collect_loans', self.entropy, self.model.schedule.cycle, self.model.loanBook.interestRateShift)
+        if self.model.depositorStage is not None:
+            self.model.depositorStage.period_2()
@@ -0,0 +1,183 @@
+"""
+Storage of simulation outputs, partitioned by scenario and seed.
+
+    <path>/<table>/scenario=<scenario>/seed=<seed>/chunk-<n>.parquet
+
+Tables hold columns of equal length: 'cycles' has one row per cycle of a run and 'banks' one row per bank
+and cycle. Files are Parquet when pyarrow is available (imported only when a file is actually written or
+read) and .npz column archives otherwise. Reads only open the partitions and chunks that can match the
+filters, and only load the requested columns, so analyses over thousands of runs go chunk by chunk
+through `scan` instead of loading every run into memory.
+"""
+import importlib.util
+import operator
+import os
+
+import numpy as np
+
+PARTITION_COLUMNS = ('scenario', 'seed')
+
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+             '>': operator.gt, '>=': operator.ge, 'in': np.isin}
+
+
+def has_pyarrow():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def matches(values, filters):
+    # Rows matching every (column, operator, value) filter, given the values of the filtered columns
+    mask = True
+    for column, op, value in filters:
+        mask = np.logical_and(mask, OPERATORS[op](values[column], value))
+    return mask
+
+
+class ResultStore:
+
+    def __init__(self, path, file_format=None):
+        self.path = path
+        self.fileFormat = file_format or ('parquet' if has_pyarrow() else 'npz')
+        if self.fileFormat not in ('parquet', 'npz'):
+            raise ValueError("Unknown file format: {}".format(self.fileFormat))
+
+    def partition_path(self, table, scenario, seed):
+        return os.path.join(self.path, table, 'scenario={}'.format(scenario), 'seed={}'.format(seed))
+
+    def write(self, table, scenario, seed, chunk, columns):
+        # Writes (or replaces) a chunk of a partition, atomically
+        directory = self.partition_path(table, scenario, seed)
+        os.makedirs(directory, exist_ok=True)
+        name = 'chunk-{:05d}.{}'.format(chunk, self.fileFormat)
+        temporary = os.path.join(directory, '.{}.{}'.format(os.getpid(), name))
+        if self.fileFormat == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table({k: np.asarray(v) for k, v in columns.items()}), temporary)
+        else:
+            with open(temporary, 'wb') as f:
+                np.savez(f, **columns)
+        os.replace(temporary, os.path.join(directory, name))
+
+    def partitions(self, table, filters=()):
+        # (scenario, seed, directory) of every partition not ruled out by filters on partition columns
+        partition_filters = [_ for _ in filters if _[0] in PARTITION_COLUMNS]
+        table_path = os.path.join(self.path, table)
+        partitions = []
+        for scenario_directory in sorted(os.listdir(table_path)) if os.path.isdir(table_path) else []:
+            scenario = scenario_directory.split('=', 1)[1]
+            for seed_directory in sorted(os.listdir(os.path.join(table_path, scenario_directory))):
+                seed = int(seed_directory.split('=', 1)[1])
+                if np.all(matches({'scenario': np.array(scenario), 'seed': np.array(seed)}, partition_filters)):
+                    partitions.append((scenario, seed, os.path.join(table_path, scenario_directory, seed_directory)))
+        return partitions
+
+    def scan(self, table, columns=None, filters=()):
+        """
+        Yields the matching rows of each chunk as a dict of arrays, restricted to `columns` (every column
+        when None). Filters are (column, operator, value) tuples, with operator in ==, !=, <, <=, >, >=, in.
+        """
+        row_filters = [_ for _ in filters if _[0] not in PARTITION_COLUMNS]
+        for scenario, seed, directory in self.partitions(table, filters):
+            for name in sorted(_ for _ in os.listdir(directory) if not _.startswith('.')):
+                chunk, number_rows = self.read_chunk(os.path.join(directory, name), columns, row_filters)
+                if number_rows == 0:
+                    continue
+                for column, value in (('scenario', scenario), ('seed', seed)):
+                    if columns is None or column in columns:
+                        chunk[column] = np.full(number_rows, value)
+                yield chunk
+
+    def read_chunk(self, path, columns, row_filters):
+        stored_columns = None if columns is None else [_ for _ in columns if _ not in PARTITION_COLUMNS]
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            # filters are pushed down to the row groups of the file
+            data = pq.read_table(path, columns=stored_columns, filters=row_filters or None)
+            return {name: data.column(name).to_numpy() for name in data.column_names}, data.num_rows
+
+        with np.load(path) as archive:
+            names = archive.files if stored_columns is None else stored_columns
+            if len(row_filters) == 0:
+                return {name: archive[name] for name in names}, len(archive[archive.files[0]])
+            # filter columns are loaded first, the others only if some row matches
+            mask = matches({column: archive[column] for column, _, _ in row_filters}, row_filters)
+            if not np.any(mask):
+                return {}, 0
+            return {name: archive[name][mask] for name in names}, int(np.sum(mask))
+
+    def read(self, table, columns=None, filters=()):
+        # Every matching row at once, as a pandas DataFrame
+        import pandas as pd
+        chunks = list(self.scan(table, columns, filters))
+        if len(chunks) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.DataFrame({name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]},
+                            columns=columns)
+
+    def aggregate(self, table, column, by=('scenario', 'seed'), filters=()):
+        # Count, sum, min and max of a column per group, accumulated chunk by chunk
+        import pandas as pd
+        partials = []
+        for chunk in self.scan(table, list(by) + [column], filters):
+            frame = pd.DataFrame(chunk)
+            partials.append(frame.groupby(list(by))[column].agg(['count', 'sum', 'min', 'max']))
+        if len(partials) == 0:
+            return pd.DataFrame(columns=['count', 'sum', 'min', 'max', 'mean'])
+        combined = pd.concat(partials).groupby(level=list(range(len(by)))).agg(
+            {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+        combined['mean'] = combined['sum'] / combined['count']
+        return combined
+
+
+class ResultWriter:
+    """
+    Records per-cycle and per-bank metrics of a run, written to a ResultStore every `chunk_size` cycles.
+    """
+
+    def __init__(self, store, scenario, seed, chunk_size=100):
+        self.store = store
+        self.scenario = scenario
+        self.seed = seed
+        self.chunkSize = chunk_size
+        self.chunk = 0
+        self.cycles = []
+        self.banks = []
+
+    def record(self, model):
+        schedule = model.schedule
+        central_bank = schedule.central_bank
+        total_loans = 0
+        for bank in schedule.banks:
+            sheet = bank.balanceSheet
+            loans = sum(getattr(sheet, account) for _, account, _ in bank.loan_book_segments())
+            total_loans += loans
+            self.banks.append((schedule.cycle, bank.bankIndex, -sheet.capital, sheet.liquidAssets, loans,
+                               sheet.interbankLoan, sheet.discountWindowLoan, sheet.deposits, bank.is_insolvent()))
+        self.cycles.append((schedule.cycle,
+                            central_bank.insolvencyPerCycleCounter,
+                            central_bank.insolvencyDueToContagionPerCycleCounter,
+                            total_loans,
+                            schedule.clearing_house.totalInterbankDebt,
+                            central_bank.fireSaleVolumePerCycle))
+        if len(self.cycles) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.cycles) == 0:
+            return
+        cycles = np.array(self.cycles, dtype=[('cycle', int), ('insolvencies', int), ('contagions', int),
+                                              ('totalLoans', float), ('totalInterbankDebt', float),
+                                              ('fireSaleVolume', float)])
+        banks = np.array(self.banks, dtype=[('cycle', int), ('bank', int), ('equity', float), ('liquidAssets', float),
+                                            ('loans', float), ('interbankLoan', float),
+                                            ('discountWindowLoan', float), ('deposits', float),
+                                            ('insolvent', bool)])
+        for table, rows in (('cycles', cycles), ('banks', banks)):
+            self.store.write(table, self.scenario, self.seed, self.chunk,
+                             {name: rows[name] for name in rows.dtype.names})
+        self.chunk += 1
+        self.cycles, self.banks = [], []
+
+    def close(self):
+        self.flush()
@@ -1,27 +1,37 @@
+from banksim.strategies.strategy_grid import StrategyGrid
+
+
 class BankEWAStrategy:
     # capital ratio (capital / assets)
-    numberAlphaOptions = 30
+    alphaGrid = StrategyGrid(30)
     # liquidity ratio(liquid assets / deposits)
-    numberBetaOptions = 20
+    betaGrid = StrategyGrid(20)
     # risk appetite (High Risk Corporate Client/ Low Risk Corporate Client)
-    numberGammaOptions = 30
+    gammaGrid = StrategyGrid(30)
 
-    def __init__(self, alpha_index_option=0, beta_index_option=0, gamma_index_option=0):
+    def __init__(self, alpha_index_option=0, beta_index_option=0, gamma_index_option=0,
+                 alpha_grid=None, beta_grid=None, gamma_grid=None):
         self.alphaIndex = alpha_index_option
         self.betaIndex = beta_index_option
         self.gammaIndex = gamma_index_option
+        if alpha_grid is not None:
+            self.alphaGrid = alpha_grid
+        if beta_grid is not None:
+            self.betaGrid = beta_grid
+        if gamma_grid is not None:
+            self.gammaGrid = gamma_grid
         self.strategyProfit = self.strategyProfitPercentage = self.strategyProfitPercentageDamped = 0
         self.A = self.P = self.F = 0
     
     
     def get_alpha_value(self):
-        return (self.alphaIndex + 1) / 100 
+        return self.alphaGrid.value(self.alphaIndex)
     
     def get_beta_value(self):
-        return  (self.betaIndex + 1) / 100 
+        return self.betaGrid.value(self.betaIndex)
     
     def get_gamma_value(self):
-        return (self.gammaIndex + 1) / 100
+        return self.gammaGrid.value(self.gammaIndex)
         
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -34,8 +44,14 @@ class BankEWAStrategy:
         self.A = self.P = self.F = 0
 
     @classmethod
-    def bank_ewa_strategy_list(cls):
-        return [BankEWAStrategy(a, b, c) for a in range(cls.numberAlphaOptions) for b in \
-                range(cls.numberBetaOptions) for c in range(cls.numberGammaOptions)]
+    def grid_shape(cls, alpha_grid=None, beta_grid=None, gamma_grid=None):
+        return (len(alpha_grid or cls.alphaGrid), len(beta_grid or cls.betaGrid), len(gamma_grid or cls.gammaGrid))
+
+    @classmethod
+    def bank_ewa_strategy_list(cls, alpha_grid=None, beta_grid=None, gamma_grid=None):
+        number_alpha_options, number_beta_options, number_gamma_options = \
+            cls.grid_shape(alpha_grid, beta_grid, gamma_grid)
+        return [BankEWAStrategy(a, b, c, alpha_grid, beta_grid, gamma_grid) for a in range(number_alpha_options)
+                for b in range(number_beta_options) for c in range(number_gamma_options)]
 
                 
@@ -1,17 +1,21 @@
 import numpy as np
 
+from banksim.strategies.strategy_grid import StrategyGrid
+
 
 class CentralBankEWAStrategy:
-    numberAlphaOptions = 30
+    alphaGrid = StrategyGrid(30)
 
-    def __init__(self, alpha_index_option=0):
+    def __init__(self, alpha_index_option=0, alpha_grid=None):
         self.alphaIndex = alpha_index_option
+        if alpha_grid is not None:
+            self.alphaGrid = alpha_grid
         self.strategyProfit = self.strategyProfitPercentage = self.strategyProfitPercentageDamped = 0
         self.A = self.P = self.F = 0
         self.numberInsolvencies = self.totalLoans = 0
     
     def get_alpha_value(self):
-        return (self.alphaIndex + 1) / 100
+        return self.alphaGrid.value(self.alphaIndex)
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -24,6 +28,7 @@ class CentralBankEWAStrategy:
         self.numberInsolvencies = self.totalLoans = 0
 
     @classmethod
-    def central_bank_ewa_strategy_list(cls):
-        return np.array([CentralBankEWAStrategy(a) for a in range(cls.numberAlphaOptions)],
+    def central_bank_ewa_strategy_list(cls, alpha_grid=None):
+        number_alpha_options = len(alpha_grid or cls.alphaGrid)
+        return np.array([CentralBankEWAStrategy(a, alpha_grid) for a in range(number_alpha_options)],
                         dtype=CentralBankEWAStrategy)
@@ -1,11 +1,15 @@
 import numpy as np
 
+from banksim.strategies.strategy_grid import StrategyGrid
+
 
 class DepositorEWAStrategy:
-    numberAlphaOptions = 10 #30
+    alphaGrid = StrategyGrid(10)
 
-    def __init__(self, alpha_index_option=0):
+    def __init__(self, alpha_index_option=0, alpha_grid=None):
         self.alphaIndex = alpha_index_option
+        if alpha_grid is not None:
+            self.alphaGrid = alpha_grid
         self.strategyProfit = 0
         self.amountEarlyWithdraw = 0
         self.amountFinalWithdraw = 0
@@ -14,7 +18,7 @@ class DepositorEWAStrategy:
         self.A = self.P = self.F = 0
     
     def get_alpha_value(self):
-        return (self.alphaIndex + 1) / 100
+        return self.alphaGrid.value(self.alphaIndex)
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -26,7 +30,15 @@ class DepositorEWAStrategy:
         self.insolvencyCounter = self.finalConsumption = 0
         self.A = self.P = self.F = 0
 
+    @staticmethod
+    def utility(final_consumption, initial_deposit, minimum_consumption_ratio):
+        # log return on the deposit, in %, of one depositor or of an array of them, consumption counting as
+        # at least minimum_consumption_ratio of the deposit
+        ratio = np.maximum(final_consumption / initial_deposit, minimum_consumption_ratio)
+        return 100 * np.log(ratio)
+
     @classmethod
-    def depositor_ewa_strategy_list(cls):
-        return np.array([DepositorEWAStrategy(a) for a in range(cls.numberAlphaOptions)], dtype=DepositorEWAStrategy)
-                        
+    def depositor_ewa_strategy_list(cls, alpha_grid=None):
+        number_alpha_options = len(alpha_grid or cls.alphaGrid)
+        return np.array([DepositorEWAStrategy(a, alpha_grid) for a in range(number_alpha_options)],
+                        dtype=DepositorEWAStrategy)
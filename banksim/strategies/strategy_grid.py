@@ -0,0 +1,37 @@
+import numpy as np
+
+
+class StrategyGrid:
+    """
+    Values a single strategy dimension can take.
+
+    By default the grid reproduces the original (index + 1) / 100 options. A range and a
+    'linear' or 'log' spacing can be given instead.
+    """
+
+    def __init__(self, number_options, minimum=None, maximum=None, spacing='linear'):
+        self.numberOptions = number_options
+        self.spacing = spacing
+
+        if minimum is None and maximum is None:
+            self.values = (np.arange(number_options) + 1) / 100
+        else:
+            minimum = 0.01 if minimum is None else minimum
+            maximum = number_options / 100 if maximum is None else maximum
+            if spacing == 'linear':
+                self.values = np.linspace(minimum, maximum, number_options)
+            elif spacing == 'log':
+                self.values = np.geomspace(minimum, maximum, number_options)
+            else:
+                raise ValueError("Unknown grid spacing: {}".format(spacing))
+        self.values.flags.writeable = False
+
+    def __len__(self):
+        return self.numberOptions
+
+    def __repr__(self):
+        return 'StrategyGrid({}, minimum={}, maximum={}, spacing={!r})'.format(
+            self.numberOptions, self.values[0], self.values[-1], self.spacing)
+
+    def value(self, index):
+        return float(self.values[index])
@@ -0,0 +1,175 @@
+import numpy as np
+
+
+class StrategySupport:
+    """
+    EWA choice probabilities over a list of strategies, restricted to an active support.
+
+    Strategies whose probability stays below `probability_threshold` for `patience` consecutive cycles
+    become dormant and are no longer exponentiated nor normalized. Dormant attractions are caught up in
+    closed form when they are woken up, either by exploration sampling or by a periodic re-expansion.
+    With pruning disabled every strategy is always active and the update matches the plain EWA rule.
+
+    In coarse-to-fine mode only every `coarse_stride`-th point of the (possibly multi-dimensional) grid
+    is eligible at first. Every `refinement_interval` cycles the stride is halved around the
+    `refinement_top` most probable strategies, until the full resolution is reached there.
+
+    Exploration samples are drawn from `rng`, the generator of the agent's model (numpy's global one if
+    None).
+    """
+
+    def __init__(self, strategies, decay, payoff_attribute, is_pruning_active=False, probability_threshold=0,
+                 patience=1, reexpansion_interval=0, exploration_size=0, shape=None, coarse_stride=1,
+                 refinement_interval=0, refinement_top=0, rng=None):
+        self.strategies = strategies
+        self.numberStrategies = len(strategies)
+        self.decay = decay
+        self.payoffAttribute = payoff_attribute
+
+        self.isPruningActive = is_pruning_active
+        self.probabilityThreshold = probability_threshold
+        self.patience = patience
+        self.reexpansionInterval = reexpansion_interval
+        self.explorationSize = exploration_size
+
+        self.shape = shape if shape is not None else (self.numberStrategies,)
+        self.stride = coarse_stride
+        self.refinementInterval = refinement_interval
+        self.refinementTop = refinement_top
+        self.rng = rng
+
+        self.cycle = 0
+        self.isEligible = self.coarse_grid_mask(self.shape, self.stride)
+        self.isActive = self.isEligible.copy()
+        self.activeIndices = np.flatnonzero(self.isActive)
+        self.belowThresholdCycles = np.zeros(self.numberStrategies, dtype=int)
+        self.lastUpdateCycle = np.zeros(self.numberStrategies, dtype=int)
+        self.probabilities = self.cumulativeProbabilities = None
+
+        # Probability mass pruned since the last re-expansion (estimate) ...
+        self.prunedProbabilityMass = 0
+        # ... and mass the dormant set actually held when the full grid was last evaluated.
+        self.droppedProbabilityMass = 0
+
+    @property
+    def effective_support(self):
+        return len(self.activeIndices)
+
+    def update(self):
+        self.cycle += 1
+        reexpanded = None
+        if self.stride > 1 and self.refinementInterval and self.cycle % self.refinementInterval == 0:
+            self.refine()
+        if self.isPruningActive:
+            if self.reexpansionInterval and self.cycle % self.reexpansionInterval == 0:
+                reexpanded = self.reexpand()
+            elif self.explorationSize:
+                self.explore()
+
+        strategies = self.strategies
+        indices = self.activeIndices
+        list_a = np.array([self.decay * strategies[i].A + getattr(strategies[i], self.payoffAttribute)
+                           for i in indices])
+        _exp = np.exp(list_a - np.max(list_a))
+        list_p = _exp / np.sum(_exp)
+        self.lastUpdateCycle[indices] = self.cycle
+        if reexpanded is not None:
+            # every eligible strategy is active right after a re-expansion
+            self.droppedProbabilityMass = np.sum(list_p[np.searchsorted(indices, reexpanded)])
+            self.prunedProbabilityMass = 0
+
+        if self.isPruningActive:
+            keep = self.prune(list_p)
+            for i, a in zip(indices[~keep], list_a[~keep]):
+                strategy = self.strategies[i]
+                strategy.A, strategy.P, strategy.F = a, 0, 0
+            indices, list_a, list_p = indices[keep], list_a[keep], list_p[keep] / np.sum(list_p[keep])
+
+        list_f = np.cumsum(list_p)
+        for i, a, p, f in zip(indices, list_a, list_p, list_f):
+            strategy = strategies[i]
+            strategy.A, strategy.P, strategy.F = a, p, f
+        self.probabilities, self.cumulativeProbabilities = list_p, list_f
+
+    def prune(self, list_p):
+        indices = self.activeIndices
+        below = list_p < self.probabilityThreshold
+        self.belowThresholdCycles[indices] = np.where(below, self.belowThresholdCycles[indices] + 1, 0)
+        to_prune = self.belowThresholdCycles[indices] >= self.patience
+        if np.all(to_prune):
+            # never leave the learner without strategies
+            to_prune[np.argmax(list_p)] = False
+
+        if np.any(to_prune):
+            self.prunedProbabilityMass += np.sum(list_p[to_prune])
+            self.isActive[indices[to_prune]] = False
+            self.belowThresholdCycles[indices[to_prune]] = 0
+            self.activeIndices = indices[~to_prune]
+        return ~to_prune
+
+    def wake_up(self, indices):
+        # Dormant strategies were never picked, so their payoff stayed constant while they slept:
+        # A_k = decay^k * A + payoff * (1 + decay + ... + decay^(k-1))
+        for i in indices:
+            strategy = self.strategies[i]
+            missed_cycles = self.cycle - 1 - self.lastUpdateCycle[i]
+            payoff = getattr(strategy, self.payoffAttribute)
+            decay_k = self.decay ** missed_cycles
+            geometric_sum = missed_cycles if self.decay == 1 else (1 - decay_k) / (1 - self.decay)
+            strategy.A = decay_k * strategy.A + payoff * geometric_sum
+        self.isActive[indices] = True
+        self.activeIndices = np.flatnonzero(self.isActive)
+
+    def explore(self):
+        dormant = np.flatnonzero(self.isEligible & ~self.isActive)
+        if len(dormant) > 0:
+            size = min(self.explorationSize, len(dormant))
+            rng = np.random if self.rng is None else self.rng
+            self.wake_up(rng.choice(dormant, size, replace=False))
+
+    def reexpand(self):
+        dormant = np.flatnonzero(self.isEligible & ~self.isActive)
+        self.wake_up(dormant)
+        return dormant
+
+    def refine(self):
+        if self.probabilities is None:
+            # nothing to refine around before the first update
+            return
+        previous_stride, self.stride = self.stride, max(1, self.stride // 2)
+        top = self.activeIndices[np.argsort(self.probabilities)[-self.refinementTop:]]
+
+        # neighbourhood of each top strategy on the finer lattice, one axis per grid dimension
+        offsets = np.arange(-previous_stride + self.stride, previous_stride, self.stride)
+        coordinates = np.unravel_index(top, self.shape)
+        neighbours = []
+        for axis, size in enumerate(self.shape):
+            offsets_shape = [1] * (len(self.shape) + 1)
+            offsets_shape[axis + 1] = len(offsets)
+            axis_coordinates = coordinates[axis].reshape([-1] + [1] * len(self.shape)) + offsets.reshape(offsets_shape)
+            neighbours.append(np.clip(axis_coordinates, 0, size - 1))
+        neighbours = np.ravel_multi_index(tuple(np.broadcast_arrays(*neighbours)), self.shape).ravel()
+
+        new = np.unique(neighbours[~self.isEligible[neighbours]])
+        self.isEligible[new] = True
+        self.wake_up(new)
+
+    @staticmethod
+    def coarse_grid_mask(shape, stride):
+        # every stride-th option along each dimension, always keeping the last one
+        axes = []
+        for size in shape:
+            axis = np.zeros(size, dtype=bool)
+            axis[::stride] = True
+            axis[-1] = True
+            axes.append(axis)
+        mask = axes[0]
+        for axis in axes[1:]:
+            mask = np.logical_and.outer(mask, axis)
+        return mask.ravel()
+
+    def pick(self, probability_threshold):
+        # First active strategy whose cumulative probability exceeds the threshold
+        position = np.searchsorted(self.cumulativeProbabilities, probability_threshold, side='right')
+        position = min(position, len(self.activeIndices) - 1)
+        return self.strategies[self.activeIndices[position]]
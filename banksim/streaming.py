@@ -0,0 +1,85 @@
+from collections import namedtuple
+
+# Lightweight, immutable summary of a simulated cycle
+CycleSnapshot = namedtuple('CycleSnapshot', ['cycle',
+                                             'insolvencies',
+                                             'contagions',
+                                             'totalLoans',
+                                             'totalInterbankDebt',
+                                             'interbankLendingMatrix'])
+
+
+class CycleStream:
+    """
+    Asynchronous iterator over the next `number_cycles` cycles of a model.
+
+    Cycles are simulated on a dedicated worker thread, one cycle ahead of the consumer, so the event loop
+    stays responsive. Consumers should rely on the yielded snapshots instead of reading the model itself,
+    which keeps changing in the background.
+
+    A consumer that may stop early should use the stream as an async context manager, or await aclose():
+
+        async with model.astream(100) as stream:
+            async for snapshot in stream:
+                ...
+
+    Closing cancels the cycle scheduled ahead if it has not started yet; one already running can not be
+    interrupted, so it is completed (and its snapshot dropped) before the worker thread is shut down.
+    """
+
+    def __init__(self, model, number_cycles):
+        # concurrent.futures and asyncio are imported here rather than at module level, as they are costly
+        # at startup and only streaming consumers need them
+        from concurrent.futures import ThreadPoolExecutor
+        self.model = model
+        self.cyclesLeft = number_cycles
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # the cycle simulated ahead, as a concurrent future and as the asyncio future wrapping it
+        self.future = None
+        self.pending = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.pending is None:
+            self.schedule_next_cycle()
+        if self.pending is None:
+            await self.aclose()
+            raise StopAsyncIteration
+        snapshot = await self.pending
+        self.future = self.pending = None
+        # ... simulate the following cycle while the consumer handles this one
+        self.schedule_next_cycle()
+        return snapshot
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def schedule_next_cycle(self):
+        if self.cyclesLeft > 0:
+            self.cyclesLeft -= 1
+            import asyncio
+            self.future = self.executor.submit(self.model.advance)
+            self.pending = asyncio.wrap_future(self.future)
+
+    async def aclose(self):
+        self.cyclesLeft = 0
+        if self.pending is not None and not self.future.cancel():
+            # running already: let it finish, so the model is not changed behind the consumer's back
+            try:
+                await self.pending
+            except Exception:
+                pass
+        self.future = self.pending = None
+        self.executor.shutdown(wait=True)
+
+    def __del__(self):
+        # a stream dropped without being closed, e.g. on break out of async for
+        self.cyclesLeft = 0
+        if self.future is not None:
+            self.future.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,201 @@
+"""
+Stress tests: time-indexed shock paths applied to checkpointed economies, in batch.
+
+An economy is checkpointed once, say after its burn-in, with `checkpoint(model)`: the model along with the
+exogenous factors it runs under and its random stream. A ShockSchedule sets exogenous
+factors stress cycle by stress cycle, e.g.
+
+    ShockSchedule({'probabilityofWithdrawal': [0.4, 0.4, 0.25],
+                   'HighRiskCorporateClientDefaultRate': [0.15, 0.15, 0.1]}, name='adverse')
+
+and StressTest runs every (economy, schedule, seed) triple for a number of cycles as one job, in worker
+processes that load every checkpoint and schedule once. Without seeds, every run of an economy draws the
+same random numbers as its checkpoint would, so schedules are compared on common shocks.
+"""
+import itertools
+import multiprocessing
+import pickle
+
+import numpy as np
+
+from banksim.exogeneous_factors import ExogenousFactors
+
+
+def checkpoint(model):
+    # The model, with the exogenous factors it runs under and its random stream, as bytes
+    if model.phaseExecutor is not None:
+        raise ValueError('A model running worker processes can not be checkpointed: close() it first')
+    return pickle.dumps(model)
+
+
+def restore(data):
+    # Inverse of checkpoint: every restored copy goes on exactly as the checkpointed model would have
+    return pickle.loads(data)
+
+
+class ShockSchedule:
+    """
+    Values of some exogenous factors in each stress cycle. Past the end of its path, a factor is back at
+    its value in the checkpoint.
+
+    Factors a model copies when it is built (interest rates and the parameters of corporate clients) are
+    passed on to the model as well. Under a policy-rate rule, the rule sets the rates every cycle: a shock
+    to interbankInterestRate sets the policy rate of the cycle instead, the corridor and the deposit and
+    loan rates moving with it as they do with the rule's own moves, and shocks to the other rates move the
+    constants the rule sets them from.
+    """
+
+    MODEL_RATES = ('depositInterestRate', 'interbankInterestRate', 'liquidAssetsInterestRate')
+    CLIENT_PARAMETERS = {'DefaultRate': 'probabilityOfDefault',
+                         'LossGivenDefault': 'lossGivenDefault',
+                         'LoanInterestRate': 'loanInterestRate'}
+
+    def __init__(self, paths, name=None):
+        for factor in paths:
+            if not hasattr(ExogenousFactors, factor):
+                raise ValueError('Unknown exogenous factor: {}'.format(factor))
+        self.paths = {factor: list(values) for factor, values in paths.items()}
+        self.name = name
+
+    def apply(self, model, t, baseline):
+        # Sets every factor of the model to its value in stress cycle t (from 0); baseline holds their
+        # checkpoint values
+        factors = model.exogenousFactors
+        for factor, path in self.paths.items():
+            setattr(factors, factor, path[t] if t < len(path) else baseline[factor])
+
+        monetary_policy = model.schedule.central_bank.monetaryPolicy
+        if monetary_policy is not None:
+            if 'interbankInterestRate' in self.paths:
+                path = self.paths['interbankInterestRate']
+                monetary_policy.shockedRate = path[t] if t < len(path) else None
+        else:
+            for factor in self.paths:
+                if factor in self.MODEL_RATES:
+                    setattr(model, factor, getattr(factors, factor))
+                elif factor == 'centralBankLendingInterestRate':
+                    model.schedule.central_bank.centralBankLendingInterestRate = getattr(factors, factor)
+
+        schedule = model.schedule
+        standard = 'standardCorporateClient' if factors.standardCorporateClients \
+            else 'wholesaleCorporateClient'
+        pools = (('LowRiskCorporateClient', schedule.LowRiskpoolcorporate_clients),
+                 ('HighRiskCorporateClient', schedule.HighRiskpoolcorporate_clients),
+                 (standard, schedule.corporate_clients))
+        clients_changed = False
+        for prefix, clients in pools:
+            for suffix, attribute in self.CLIENT_PARAMETERS.items():
+                if prefix + suffix in self.paths:
+                    value = getattr(factors, prefix + suffix)
+                    for client in clients:
+                        setattr(client, attribute, value)
+                    clients_changed = True
+        if clients_changed and model.loanLedger is not None:
+            model.loanLedger.refresh_clients()
+
+
+def run_stress_path(data, schedule, number_cycles, seed=None):
+    # Per-cycle losses (capital lost by the banks that lost capital), insolvencies and contagions of one run
+    model = restore(data)
+    if seed is not None:
+        model.random.seed(seed)
+    baseline = {factor: getattr(model.exogenousFactors, factor) for factor in schedule.paths}
+
+    losses = np.zeros(number_cycles)
+    insolvencies = np.zeros(number_cycles, dtype=int)
+    contagions = np.zeros(number_cycles, dtype=int)
+    central_bank = model.schedule.central_bank
+    for t in range(number_cycles):
+        schedule.apply(model, t, baseline)
+        model.step()
+        profits = np.array([bank.get_profit() for bank in model.schedule.banks])
+        losses[t] = -np.sum(np.minimum(profits, 0))
+        insolvencies[t] = central_bank.insolvencyPerCycleCounter
+        contagions[t] = central_bank.insolvencyDueToContagionPerCycleCounter
+    return losses, insolvencies, contagions
+
+
+# checkpoints and schedules of a StressTest, loaded once by each worker process
+_stressTest = None
+
+
+def load_stress_test(checkpoints, schedules):
+    global _stressTest
+    _stressTest = (checkpoints, schedules)
+
+
+def run_task(task):
+    # entry point of the worker processes
+    (economy, path, seed_index), number_cycles, seed = task
+    checkpoints, schedules = _stressTest
+    return (economy, path, seed_index), run_stress_path(checkpoints[economy], schedules[path], number_cycles, seed)
+
+
+class StressTest:
+    """
+    Every schedule run on every checkpointed economy, once per seed, over `number_workers` processes (none:
+    in this process).
+    """
+
+    def __init__(self, checkpoints, schedules, number_cycles, seeds=(None,), number_workers=0):
+        self.checkpoints = list(checkpoints)
+        self.schedules = list(schedules)
+        self.numberCycles = number_cycles
+        self.seeds = list(seeds)
+        self.numberWorkers = number_workers
+
+    def tasks(self):
+        runs = itertools.product(range(len(self.checkpoints)), range(len(self.schedules)), range(len(self.seeds)))
+        return [(run, self.numberCycles, self.seeds[run[2]]) for run in runs]
+
+    def run(self):
+        shape = (len(self.checkpoints), len(self.schedules), len(self.seeds), self.numberCycles)
+        losses = np.zeros(shape)
+        insolvencies = np.zeros(shape, dtype=int)
+        contagions = np.zeros(shape, dtype=int)
+
+        if self.numberWorkers > 0:
+            with multiprocessing.Pool(self.numberWorkers, initializer=load_stress_test,
+                                      initargs=(self.checkpoints, self.schedules)) as pool:
+                outcomes = list(pool.imap_unordered(run_task, self.tasks()))
+        else:
+            load_stress_test(self.checkpoints, self.schedules)
+            outcomes = [run_task(task) for task in self.tasks()]
+
+        for run, (run_losses, run_insolvencies, run_contagions) in outcomes:
+            losses[run] = run_losses
+            insolvencies[run] = run_insolvencies
+            contagions[run] = run_contagions
+        names = [schedule.name or str(i) for i, schedule in enumerate(self.schedules)]
+        return StressResult(losses, insolvencies, contagions, names)
+
+
+class StressResult:
+    """
+    Per-cycle losses, insolvencies and contagions of every run, as (economies, schedules, seeds, cycles)
+    arrays.
+    """
+
+    def __init__(self, losses, insolvencies, contagions, schedule_names):
+        self.losses = losses
+        self.insolvencies = insolvencies
+        self.contagions = contagions
+        self.scheduleNames = schedule_names
+
+    def total_losses(self):
+        # cumulative loss of each run, as an (economies, schedules, seeds) array
+        return np.sum(self.losses, axis=-1)
+
+    def loss_distribution(self, quantiles=(0.5, 0.95, 0.99)):
+        # Distribution of the cumulative loss under each schedule, over economies and seeds: mean, quantiles
+        # (value at risk) and expected shortfall beyond the last quantile
+        totals = np.moveaxis(self.total_losses(), 1, 0).reshape(len(self.scheduleNames), -1)
+        values_at_risk = np.quantile(totals, quantiles, axis=1).T
+        tail = totals >= values_at_risk[:, -1:]
+        return {'schedule': self.scheduleNames,
+                'mean': np.mean(totals, axis=1),
+                'quantiles': np.asarray(quantiles),
+                'valueAtRisk': values_at_risk,
+                'expectedShortfall': np.sum(totals * tail, axis=1) / np.sum(tail, axis=1),
+                'insolvencies': np.mean(np.sum(self.insolvencies, axis=-1), axis=(0, 2)),
+                'contagions': np.mean(np.sum(self.contagions, axis=-1), axis=(0, 2))}
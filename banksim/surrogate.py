@@ -0,0 +1,217 @@
+"""
+Surrogate of BankingModel over a box of exogenous factors, for exploring it with few full simulations.
+
+A Gaussian process is fitted, per output, on completed runs: insolvency and contagion rates (per bank and
+cycle) against the exogenous factors they ran under, scaled to the unit box. It predicts both outputs with
+a standard deviation, and picks the next runs where it is most uncertain, or where it is most likely to be
+wrong about which side of a level (a policy frontier, say) a point is on. A round of active learning:
+
+    space = ParameterSpace({'probabilityofWithdrawal': (0.05, 0.5), 'minimumCapitalAdequacyRatio': (-20, 0)})
+    surrogate = Surrogate(space)
+    ...
+    factors = surrogate.suggest(8, output='insolvencyRate', level=0.05)
+    jobs = sweep_jobs(factors, 'Basel', seed=1, number_of_cycles=100)
+    run_local_sweep(root, jobs, number_workers=4)
+    surrogate.add_runs(sweep_outcomes(SweepDirectory(root).store, jobs))
+    surrogate.fit()
+
+Only numpy is needed: the process has an isotropic squared exponential kernel, and its length scale and
+noise are picked by marginal likelihood over a grid, which is enough for the hundreds of runs it is
+meant for.
+"""
+import hashlib
+import json
+
+import numpy as np
+
+OUTPUTS = ('insolvencyRate', 'contagionRate')
+
+
+class ParameterSpace:
+    """
+    A box of exogenous factors, {name: (low, high)}, mapped to and from the unit box.
+    """
+
+    def __init__(self, bounds):
+        self.names = list(bounds)
+        self.low = np.array([bounds[_][0] for _ in self.names], dtype=float)
+        self.high = np.array([bounds[_][1] for _ in self.names], dtype=float)
+
+    def to_unit(self, points):
+        return (np.asarray(points, dtype=float) - self.low) / (self.high - self.low)
+
+    def from_unit(self, points):
+        return self.low + np.asarray(points, dtype=float) * (self.high - self.low)
+
+    def point(self, factors):
+        return np.array([factors[_] for _ in self.names], dtype=float)
+
+    def factors(self, point):
+        return {name: float(value) for name, value in zip(self.names, point)}
+
+    def latin_hypercube(self, number_points, rng):
+        # one point per stratum along every dimension, in the unit box
+        strata = np.argsort(rng.random((len(self.names), number_points)), axis=1).T
+        return (strata + rng.random((number_points, len(self.names)))) / number_points
+
+
+class GaussianProcess:
+
+    def __init__(self, length_scales=(0.05, 0.1, 0.2, 0.5, 1.0, 2.0), noises=(1e-6, 1e-4, 1e-2, 1e-1)):
+        self.lengthScales = length_scales
+        self.noises = noises
+        self.lengthScale = self.noise = None
+        self.X = self.alpha = self.L = None
+        self.mean = 0
+        self.scale = 1
+
+    @staticmethod
+    def kernel(A, B, length_scale):
+        squared_distances = np.sum(A ** 2, axis=1)[:, np.newaxis] + np.sum(B ** 2, axis=1) - 2 * A @ B.T
+        return np.exp(-0.5 * np.maximum(squared_distances, 0) / length_scale ** 2)
+
+    def factorize(self, X, y, length_scale, noise):
+        K = self.kernel(X, X, length_scale) + noise * np.eye(len(X))
+        L = np.linalg.cholesky(K)
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, y))
+        log_likelihood = -0.5 * y @ alpha - np.sum(np.log(np.diag(L)))
+        return L, alpha, log_likelihood
+
+    def fit(self, X, y, keep_hyperparameters=False):
+        # X in the unit box; outputs are standardized, so the signal variance is 1
+        self.X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.mean = np.mean(y)
+        self.scale = np.std(y) if np.std(y) > 0 else 1
+        y = (y - self.mean) / self.scale
+
+        if keep_hyperparameters and self.lengthScale is not None:
+            self.L, self.alpha, _ = self.factorize(self.X, y, self.lengthScale, self.noise)
+            return self
+        best = -np.inf
+        for length_scale in self.lengthScales:
+            for noise in self.noises:
+                try:
+                    L, alpha, log_likelihood = self.factorize(self.X, y, length_scale, noise)
+                except np.linalg.LinAlgError:
+                    continue
+                if log_likelihood > best:
+                    best = log_likelihood
+                    self.lengthScale, self.noise, self.L, self.alpha = length_scale, noise, L, alpha
+        return self
+
+    def predict(self, X):
+        # mean and standard deviation of the (noise-free) output at each point
+        X = np.asarray(X, dtype=float)
+        K_star = self.kernel(X, self.X, self.lengthScale)
+        v = np.linalg.solve(self.L, K_star.T)
+        variance = np.maximum(1 - np.sum(v ** 2, axis=0), 0)
+        return self.mean + self.scale * (K_star @ self.alpha), self.scale * np.sqrt(variance)
+
+
+class Surrogate:
+
+    def __init__(self, space, outputs=OUTPUTS):
+        self.space = space
+        self.outputs = outputs
+        self.points = []
+        self.values = {output: [] for output in outputs}
+        self.processes = {output: GaussianProcess() for output in outputs}
+
+    def add(self, factors, outcomes):
+        # one completed run: the exogenous factors it ran under and its outputs
+        self.points.append(self.space.to_unit(self.space.point(factors)))
+        for output in self.outputs:
+            self.values[output].append(outcomes[output])
+
+    def add_runs(self, runs):
+        for factors, outcomes in runs:
+            self.add(factors, outcomes)
+
+    def fit(self):
+        for output in self.outputs:
+            self.processes[output].fit(np.array(self.points), np.array(self.values[output]))
+        return self
+
+    def predict(self, factors):
+        # {output: (mean, standard deviation)} at each of a list of exogenous factor dicts
+        points = self.space.to_unit([self.space.point(_) for _ in factors])
+        return {output: self.processes[output].predict(points) for output in self.outputs}
+
+    def suggest(self, number_runs=1, output='insolvencyRate', level=None, number_candidates=2000, seed=None):
+        """
+        Exogenous factors of the next runs, among Latin hypercube candidates: those of largest predictive
+        standard deviation or, given a level, those most likely on the wrong side of it (largest
+        1.96 std - |mean - level|). A batch is picked one run at a time, each picked run being added with
+        its predicted mean as outcome, so the next ones go elsewhere.
+        """
+        rng = np.random.default_rng(seed)
+        candidates = self.space.latin_hypercube(number_candidates, rng)
+        process = self.processes[output]
+        X, y = np.array(self.points), np.array(self.values[output])
+        believer = GaussianProcess(process.lengthScales, process.noises)
+        believer.lengthScale, believer.noise = process.lengthScale, process.noise
+        believer.fit(X, y, keep_hyperparameters=True)
+
+        chosen = []
+        for _ in range(number_runs):
+            mean, std = believer.predict(candidates)
+            score = std if level is None else 1.96 * std - np.abs(mean - level)
+            best = int(np.argmax(score))
+            chosen.append(candidates[best])
+            X, y = np.vstack([X, candidates[best]]), np.append(y, mean[best])
+            believer.fit(X, y, keep_hyperparameters=True)
+            candidates = np.delete(candidates, best, axis=0)
+        return [self.space.factors(self.space.from_unit(_)) for _ in chosen]
+
+
+def run_outcomes(insolvencies, contagions, number_banks):
+    # insolvency and contagion rates of a run, per bank and cycle
+    number_cycles = max(len(insolvencies), 1)
+    return {'insolvencyRate': float(np.sum(insolvencies)) / (number_banks * number_cycles),
+            'contagionRate': float(np.sum(contagions)) / (number_banks * number_cycles)}
+
+
+def simulate(factors, simulation_type, number_of_cycles, seed, number_of_banks=None):
+    # One run in this process, from the default exogenous factors, keeping only its counts of insolvencies
+    from banksim.model import BankingModel
+
+    model = BankingModel(simulation_type, dict(factors), number_of_banks, seed=seed)
+    central_bank = model.schedule.central_bank
+    insolvencies = np.zeros(number_of_cycles, dtype=int)
+    contagions = np.zeros(number_of_cycles, dtype=int)
+    for t in range(number_of_cycles):
+        model.step()
+        insolvencies[t] = central_bank.insolvencyPerCycleCounter
+        contagions[t] = central_bank.insolvencyDueToContagionPerCycleCounter
+    return run_outcomes(insolvencies, contagions, len(model.schedule.banks))
+
+
+def sweep_jobs(factors, simulation_type, seed, number_of_cycles, number_of_banks=None, label='surrogate'):
+    # Sweep jobs (see banksim.sweep) of suggested runs, each under a scenario label of its own
+    from banksim.sweep import make_jobs
+
+    jobs = []
+    for point in factors:
+        job = make_jobs([simulation_type], [seed], number_of_cycles, number_of_banks, dict(point))[0]
+        job['scenario'] = '{}-{}'.format(label, hashlib.md5(json.dumps(point, sort_keys=True).encode()).hexdigest()[:12])
+        job['id'] = '{}-{}'.format(job['scenario'], seed)
+        jobs.append(job)
+    return jobs
+
+
+def sweep_outcomes(store, jobs):
+    # (exogenous factors, outcomes) of the completed jobs of a sweep, read from its result store
+    from banksim.exogeneous_factors import ExogenousFactors
+
+    runs = []
+    for job in jobs:
+        filters = [('scenario', '==', job['scenario']), ('seed', '==', job['seed'])]
+        chunks = list(store.scan('cycles', ['insolvencies', 'contagions'], filters))
+        if len(chunks) == 0:
+            continue
+        number_banks = job.get('number_of_banks') or ExogenousFactors.numberBanks
+        runs.append((job['exogenous_factors'],
+                     run_outcomes(np.concatenate([_['insolvencies'] for _ in chunks]),
+                                  np.concatenate([_['contagions'] for _ in chunks]), number_banks)))
+    return runs
@@ -0,0 +1,280 @@
+"""
+Parameter sweeps of BankingModel runs, spread over worker processes on one or several machines.
+
+Coordinator and workers only share a directory (local disk or shared storage):
+
+    sweep.json                          settings of the sweep
+    jobs/<job>.json                     one file per run: scenario, seed, cycles, exogenous factors...
+    queues/<worker>/<seq>.<job>.<try>   per-worker deque of tokens, handed out round-robin
+    running/<job>.<try>.<worker>        lease of a running job, touched while the job is alive
+    done/<job>.json, failed/<job>.json  outcome of each job
+    results/                            per-cycle and per-bank results (see banksim.results)
+
+Every state change is an atomic rename, so no locks are needed. A worker takes the oldest token of its
+own queue and, when it runs dry, steals the newest token of the longest queue. The coordinator requeues
+the jobs whose lease went stale (the worker died) and workers requeue the jobs that raised, until
+`max_attempts` is reached. Workers on other machines are started with
+
+    python -m banksim.sweep worker <root> <worker index>
+"""
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+
+from banksim.results import ResultStore, ResultWriter
+
+
+def make_jobs(simulation_types, seeds, number_of_cycles, number_of_banks=None, exogenous_factors=None,
+              common_random_numbers=None):
+    # One job per (simulation type, seed) pair. Results are partitioned by 'scenario', so jobs of the same
+    # simulation type that change exogenous factors should be given scenario labels of their own.
+    # With a common_random_numbers directory, jobs of the same seed share its exogenous random streams.
+    return [{'id': '{}-{}'.format(simulation_type, seed),
+             'scenario': simulation_type,
+             'simulation_type': simulation_type,
+             'seed': seed,
+             'number_of_cycles': number_of_cycles,
+             'number_of_banks': number_of_banks,
+             'exogenous_factors': exogenous_factors,
+             'common_random_numbers': common_random_numbers}
+            for simulation_type in simulation_types for seed in seeds]
+
+
+def run_job(job, store):
+    from banksim.model import BankingModel
+
+    model = BankingModel(job['simulation_type'], job.get('exogenous_factors'), job.get('number_of_banks'),
+                         seed=job['seed'])
+    if job.get('common_random_numbers') is not None:
+        from banksim.common_random_numbers import CommonRandomNumbers
+        # generated by the first job of the seed, large enough for either kind of corporate client pools
+        number_banks = len(model.schedule.banks)
+        model.use_common_random_numbers(CommonRandomNumbers.generate(
+            os.path.join(job['common_random_numbers'], 'seed={}'.format(job['seed'])), job['seed'],
+            job['number_of_cycles'], model.depositBook.size,
+            2 * number_banks * model.exogenousFactors.numberCorporateClientsPerBank, number_banks))
+    writer = ResultWriter(store, job.get('scenario') or job['simulation_type'], job['seed'])
+    try:
+        for _ in model.iter_cycles(job['number_of_cycles']):
+            writer.record(model)
+        writer.close()
+    finally:
+        model.close()
+
+
+class SweepDirectory:
+
+    def __init__(self, root):
+        self.root = root
+        self.settings = {}
+        settings_file = os.path.join(root, 'sweep.json')
+        if os.path.exists(settings_file):
+            with open(settings_file) as f:
+                self.settings = json.load(f)
+        self.store = ResultStore(os.path.join(root, 'results'))
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def list(self, *parts):
+        try:
+            # dot files are still being written
+            return sorted(_ for _ in os.listdir(self.path(*parts)) if not _.startswith('.'))
+        except FileNotFoundError:
+            return []
+
+    def queues(self):
+        return {worker: self.list('queues', worker) for worker in self.list('queues')}
+
+    def enqueue(self, worker, job_id, attempt, source=None):
+        token = '{:012d}.{}.{}'.format(time.time_ns() // 1000, job_id, attempt)
+        target = self.path('queues', worker, token)
+        if source is None:
+            open(target, 'w').close()
+        else:
+            os.rename(source, target)
+
+    def job(self, job_id):
+        with open(self.path('jobs', job_id + '.json')) as f:
+            return json.load(f)
+
+    def outcomes(self, outcome):
+        outcomes = []
+        for name in self.list(outcome):
+            with open(self.path(outcome, name)) as f:
+                outcomes.append(json.load(f))
+        return outcomes
+
+    def record(self, outcome, job_id, **details):
+        temporary = self.path(outcome, '.{}.json'.format(job_id))
+        with open(temporary, 'w') as f:
+            json.dump(dict(details, id=job_id), f)
+        os.replace(temporary, self.path(outcome, job_id + '.json'))
+
+    def finished(self):
+        return len(self.list('done')) + len(self.list('failed')) >= len(self.list('jobs'))
+
+    def fail_or_requeue(self, job_id, attempt, worker, source, error):
+        if attempt + 1 < self.settings['max_attempts']:
+            self.enqueue(worker, job_id, attempt + 1, source)
+        else:
+            self.record('failed', job_id, attempts=attempt + 1, error=error)
+            os.remove(source)
+
+
+class SweepCoordinator:
+
+    def __init__(self, root, number_workers, max_attempts=3, lease_timeout=60.0, poll_interval=0.5):
+        self.directory = SweepDirectory(root)
+        self.numberWorkers = number_workers
+        self.leaseTimeout = lease_timeout
+        self.pollInterval = poll_interval
+
+        for folder in ('jobs', 'running', 'done', 'failed', 'results'):
+            os.makedirs(self.directory.path(folder), exist_ok=True)
+        for worker in range(number_workers):
+            os.makedirs(self.directory.path('queues', str(worker)), exist_ok=True)
+        self.directory.settings = {'max_attempts': max_attempts, 'lease_timeout': lease_timeout,
+                                   'poll_interval': poll_interval}
+        with open(self.directory.path('sweep.json'), 'w') as f:
+            json.dump(self.directory.settings, f)
+
+    def submit(self, jobs):
+        for i, job in enumerate(jobs):
+            if '.' in job['id']:
+                raise ValueError("Job ids can not contain '.': {}".format(job['id']))
+            with open(self.directory.path('jobs', job['id'] + '.json'), 'w') as f:
+                json.dump(job, f)
+            self.directory.enqueue(str(i % self.numberWorkers), job['id'], 0)
+
+    def requeue_stale_jobs(self):
+        # A lease that is not touched anymore belongs to a dead worker
+        now = time.time()
+        for lease in self.directory.list('running'):
+            source = self.directory.path('running', lease)
+            try:
+                # renaming a token into a lease updates its ctime on most file systems
+                stale = now - max(os.path.getmtime(source), os.path.getctime(source)) > self.leaseTimeout
+            except FileNotFoundError:
+                continue
+            if stale:
+                job_id, attempt, _ = lease.rsplit('.', 2)
+                queues = self.directory.queues()
+                shortest = min(queues, key=lambda worker: len(queues[worker]))
+                try:
+                    self.directory.fail_or_requeue(job_id, int(attempt), shortest, source, 'worker lost')
+                except FileNotFoundError:
+                    pass  # finished meanwhile
+
+    def wait(self, timeout=None):
+        start = time.time()
+        while not self.directory.finished():
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError('sweep not finished after {} seconds'.format(timeout))
+            self.requeue_stale_jobs()
+            time.sleep(self.pollInterval)
+
+    def results(self, table='cycles', columns=None, filters=()):
+        # Results of every completed run, as a pandas DataFrame (see ResultStore.read)
+        return self.directory.store.read(table, columns, filters)
+
+    def summary(self):
+        done, failed = self.directory.outcomes('done'), self.directory.outcomes('failed')
+        return {'done': len(done), 'failed': len(failed),
+                'attempts': sum(_['attempts'] for _ in done + failed),
+                'jobsPerWorker': {worker: sum(_['worker'] == worker for _ in done)
+                                  for worker in self.directory.list('queues')}}
+
+
+class SweepWorker:
+
+    def __init__(self, root, worker):
+        self.directory = SweepDirectory(root)
+        self.worker = str(worker)
+
+    def claim(self):
+        # Oldest token of our own queue first, then the newest one of the longest queue
+        queues = self.directory.queues()
+        candidates = [(self.worker, token) for token in queues.get(self.worker, [])]
+        for victim in sorted(queues, key=lambda worker: -len(queues[worker])):
+            if victim != self.worker:
+                candidates += [(victim, token) for token in reversed(queues[victim])]
+        for queue, token in candidates:
+            _, job_id, attempt = token.split('.')
+            lease = self.directory.path('running', '{}.{}.{}'.format(job_id, attempt, self.worker))
+            try:
+                os.rename(self.directory.path('queues', queue, token), lease)
+            except FileNotFoundError:
+                continue  # taken by someone else
+            if os.path.exists(self.directory.path('done', job_id + '.json')):
+                os.remove(lease)  # requeued while it was finishing
+                continue
+            os.utime(lease)
+            return job_id, int(attempt), lease
+        return None
+
+    def heartbeat(self, lease, stop):
+        while not stop.wait(self.directory.settings['lease_timeout'] / 4):
+            try:
+                os.utime(lease)
+            except FileNotFoundError:
+                return
+
+    def execute(self, job_id, attempt, lease):
+        stop = threading.Event()
+        heart = threading.Thread(target=self.heartbeat, args=(lease, stop), daemon=True)
+        heart.start()
+        start = time.time()
+        try:
+            run_job(self.directory.job(job_id), self.directory.store)
+        except Exception:
+            stop.set()
+            self.directory.fail_or_requeue(job_id, attempt, self.worker, lease, traceback.format_exc())
+            return
+        stop.set()
+        self.directory.record('done', job_id, worker=self.worker, attempts=attempt + 1,
+                              elapsed=time.time() - start)
+        try:
+            os.remove(lease)
+        except FileNotFoundError:
+            pass  # taken for stale by the coordinator meanwhile
+
+    def run(self):
+        while not self.directory.finished():
+            claimed = self.claim()
+            if claimed is None:
+                time.sleep(self.directory.settings['poll_interval'])
+            else:
+                self.execute(*claimed)
+
+
+def run_worker(root, worker):
+    SweepWorker(root, worker).run()
+
+
+def run_local_sweep(root, jobs, number_workers, max_attempts=3, lease_timeout=60.0, timeout=None):
+    # Coordinator plus `number_workers` local worker processes standing in for the nodes
+    coordinator = SweepCoordinator(root, number_workers, max_attempts, lease_timeout)
+    coordinator.submit(jobs)
+    workers = [multiprocessing.Process(target=run_worker, args=(root, i)) for i in range(number_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        coordinator.wait(timeout)
+    finally:
+        for worker in workers:
+            worker.join(timeout=coordinator.pollInterval * 4)
+            if worker.is_alive():
+                worker.terminate()
+    return coordinator
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2], sys.argv[3])
+    else:
+        print('usage: python -m banksim.sweep worker <root> <worker index>')
@@ -0,0 +1,217 @@
+"""
+Full per-agent trajectories of a run, in memory-mapped files.
+
+Each cycle appends one fixed-width record to each file of the trajectory directory:
+
+    cycles.dat   cycle counters and central bank choice
+    banks.dat    balance sheet, liquidity needs and chosen strategy of every bank
+    edges.dat    interbank loans of every cycle, one after the other
+    meta.json    number of banks, of cycles and of interbank loans written
+
+The number of interbank loans varies from cycle to cycle (a bank run cascade may have a borrower draw on
+several lenders), so each cycle record holds the position of its first loan in edges.dat and their number.
+Records are addressed by position, hence any cycle is read in O(1).
+"""
+import json
+import os
+
+import numpy as np
+
+from banksim.agents.bank import BalanceSheet
+from banksim.streaming import CycleSnapshot
+
+CYCLE_RECORD = np.dtype([('cycle', np.int64), ('insolvencies', np.int64), ('contagions', np.int64),
+                         ('firstEdge', np.int64), ('numberEdges', np.int64), ('totalInterbankDebt', np.float64),
+                         ('minimumCapitalAdequacyRatio', np.float64)])
+
+BANK_RECORD = np.dtype([('deposits', np.float64), ('discountWindowLoan', np.float64),
+                        ('interbankLoan', np.float64), ('nonFinancialSectorLoanLowRisk', np.float64),
+                        ('nonFinancialSectorLoanHighRisk', np.float64), ('nonFinancialSectorLoan', np.float64),
+                        ('liquidAssets', np.float64), ('capital', np.float64), ('liquidityNeeds', np.float64),
+                        ('alphaIndex', np.int32), ('betaIndex', np.int32), ('gammaIndex', np.int32),
+                        ('bankRunOccurred', np.bool_)])
+
+ACCOUNTS = BANK_RECORD.names[:7]
+
+EDGE_RECORD = np.dtype([('lender', np.int32), ('borrower', np.int32), ('amount', np.float64)])
+
+# files of one record per cycle
+FILES = (('cycles', CYCLE_RECORD, ()), ('banks', BANK_RECORD, ('numberBanks',)))
+
+
+def record_shape(meta, shape):
+    return tuple(meta[_] for _ in shape)
+
+
+def map_file(path, name, dtype, shape, mode):
+    return np.memmap(os.path.join(path, name + '.dat'), dtype=dtype, mode=mode, shape=shape)
+
+
+class TrajectoryWriter:
+
+    def __init__(self, path, model, initial_capacity=64):
+        if model.bankPopulation is not None:
+            raise ValueError('Trajectories have a fixed number of banks, bank entry and exit must be inactive')
+        self.path = path
+        self.model = model
+        os.makedirs(path, exist_ok=True)
+        self.meta = {'numberBanks': len(model.schedule.banks), 'size': 0, 'capacity': 0,
+                     'edgesSize': 0, 'edgesCapacity': 0,
+                     'monetaryPolicy': self.model.exogenousFactors.isMonetaryPolicyAvailable}
+        self.files = {}
+        self.grow(initial_capacity)
+        self.grow_edges(initial_capacity * max(self.meta['numberBanks'], 1))
+
+    def extend(self, name, dtype, shape):
+        # Files are extended by doubling and mapped again, so appending is amortized O(1)
+        with open(os.path.join(self.path, name + '.dat'), 'ab') as f:
+            f.truncate(dtype.itemsize * int(np.prod(shape, dtype=int)))
+        self.files[name] = map_file(self.path, name, dtype, shape, 'r+')
+
+    def grow(self, capacity):
+        for name, dtype, shape in FILES:
+            self.extend(name, dtype, (capacity,) + record_shape(self.meta, shape))
+        self.meta['capacity'] = capacity
+        self.flush()
+
+    def grow_edges(self, capacity):
+        self.extend('edges', EDGE_RECORD, (capacity,))
+        self.meta['edgesCapacity'] = capacity
+        self.flush()
+
+    def record(self):
+        # Appends the state of the model at the end of the current cycle
+        if self.meta['size'] == self.meta['capacity']:
+            self.grow(2 * self.meta['capacity'])
+        t = self.meta['size']
+        schedule = self.model.schedule
+        central_bank, clearing_house = schedule.central_bank, schedule.clearing_house
+
+        banks = self.files['banks'][t]
+        for bank in schedule.banks:
+            row = banks[bank.bankIndex]
+            sheet = bank.balanceSheet
+            for account in ACCOUNTS:
+                row[account] = getattr(sheet, account)
+            row['capital'] = sheet.capital
+            row['liquidityNeeds'] = bank.liquidityNeeds
+            row['bankRunOccurred'] = bank.bankRunOccurred
+            strategy = getattr(bank, 'currentlyChosenStrategy', None)
+            for index in ('alphaIndex', 'betaIndex', 'gammaIndex'):
+                row[index] = -1 if strategy is None else getattr(strategy, index)
+
+        edges = np.array(clearing_house.interbankEdges, dtype=int).reshape(-1, 2)
+        first_edge = self.meta['edgesSize']
+        end = first_edge + len(edges)
+        if end > self.meta['edgesCapacity']:
+            self.grow_edges(max(2 * self.meta['edgesCapacity'], end))
+        slots = self.files['edges'][first_edge:end]
+        slots['lender'] = edges[:, 0]
+        slots['borrower'] = edges[:, 1]
+        slots['amount'] = clearing_house.interbankLendingMatrix[edges[:, 0], edges[:, 1]]
+        self.meta['edgesSize'] = end
+
+        self.files['cycles'][t] = (schedule.cycle, central_bank.insolvencyPerCycleCounter,
+                                   central_bank.insolvencyDueToContagionPerCycleCounter, first_edge, len(edges),
+                                   clearing_house.totalInterbankDebt, central_bank.minimumCapitalAdequacyRatio)
+        self.meta['size'] = t + 1
+
+    def flush(self):
+        # cycles recorded so far become visible to readers
+        for memmap in self.files.values():
+            memmap.flush()
+        temporary = os.path.join(self.path, '.meta.json')
+        with open(temporary, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(temporary, os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        self.flush()
+        self.files.clear()
+
+
+class TrajectoryReader:
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.numberBanks = self.meta['numberBanks']
+        self.files = {name: map_file(path, name, dtype, (self.meta['capacity'],) + record_shape(self.meta, shape), 'r')
+                      for name, dtype, shape in FILES}
+        self.files['edges'] = map_file(path, 'edges', EDGE_RECORD, (self.meta['edgesCapacity'],), 'r')
+
+    def __len__(self):
+        return self.meta['size']
+
+    def position(self, t):
+        if t < 0:
+            t += len(self)
+        if not 0 <= t < len(self):
+            raise IndexError('cycle {} not in trajectory of {} cycles'.format(t, len(self)))
+        return t
+
+    def cycle(self, t):
+        return self.files['cycles'][self.position(t)]
+
+    def banks(self, t):
+        return self.files['banks'][self.position(t)]
+
+    def edges(self, t):
+        cycle = self.cycle(t)
+        first_edge = cycle['firstEdge']
+        return self.files['edges'][first_edge:first_edge + cycle['numberEdges']]
+
+    def series(self, field, table='cycles'):
+        # a field along the whole trajectory, e.g. series('capital', 'banks') -> (cycles, banks)
+        return self.files[table][:len(self)][field]
+
+    def replay(self, t):
+        return ModelView(self, t)
+
+
+class BankView:
+    # Bank of a replayed cycle, with the attributes analyses usually read from a Bank
+
+    def __init__(self, bank_index, record, is_monetary_policy_available):
+        self.bankIndex = bank_index
+        self.balanceSheet = BalanceSheet(is_monetary_policy_available)
+        for account in ACCOUNTS:
+            setattr(self.balanceSheet, account, float(record[account]))
+        self.capital = float(record['capital'])
+        self.liquidityNeeds = float(record['liquidityNeeds'])
+        self.bankRunOccurred = bool(record['bankRunOccurred'])
+        self.strategyIndices = tuple(int(record[_]) for _ in ('alphaIndex', 'betaIndex', 'gammaIndex'))
+
+    def is_solvent(self):
+        return self.capital <= 0
+
+    def is_insolvent(self):
+        return self.capital > 0
+
+
+class ModelView:
+    """
+    Read-only view of a BankingModel at the end of cycle t of a trajectory, rebuilt without simulating.
+    """
+
+    def __init__(self, reader, t):
+        self.cycle = reader.cycle(t)
+        self.edges = reader.edges(t)
+        self.isMonetaryPolicyAvailable = reader.meta['monetaryPolicy']
+        self.banks = [BankView(i, record, self.isMonetaryPolicyAvailable) for i, record in enumerate(reader.banks(t))]
+        self.interbankLendingMatrix = np.zeros((reader.numberBanks, reader.numberBanks))
+        self.interbankLendingMatrix[self.edges['lender'], self.edges['borrower']] = self.edges['amount']
+        self.interbankLendingMatrix[self.edges['borrower'], self.edges['lender']] = -self.edges['amount']
+
+    def snapshot(self):
+        balance_sheets = [bank.balanceSheet for bank in self.banks]
+        if self.isMonetaryPolicyAvailable:
+            total_loans = sum(_.nonFinancialSectorLoanLowRisk + _.nonFinancialSectorLoanHighRisk for _ in balance_sheets)
+        else:
+            total_loans = sum(_.nonFinancialSectorLoan for _ in balance_sheets)
+        return CycleSnapshot(cycle=int(self.cycle['cycle']),
+                             insolvencies=int(self.cycle['insolvencies']),
+                             contagions=int(self.cycle['contagions']),
+                             totalLoans=total_loans,
+                             totalInterbankDebt=float(self.cycle['totalInterbankDebt']),
+                             interbankLendingMatrix=self.interbankLendingMatrix)
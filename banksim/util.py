@@ -1,18 +1,80 @@
+import math
+
 import numpy as np
 
 
-class Util:
-    id = 0
+class RandomStream:
+    """
+    Random numbers of one model: a numpy Generator of its own, so that models living in the same process
+    never draw from each other's stream.
+
+    Draws are served from blocks drawn in bulk from the generator: a numpy call costs microseconds, taking
+    the next value of a block a few tens of nanoseconds. Scalar and sized draws take the next values of the
+    same blocks, so drawing n values at once gives the same numbers as n scalar draws. The stream pickles
+    along with the model, blocks included, so a checkpointed model goes on drawing the same numbers.
+    """
+
+    bufferSize = 4096
+
+    def __init__(self, seed=None):
+        self.seed(seed)
+
+    def seed(self, seed):
+        self.generator = np.random.default_rng(seed)
+        # The current block of uniforms and the cursor at the next value to take. Scalar draws read the
+        # block as a list, built the first time one of them reaches it (Python floats are faster to take
+        # one by one than numpy scalars).
+        self.uniformBlock = np.zeros(0)
+        self.uniformList = None
+        self.uniformPosition = 0
+        self.normalList = []
+        self.normalPosition = 0
+
+    def get_random_uniform(self, max_size, size=None):
+        if size is not None:
+            return max_size * self.next_uniforms(size)
+        if self.uniformPosition == len(self.uniformBlock):
+            self.fill_uniforms()
+        if self.uniformList is None:
+            self.uniformList = self.uniformBlock.tolist()
+        uniform = self.uniformList[self.uniformPosition]
+        self.uniformPosition += 1
+        return max_size * uniform
 
-    @staticmethod
-    def get_random_uniform(max_size):
-        return np.random.uniform(0, max_size)
+    def fill_uniforms(self):
+        self.uniformBlock = self.generator.random(self.bufferSize)
+        self.uniformList = None
+        self.uniformPosition = 0
 
-    @staticmethod
-    def get_random_log_normal(mean, standard_deviation):
-        return np.random.lognormal(mean, standard_deviation)
+    def next_uniforms(self, size):
+        # The next values of the blocks, as scalar draws would take them. Past the current block, the rest is
+        # taken from a new block or, when it would not fit in one, drawn straight into the result in one call:
+        # the generator gives the same values however its stream is split into calls.
+        number = size if isinstance(size, int) else int(np.prod(size))
+        start = self.uniformPosition
+        remaining = len(self.uniformBlock) - start
+        if number <= remaining:
+            uniforms = self.uniformBlock[start:start + number]
+            self.uniformPosition += number
+        else:
+            uniforms = np.empty(number)
+            uniforms[:remaining] = self.uniformBlock[start:]
+            rest = number - remaining
+            if rest < self.bufferSize:
+                self.fill_uniforms()
+                uniforms[remaining:] = self.uniformBlock[:rest]
+                self.uniformPosition = rest
+            else:
+                self.generator.random(out=uniforms[remaining:])
+                self.uniformBlock = np.zeros(0)
+                self.uniformList = None
+                self.uniformPosition = 0
+        return uniforms if isinstance(size, int) else uniforms.reshape(size)
 
-    @classmethod
-    def get_unique_id(cls):
-        cls.id += 1
-        return cls.id
+    def get_random_log_normal(self, mean, standard_deviation):
+        if self.normalPosition == len(self.normalList):
+            self.normalList = self.generator.standard_normal(self.bufferSize).tolist()
+            self.normalPosition = 0
+        normal = self.normalList[self.normalPosition]
+        self.normalPosition += 1
+        return math.exp(mean + standard_deviation * normal)
@@ -0,0 +1,55 @@
+"""
+Import-time budget of the BankSim core, as paid by every sweep worker process.
+
+Each sample imports a module in a fresh interpreter. The cost of banksim itself is the time to import
+banksim.model minus the time to import numpy, its only required dependency; optional dependencies must
+not be loaded by the import at all. Exits with status 1 when the budget is exceeded.
+
+    python examples/StartupBenchmark/startup.py [--samples 20] [--budget-ms 50]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+OPTIONAL_DEPENDENCIES = ('mesa', 'numba', 'pandas', 'pyarrow', 'networkx', 'asyncio', 'multiprocessing')
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ' '.join(sorted({{_.split('.')[0] for _ in sys.modules}} & set({optional!r}))))
+"""
+
+
+def measure(module):
+    output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, optional=OPTIONAL_DEPENDENCIES)],
+                            check=True, capture_output=True, text=True).stdout.split()
+    return float(output[0]), output[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--budget-ms', type=float, default=50.)
+    args = parser.parse_args()
+
+    numpy_times = [measure('numpy')[0] for _ in range(args.samples)]
+    banksim_samples = [measure('banksim.model') for _ in range(args.samples)]
+    banksim_times = [_[0] for _ in banksim_samples]
+    loaded = sorted(set().union(*(_[1] for _ in banksim_samples)))
+
+    numpy_ms = 1000 * statistics.median(numpy_times)
+    banksim_ms = 1000 * statistics.median(banksim_times)
+    overhead_ms = banksim_ms - numpy_ms
+    print('import numpy          {:8.1f} ms (median of {})'.format(numpy_ms, args.samples))
+    print('import banksim.model  {:8.1f} ms'.format(banksim_ms))
+    print('banksim overhead      {:8.1f} ms, budget {:.1f} ms'.format(overhead_ms, args.budget_ms))
+    if loaded:
+        print('optional dependencies loaded at import: {}'.format(', '.join(loaded)))
+    return 0 if overhead_ms <= args.budget_ms and not loaded else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
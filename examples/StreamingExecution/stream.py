@@ -0,0 +1,14 @@
+import asyncio
+
+from banksim.model import BankingModel
+
+
+async def print_insolvencies(model, number_cycles):
+    # the model keeps running on a worker thread while snapshots are consumed here
+    async with model.astream(number_cycles) as stream:
+        async for snapshot in stream:
+            print('Cycle {}: {} insolvencies, {} due to contagion, total loans {:.2f}'.format(
+                snapshot.cycle, snapshot.insolvencies, snapshot.contagions, snapshot.totalLoans))
+
+
+asyncio.run(print_insolvencies(BankingModel(simulation_type='ClearingHouse'), 100))